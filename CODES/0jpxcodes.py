@@ -1,11 +1,9 @@
 import pandas as pd
 path = r"C:\Users\100ca\Downloads\data_j.xls"
-import chardet
+from textencoding import detect_encoding
 
-with open(path, 'rb') as file:
-    raw_data = file.read()
-    result = chardet.detect(raw_data)
-    encoding = result['encoding']
+# ファイル全体ではなく先頭のサンプルだけで判定する
+encoding = detect_encoding(path)
 
 print(f"Detected encoding: {encoding}")
 
@@ -1,35 +1,58 @@
 import pandas as pd
+import numpy as np
 import os
 from datetime import datetime
 import logging
+from fxrates import load_fx_rates
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class WiseDataCleaner:
-    def __init__(self, input_file: str, output_folder: str):
+    # 通貨ペアの順序を定義（基準通貨が先）
+    CURRENCY_PAIRS = {
+        ('EUR', 'JPY'): 'EURJPY=X',
+        ('USD', 'JPY'): 'USDJPY=X',
+        ('EUR', 'USD'): 'EURUSD=X',
+        ('JPY', 'EUR'): 'EURJPY=X',  # 逆順の場合も同じコードを使用
+        ('JPY', 'USD'): 'USDJPY=X',  # 逆順の場合も同じコードを使用
+        ('USD', 'EUR'): 'EURUSD=X',  # 逆順の場合も同じコードを使用
+    }
+
+    BASE_COLUMNS = ['trade_date', 'security_code', 'from_currency', 'to_currency', 'from_amount', 'to_amount',
+                    'exchange_rate', 'transaction_type', 'amount_jpy']
+    PAIR_COLUMNS = ['EURJPY=X', 'USDJPY=X', 'EURUSD=X']
+
+    def __init__(self, input_file: str, output_folder: str, id_column: str = 'ID', fx_rates=None):
         self.input_file = input_file
         self.output_folder = output_folder
+        # Optional FxRates used for transfers without a JPY leg (e.g. EUR -> USD)
+        self.fx_rates = fx_rates
+        # Transfer ID column of the export, the key of the incremental store
+        self.id_column = id_column
+        # Incremental store; no date in the name so the integrator always reads the latest one
+        self.store_file = os.path.join(output_folder, 'cleaned_wise_data.csv')
+        # IDs of completed transfers that were cleaned but had no JPY amount for a reason other than a
+        # missing FX rate (e.g. an unparseable amount), so they are not retried daily
+        self.rejected_file = os.path.join(output_folder, 'cleaned_wise_data_rejected_ids.csv')
 
     def read_data(self) -> pd.DataFrame:
         logger.info(f"Reading data from {self.input_file}")
         df = pd.read_csv(self.input_file)
-        df = df[df['ステータス'] == 'COMPLETED'][df['送金の種類'] == 'NEUTRAL']
+        df = df[(df['ステータス'] == 'COMPLETED') & (df['送金の種類'] == 'NEUTRAL')]
         return df
 
     def generate_security_code(self, from_currency: str, to_currency: str) -> str:
-        # 通貨ペアの順序を定義（基準通貨が先）
-        currency_pairs = {
-            ('EUR', 'JPY'): 'EURJPY=X',
-            ('USD', 'JPY'): 'USDJPY=X',
-            ('EUR', 'USD'): 'EURUSD=X',
-            ('JPY', 'EUR'): 'EURJPY=X',  # 逆順の場合も同じコードを使用
-            ('JPY', 'USD'): 'USDJPY=X',  # 逆順の場合も同じコードを使用
-            ('USD', 'EUR'): 'EURUSD=X',  # 逆順の場合も同じコードを使用
-        }
         pair = (from_currency, to_currency)
-        return currency_pairs.get(pair, f"{from_currency}{to_currency}=X")
+        return self.CURRENCY_PAIRS.get(pair, f"{from_currency}{to_currency}=X")
+
+    def pair_table(self, df: pd.DataFrame) -> pd.DataFrame:
+        # One row per distinct (from, to) in the data, so the code is generated once per pair
+        pairs = df[['from_currency', 'to_currency']].drop_duplicates()
+        pairs['security_code'] = [self.generate_security_code(f, t)
+                                  for f, t in zip(pairs['from_currency'], pairs['to_currency'])]
+        return pairs
 
     def clean_data(self, df: pd.DataFrame) -> pd.DataFrame:
         logger.info("Cleaning and processing data")
@@ -50,42 +73,54 @@ class WiseDataCleaner:
         df['from_amount'] = pd.to_numeric(df['from_amount'], errors='coerce')
         df['to_amount'] = pd.to_numeric(df['to_amount'], errors='coerce')
 
+        # Generate security code by joining the pair table on (from, to); the left join keeps row order
+        security_code = df[['from_currency', 'to_currency']].merge(
+            self.pair_table(df), on=['from_currency', 'to_currency'], how='left')['security_code']
+        security_code.index = df.index
+
         # Create currency pair columns
-        currency_pairs = ['EURJPY=X', 'USDJPY=X', 'EURUSD=X']
-        for pair in currency_pairs:
-            from_curr, to_curr = pair[:3], pair[3:6]
-            df[pair] = df.apply(
-                lambda row: row['exchange_rate'] if self.generate_security_code(row['from_currency'], row['to_currency']) == pair else None, 
-                axis=1
-            )
+        for pair in self.PAIR_COLUMNS:
+            df[pair] = df['exchange_rate'].where(security_code == pair)
 
         # Create transaction type column
-        df['transaction_type'] = df.apply(lambda row: 'Buy' if row['to_currency'] in ['USD', 'EUR'] else 'Sell', axis=1)
+        df['transaction_type'] = np.where(df['to_currency'].isin(['USD', 'EUR']), 'Buy', 'Sell')
 
-        # Generate security code
-        df['security_code'] = df.apply(lambda row: self.generate_security_code(row['from_currency'], row['to_currency']), axis=1)
+        df['security_code'] = security_code
 
         # Calculate amount in JPY
-        df['amount_jpy'] = df.apply(self.calculate_jpy_amount, axis=1)
+        df['amount_jpy'] = self.calculate_jpy_amount(df)
 
         logger.info(f"Columns after cleaning: {df.columns.tolist()}")
 
         return df
 
-    def calculate_jpy_amount(self, row):
-        if row['to_currency'] == 'JPY':
-            return row['to_amount']
-        elif row['from_currency'] == 'JPY':
-            return row['from_amount']
-        elif row['security_code'] == 'USDJPY=X':
-            return row['to_amount'] * row['USDJPY=X'] if pd.notnull(row['USDJPY=X']) else None
-        elif row['security_code'] == 'EURJPY=X':
-            return row['to_amount'] * row['EURJPY=X'] if pd.notnull(row['EURJPY=X']) else None
-        else:
-            logger.warning(f"Unable to calculate JPY amount for row: {row}")
-            return None
-
-    def save_data(self, df: pd.DataFrame):
+    def calculate_jpy_amount(self, df: pd.DataFrame) -> pd.Series:
+        # Conditions are checked in order, the first match wins
+        conditions = [
+            df['to_currency'] == 'JPY',
+            df['from_currency'] == 'JPY',
+            df['security_code'] == 'USDJPY=X',
+            df['security_code'] == 'EURJPY=X',
+        ]
+        choices = [
+            df['to_amount'],
+            df['from_amount'],
+            df['to_amount'] * df['USDJPY=X'],
+            df['to_amount'] * df['EURJPY=X'],
+        ]
+        amount = np.select(conditions, [c.to_numpy(dtype=float) for c in choices], default=np.nan)
+        unmatched = ~np.logical_or.reduce(conditions)
+        if self.fx_rates is not None and unmatched.any():
+            # No JPY leg: value the sent amount at the as-of rate of the transfer date
+            rate = self.fx_rates.rate_to(df.loc[unmatched, 'from_currency'], df.loc[unmatched, 'trade_date'])
+            amount[unmatched] = df.loc[unmatched, 'from_amount'].to_numpy(dtype=float) * rate
+            unmatched &= np.isnan(amount)
+        if unmatched.any():
+            logger.warning(f"Unable to calculate JPY amount for {unmatched.sum()} rows: "
+                           f"{df.loc[unmatched, 'security_code'].value_counts().to_dict()}")
+        return pd.Series(amount, index=df.index)
+
+    def select_columns(self, df: pd.DataFrame) -> pd.DataFrame:
         # Filter out rows where amount_jpy is NA
         df = df.dropna(subset=['amount_jpy'])
 
@@ -93,12 +128,11 @@ class WiseDataCleaner:
         df = df.dropna(how='all', axis=1)
 
         # Select and reorder columns
-        base_columns = ['trade_date', 'security_code', 'from_currency', 'to_currency', 'from_amount', 'to_amount', 
-                        'exchange_rate', 'transaction_type', 'amount_jpy']
-        extra_columns = [col for col in df.columns if col not in base_columns]
-        columns = base_columns + extra_columns
+        extra_columns = [col for col in df.columns if col not in self.BASE_COLUMNS]
+        return df[self.BASE_COLUMNS + extra_columns]
 
-        df = df[columns]
+    def save_data(self, df: pd.DataFrame):
+        df = self.select_columns(df)
 
         output_file = os.path.join(self.output_folder, f"cleaned_wise_data_{datetime.now().strftime('%Y%m%d')}.csv")
         df.to_csv(output_file, index=False, encoding='utf-8')
@@ -111,6 +145,57 @@ class WiseDataCleaner:
         final_df = self.save_data(cleaned_df)
         self.log_data_summary(final_df)
 
+    def read_ids(self, path: str) -> set:
+        if not os.path.exists(path):
+            return set()
+        return set(pd.read_csv(path, usecols=[self.id_column], dtype=str)[self.id_column])
+
+    def needs_fx_rate(self, from_currency: pd.Series, to_currency: pd.Series) -> pd.Series:
+        # Without a JPY leg the JPY amount depends on FxRates, which may cover the date on a later run
+        # (the sent amount is valued at the from_currency rate, see calculate_jpy_amount)
+        return from_currency.notna() & (from_currency != 'JPY') & (to_currency != 'JPY')
+
+    def append_csv(self, df: pd.DataFrame, path: str):
+        df.to_csv(path, mode='a', header=not os.path.exists(path), index=False, encoding='utf-8')
+
+    def process_incremental(self):
+        """Clean only transfers whose ID is not in the store yet and append them to it.
+
+        Re-running on the same or an overlapping export is a no-op for the
+        transfers already stored. The store has fixed columns (base columns,
+        pair rates and the ID) so that appends always line up.
+        Transfers without a JPY leg that no FX rate covers yet are not recorded
+        as rejected; they are cleaned again on the next run.
+        """
+        df = self.read_data()
+        if self.id_column not in df.columns:
+            raise ValueError(f"Transfer ID column {self.id_column!r} not found in {self.input_file}")
+        ids = df[self.id_column].astype(str)
+        rejected_ids = self.read_ids(self.rejected_file)
+        # Older stores also recorded transfers rejected for a missing FX rate; retry those
+        retry = ids.isin(rejected_ids) & self.needs_fx_rate(df['送金元通貨.1'], df['受取通貨'])
+        seen = ids.isin(self.read_ids(self.store_file)) | (ids.isin(rejected_ids) & ~retry)
+        new = df[~seen].drop_duplicates(subset=self.id_column, keep='last')
+        logger.info(f"{len(new)} new transfers out of {len(df)} in the export")
+        if new.empty:
+            return
+
+        cleaned_df = self.clean_data(new)
+        stored = cleaned_df.dropna(subset=['amount_jpy'])
+        self.append_csv(stored.reindex(columns=self.BASE_COLUMNS + self.PAIR_COLUMNS + [self.id_column]),
+                        self.store_file)
+        missing = cleaned_df['amount_jpy'].isna()
+        waiting_fx = missing & self.needs_fx_rate(cleaned_df['from_currency'], cleaned_df['to_currency'])
+        # Only rejections that no FX update can fix are recorded; the others are retried next run
+        rejected = cleaned_df.loc[missing & ~waiting_fx, [self.id_column]]
+        rejected = rejected[~rejected[self.id_column].astype(str).isin(rejected_ids)]
+        if not rejected.empty:
+            self.append_csv(rejected, self.rejected_file)
+        logger.info(f"Appended {len(stored)} transfers to {self.store_file} ({len(rejected)} rejected, "
+                    f"{int(waiting_fx.sum())} waiting for an FX rate)")
+        if not stored.empty:
+            self.log_data_summary(stored)
+
     def log_data_summary(self, df: pd.DataFrame):
         logger.info("\nData Summary:")
         logger.info(f"Total rows: {len(df)}")
@@ -131,8 +216,14 @@ def main():
     input_file = os.path.join(base_path, "RAWDATA", "wise", "wizefx.csv")
     output_folder = os.path.join(base_path, "RAWDATA","wise")
     
-    cleaner = WiseDataCleaner(input_file, output_folder)
-    cleaner.process()
+    try:
+        fx_rates = load_fx_rates(os.path.join(base_path, "DIC", "forex_data"))
+    except FileNotFoundError:
+        logger.warning("forex_data not found, transfers without a JPY leg are skipped")
+        fx_rates = None
+
+    cleaner = WiseDataCleaner(input_file, output_folder, fx_rates=fx_rates)
+    cleaner.process_incremental()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,16 +1,15 @@
 import pandas as pd
 import matplotlib.pyplot as plt
-import yfinance as yf
-from datetime import datetime
+from pricestore import default_store
 
-# Load the data
-df = pd.read_csv(r'C:\Users\100ca\Documents\PyCode\TRADEHISTORY\RAWDATA\wise\cleaned_wise_data_20240921.csv', parse_dates=['trade_date'])
+# Load the data (incremental store written by 0wise.py)
+df = pd.read_csv(r'C:\Users\100ca\Documents\PyCode\TRADEHISTORY\RAWDATA\wise\cleaned_wise_data.csv', parse_dates=['trade_date'])
 
 # Filter for EURJPY=X transactions
 eurjpy = df[df['security_code'] == 'EURJPY=X']
 
-# Download historical data from Yahoo Finance
-eurjpy_yf = yf.download('EURJPY=X', start='2024-01-01', end=datetime.today())
+# Yahoo Finance history through the local price store (only missing days are downloaded)
+eurjpy_yf = default_store().get(['EURJPY=X'], start='2024-01-01').rename(columns={'EURJPY=X': 'Close'})
 
 # Create the plot
 plt.figure(figsize=(12, 6))
@@ -1,100 +1,32 @@
 import pandas as pd
 import os
+import time
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from dateparse import LOCAL_TZ, parse_date_column
+from ingestcache import ShardCache
+from brokerformats import read_broker_csv, iter_broker_csv
+from extsort import ExternalSorter
+from artifacts import save_artifact, ArtifactWriter
+from dedup import deduplicate_trades, save_reports, StreamingDeduplicator
 
-def standardize_date(date_str):
-    if pd.isna(date_str):
-        return None
-    date_formats = ['%Y/%m/%d', '%Y年%m月%d日', '%Y-%m-%d']
-    for fmt in date_formats:
-        try:
-            return datetime.strptime(date_str, fmt).strftime('%Y-%m-%d')
-        except ValueError:
-            continue
-    return date_str  # 変換できない場合は元の文字列を返す
+# process_csv の出力が変わったら上げる（キャッシュ済みシャードを作り直す）
+PARSER_VERSION = 1
+
+columns_to_select = ['trade_date', 'settlement_date', 'security_code', 'security_name', 
+                     'transaction_type', 'quantity', 'price', 'settlement_amount', 
+                     'currency', 'account_type', 'data_source']
 
-def process_csv(file_path):
+def process_csv(file_path, transcode_dir=None):
     file_name = os.path.basename(file_path)
-    
-    if 'INVST' in file_name:
-        df = pd.read_csv(file_path, encoding='shift-jis')
-        df = df.rename(columns={
-            '約定日': 'trade_date',
-            '受渡日': 'settlement_date',
-            'ファンド名': 'security_name',
-            '取引': 'transaction_type',
-            '数量［口］': 'quantity',
-            '単価': 'price',
-            '受渡金額/(ポイント利用)[円]': 'settlement_amount',
-            '決済通貨': 'currency',
-            '口座': 'account_type'
-        })
-        df['security_code'] = ''
-    elif 'JP' in file_name:
-        df = pd.read_csv(file_path, encoding='shift-jis')
-        df = df.rename(columns={
-            '約定日': 'trade_date',
-            '受渡日': 'settlement_date',
-            '銘柄コード': 'security_code',
-            '銘柄名': 'security_name',
-            '売買区分': 'transaction_type',
-            '数量［株］': 'quantity',
-            '単価［円］': 'price',
-            '受渡金額［円］': 'settlement_amount',
-            '口座区分': 'account_type'
-        })
-        df['currency'] = 'JPY'
-    elif 'US' in file_name:
-        df = pd.read_csv(file_path, encoding='shift-jis')
-        df = df.rename(columns={
-            '約定日': 'trade_date',
-            '受渡日': 'settlement_date',
-            'ティッカー': 'security_code',
-            '銘柄名': 'security_name',
-            '売買区分': 'transaction_type',
-            '数量［株］': 'quantity',
-            '単価［USドル］': 'price',
-            '受渡金額［円］': 'settlement_amount',
-            '口座': 'account_type'
-        })
-        df['currency'] = 'USD'
-    elif 'SaveFile' in file_name:
-        df = pd.read_csv(file_path, encoding='shift-jis', skiprows=8)
-        df = df.rename(columns={
-            '約定日': 'trade_date',
-            '受渡日': 'settlement_date',
-            '銘柄コード': 'security_code',
-            '銘柄': 'security_name',
-            '取引': 'transaction_type',
-            '約定数量': 'quantity',
-            '約定単価': 'price',
-            '受渡金額/決済損益': 'settlement_amount',
-            '預り': 'account_type'
-        })
-        df['currency'] = 'JPY'
-    elif 'yakujo' in file_name:
-        df = pd.read_csv(file_path, encoding='shift-jis', skiprows=2)
-        df = df.rename(columns={
-            '国内約定日': 'trade_date',
-            '国内受渡日': 'settlement_date',
-            '銘柄名': 'security_name',
-            '取引': 'transaction_type',
-            '約定数量': 'quantity',
-            '約定単価': 'price',
-            '受渡金額': 'settlement_amount',
-            '通貨': 'currency',
-            '預り区分': 'account_type'
-        })
-        df['security_code'] = df['security_name'].str.extract(r'(\w+) / ')
-    else:
-        raise ValueError(f"Unknown file format: {file_name}")
+    # ファイル先頭のヘッダーからフォーマットと開始行を判定する
+    fmt, df = read_broker_csv(file_path, transcode_dir=transcode_dir)
+    return select_columns(df, file_name)
 
+def select_columns(df, file_name):
     df['data_source'] = file_name
     
-    columns_to_select = ['trade_date', 'settlement_date', 'security_code', 'security_name', 
-                         'transaction_type', 'quantity', 'price', 'settlement_amount', 
-                         'currency', 'account_type', 'data_source']
-    
     for col in columns_to_select:
         if col not in df.columns:
             df[col] = None
@@ -115,45 +47,127 @@ def standardize_transaction_type(transaction_type):
     else:
         return original_type
 
-def integrate_csv_files(folder_paths):
-    all_data = []
-    
+def process_csv_timed(file_path, transcode_dir=None):
+    # 子プロセスでも例外を親に返せるように (df, 秒数, エラー) を返す
+    start = time.perf_counter()
+    try:
+        return process_csv(file_path, transcode_dir), time.perf_counter() - start, None
+    except Exception as e:
+        return None, time.perf_counter() - start, str(e)
+
+def list_csv_files(folder_paths):
+    file_paths = []
     for folder_path in folder_paths:
         for root, dirs, files in os.walk(folder_path):
-            for file in files:
+            dirs.sort()
+            for file in sorted(files):
                 if file.endswith('.csv'):
-                    file_path = os.path.join(root, file)
-                    print(f"Processing {file_path}...")
-                    try:
-                        df = process_csv(file_path)
-                        all_data.append(df)
-                    except Exception as e:
-                        print(f"Error processing {file_path}: {str(e)}")
+                    file_paths.append(os.path.join(root, file))
+    return file_paths
+
+def parse_csv_files(file_paths, workers=None, transcode_dir=None):
+    parse = partial(process_csv_timed, transcode_dir=transcode_dir)
+    # workers > 1 でファイルごとに並列処理（出力順は直列実行と同じ）
+    if workers and workers > 1 and len(file_paths) > 1:
+        print(f"Processing {len(file_paths)} files with {workers} workers...")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(parse, file_paths))
+    else:
+        results = map(parse, file_paths)
+
+    parsed = {}
+    for file_path, (df, elapsed, error) in zip(file_paths, results):
+        if error is not None:
+            print(f"Error processing {file_path}: {error}")
+            continue
+        print(f"Processed {file_path}: {len(df)} rows in {elapsed:.2f}s")
+        parsed[file_path] = df
+    return parsed
+
+def integrate_csv_files(folder_paths, workers=None, cache_dir=None, transcode_dir=None):
+    file_paths = list_csv_files(folder_paths)
+
+    # cache_dir を指定すると、新規・変更ファイルだけを解析してキャッシュ済みシャードと結合する
+    if cache_dir:
+        cache = ShardCache(cache_dir, version=PARSER_VERSION)
+        cache.prune(file_paths)
+        stale = set(cache.stale_files(file_paths))
+        print(f"Incremental run: {len(stale)} new or changed files, {len(file_paths) - len(stale)} cached")
+        parsed = parse_csv_files([p for p in file_paths if p in stale], workers, transcode_dir)
+        for file_path, df in parsed.items():
+            cache.store(file_path, df)
+        cache.save()
+        all_data = cache.load(file_paths)
+    else:
+        parsed = parse_csv_files(file_paths, workers, transcode_dir)
+        all_data = [parsed[p] for p in file_paths if p in parsed]
     
     combined_df = pd.concat(all_data, ignore_index=True)
     
-    combined_df['trade_date'] = combined_df['trade_date'].apply(standardize_date)
-    combined_df['settlement_date'] = combined_df['settlement_date'].apply(standardize_date)
+    combined_df['trade_date'] = parse_date_column(combined_df['trade_date'], tz=LOCAL_TZ)
+    combined_df['settlement_date'] = parse_date_column(combined_df['settlement_date'], tz=LOCAL_TZ)
     
     combined_df['transaction_type'] = combined_df['transaction_type'].apply(standardize_transaction_type)
     
-    combined_df = combined_df.sort_values('trade_date')
+    # 期間が重なるエクスポートに同じ取引が入っているので重複を落とす（レポートは重複があるときだけ出力）
+    output_file = output_path()
+    combined_df, overlap, near = deduplicate_trades(combined_df)
+    save_reports(overlap, near, os.path.dirname(output_file))
+    
+    combined_df = combined_df.sort_values('trade_date', kind='stable')
     
-    output_file = fr"C:\Users\100ca\Documents\PyCode\TRADEHISTORY\integrated_trade_history_{datetime.now().strftime('%Y%m%d')}.csv"
-    combined_df.to_csv(output_file, index=False, encoding='utf-8')
-    print(f"Integrated CSV file saved as: {output_file}")
+    # 型付きの parquet と確認用の CSV を保存
+    combined_df = save_artifact(combined_df, os.path.splitext(output_file)[0])
+    print(f"Integrated file saved as: {os.path.splitext(output_file)[0]}")
     
     print("\nRows per data source:")
     print(combined_df['data_source'].value_counts())
 
+def output_path():
+    return fr"C:\Users\100ca\Documents\PyCode\TRADEHISTORY\integrated_trade_history_{datetime.now().strftime('%Y%m%d')}.csv"
+
+def stream_csv_files(folder_paths, output_file, chunksize=50_000, run_rows=500_000, transcode_dir=None):
+    # メモリに載らない履歴用: チャンクごとに正規化してソート済みランをディスクに書き、k-way マージで出力する
+    sorter = ExternalSorter('trade_date', columns_to_select, run_rows=run_rows)
+    try:
+        for file_path in list_csv_files(folder_paths):
+            file_name = os.path.basename(file_path)
+            start = time.perf_counter()
+            rows = 0
+            try:
+                for fmt, chunk in iter_broker_csv(file_path, chunksize, transcode_dir=transcode_dir):
+                    chunk = select_columns(chunk, file_name)
+                    chunk['trade_date'] = parse_date_column(chunk['trade_date'], tz=LOCAL_TZ)
+                    chunk['settlement_date'] = parse_date_column(chunk['settlement_date'], tz=LOCAL_TZ)
+                    chunk['transaction_type'] = chunk['transaction_type'].apply(standardize_transaction_type)
+                    sorter.add(chunk)
+                    rows += len(chunk)
+            except Exception as e:
+                print(f"Error processing {file_path}: {str(e)}")
+                continue
+            print(f"Streamed {file_path}: {rows} rows in {time.perf_counter() - start:.2f}s")
+        # マージ結果は日付順なので、取引日ごとに重複を落としながら parquet と CSV に書く
+        dedup = StreamingDeduplicator()
+        with ArtifactWriter(os.path.splitext(output_file)[0], columns_to_select) as writer:
+            for frame in sorter.merge():
+                writer.write(dedup.feed(frame))
+            writer.write(dedup.flush())
+        save_reports(*dedup.reports(), os.path.dirname(output_file))
+    finally:
+        sorter.cleanup()
+    print(f"Integrated file saved as: {os.path.splitext(output_file)[0]} ({writer.rows} rows)")
+
 # フォルダパスを指定
 folder_paths = [
     r"C:\Users\100ca\Documents\PyCode\TRADEHISTORY\RAWDATA\rakuten",
     r"C:\Users\100ca\Documents\PyCode\TRADEHISTORY\RAWDATA\sbi"
 ]
+cache_dir = r"C:\Users\100ca\Documents\PyCode\TRADEHISTORY\CACHE\ingest_concat"
+transcode_dir = r"C:\Users\100ca\Documents\PyCode\TRADEHISTORY\CACHE\utf8"
 
 # CSVファイルを統合して出力
-integrate_csv_files(folder_paths)
+if __name__ == "__main__":
+    integrate_csv_files(folder_paths, workers=os.cpu_count(), cache_dir=cache_dir, transcode_dir=transcode_dir)
 
 
 
@@ -1,146 +1,231 @@
 import pandas as pd
 import os
+import glob
 from datetime import datetime
 import logging
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dateparse import LOCAL_TZ, parse_date_column
+from numclean import clean_numeric_column, rejected_report
+from ingestcache import ShardCache
+from brokerformats import read_broker_csv, iter_broker_csv
+from extsort import ExternalSorter
+from artifacts import save_artifact, compact_frame, ArtifactWriter
+from dedup import deduplicate_trades, save_reports, StreamingDeduplicator
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Bump when the parsed output of a source file changes, to invalidate cached shards
+PARSER_VERSION = 4
+
+# DataFrame.attrs key of the numeric cells a broker file had that could not be parsed
+REJECTED_ATTR = 'numeric_rejections'
+
+# The transfer ID is a label; read as a number it turns into 1001.0 once broker rows without one are added
+WISE_DTYPES = {'ID': str}
+
+
+def latest_wise_file(wise_folder):
+    # The incremental store written by 0wise.py; older setups only have dated daily files
+    store = os.path.join(wise_folder, "cleaned_wise_data.csv")
+    if os.path.exists(store):
+        return store
+    dated = sorted(glob.glob(os.path.join(wise_folder, "cleaned_wise_data_[0-9]*.csv")))
+    return dated[-1] if dated else store
+
+
 class TradeDataIntegrator:
-    def __init__(self, base_path):
+    def __init__(self, base_path, workers=None, incremental=False):
         self.base_path = base_path
+        # Number of processes used to parse broker files; None or 1 parses serially
+        self.workers = workers
+        # Reuse cached shards of unchanged source files instead of re-parsing them
+        self.incremental = incremental
+        self.cache_folder = os.path.join(base_path, "CACHE", "ingest")
+        # UTF-8 copies of the Shift-JIS exports, keyed by content hash and encoding
+        self.transcode_folder = os.path.join(base_path, "CACHE", "utf8")
+        self.wise_file = latest_wise_file(os.path.join(base_path, "RAWDATA", "wise"))
         self.output_folder = os.path.join(base_path)
         os.makedirs(self.output_folder, exist_ok=True)
         self.common_columns = ['trade_date', 'settlement_date', 'security_code', 'security_name',
                                'transaction_type', 'quantity', 'price', 'settlement_amount',
                                'currency', 'account_type', 'data_source']
 
-    def standardize_date(self, date_str):
-        if pd.isna(date_str):
-            return None
-        date_formats = ['%Y/%m/%d', '%Y年%m月%d日', '%Y-%m-%d', '%y/%m/%d']
-        for fmt in date_formats:
-            try:
-                return pd.to_datetime(date_str, format=fmt)
-            except ValueError:
-                continue
-        logger.warning(f"Unable to parse date: {date_str}")
-        return pd.NaT
-
-    def clean_numeric(self, value):
-        if pd.isna(value):
-            return None
-        if isinstance(value, (int, float)):
-            return value
-        value = str(value).replace(',', '').replace('(', '').replace(')', '')
-        try:
-            return float(value)
-        except ValueError:
-            logger.warning(f"Unable to convert to number: {value}")
-            return None
-
     def read_wise_data(self):
-        wise_file = os.path.join(self.base_path, "RAWDATA", "wise", "cleaned_wise_data_20240921.csv")
-        logger.info(f"Reading Wise data from {wise_file}")
-        df = pd.read_csv(wise_file)
-        df['trade_date'] = pd.to_datetime(df['trade_date'])
+        logger.info(f"Reading Wise data from {self.wise_file}")
+        df = pd.read_csv(self.wise_file, dtype=WISE_DTYPES)
+        df['trade_date'] = parse_date_column(df['trade_date'], tz=LOCAL_TZ)
         df['data_source'] = 'wise'
         return df
 
-    def read_rakuten_csv(self, file_path):
-        logger.info(f"Processing Rakuten file: {file_path}")
-        df = pd.read_csv(file_path, encoding='shift-jis')
-        file_name = os.path.basename(file_path)
-        
-        if 'INVST' in file_name:
-            df = df.rename(columns={
-                '約定日': 'trade_date', '受渡日': 'settlement_date', 'ファンド名': 'security_name',
-                '取引': 'transaction_type', '数量［口］': 'quantity', '単価': 'price',
-                '受渡金額/(ポイント利用)[円]': 'settlement_amount', '決済通貨': 'currency', '口座': 'account_type'
-            })
-            df['security_code'] = ''
-        elif 'JP' in file_name:
-            df = df.rename(columns={
-                '約定日': 'trade_date', '受渡日': 'settlement_date', '銘柄コード': 'security_code',
-                '銘柄名': 'security_name', '売買区分': 'transaction_type', '数量［株］': 'quantity',
-                '単価［円］': 'price', '受渡金額［円］': 'settlement_amount', '口座区分': 'account_type'
-            })
-            df['currency'] = 'JPY'
-        elif 'US' in file_name:
-            df = df.rename(columns={
-                '約定日': 'trade_date', '受渡日': 'settlement_date', 'ティッカー': 'security_code',
-                '銘柄名': 'security_name', '売買区分': 'transaction_type', '数量［株］': 'quantity',
-                '単価［USドル］': 'price', '受渡金額［円］': 'settlement_amount', '口座': 'account_type'
-            })
-            df['currency'] = 'USD'
-        else:
-            raise ValueError(f"Unknown Rakuten file format: {file_name}")
-        
-        df['data_source'] = f'rakuten_{file_name}'
-        df['trade_date'] = df['trade_date'].apply(self.standardize_date)
-        df['settlement_date'] = df['settlement_date'].apply(self.standardize_date)
-        df['settlement_amount'] = df['settlement_amount'].apply(self.clean_numeric)
-        df['price'] = df['price'].apply(self.clean_numeric)
-        df['quantity'] = df['quantity'].apply(self.clean_numeric)
-        return df[self.common_columns]
-
-    def read_sbi_csv(self, file_path):
-        logger.info(f"Processing SBI file: {file_path}")
-        file_name = os.path.basename(file_path)
-        if 'SaveFile' in file_name:
-            df = pd.read_csv(file_path, encoding='shift-jis', skiprows=8)
-            df = df.rename(columns={
-                '約定日': 'trade_date', '受渡日': 'settlement_date', '銘柄コード': 'security_code',
-                '銘柄': 'security_name', '取引': 'transaction_type', '約定数量': 'quantity',
-                '約定単価': 'price', '受渡金額/決済損益': 'settlement_amount', '預り': 'account_type'
-            })
-            df['currency'] = 'JPY'
-        elif 'yakujo' in file_name:
-            df = pd.read_csv(file_path, encoding='shift-jis', skiprows=2)
-            df = df.rename(columns={
-                '国内約定日': 'trade_date', '国内受渡日': 'settlement_date', '銘柄名': 'security_name',
-                '取引': 'transaction_type', '約定数量': 'quantity', '約定単価': 'price',
-                '受渡金額': 'settlement_amount', '通貨': 'currency', '預り区分': 'account_type'
-            })
-            df['security_code'] = df['security_name'].str.extract(r'(\w+) / ')
+    def normalize_broker_frame(self, fmt, df, file_name):
+        df['data_source'] = f'{fmt.broker}_{file_name}'
+        df['trade_date'] = parse_date_column(df['trade_date'], tz=LOCAL_TZ)
+        df['settlement_date'] = parse_date_column(df['settlement_date'], tz=LOCAL_TZ)
+        rejected = {}
+        for col in ['settlement_amount', 'price', 'quantity']:
+            df[col], rejected[col] = clean_numeric_column(df[col], name=f'{file_name} {col}')
+        df = df[self.common_columns]
+        # Travels with the frame through worker processes and cached shards; plain records so concat can compare
+        df.attrs[REJECTED_ATTR] = rejected_report(rejected).assign(data_source=df['data_source'].iloc[0] if len(df)
+                                                                   else file_name).to_dict('records')
+        return df
+
+    def read_broker_file(self, file_path, broker):
+        logger.info(f"Processing {broker} file: {file_path}")
+        # The format and header row are detected from the first bytes of the file
+        fmt, df = read_broker_csv(file_path, broker=broker, transcode_dir=self.transcode_folder)
+        return self.normalize_broker_frame(fmt, df, os.path.basename(file_path))
+
+    def iter_source_chunks(self, folder, file_path, chunksize):
+        if folder == 'wise':
+            with pd.read_csv(file_path, chunksize=chunksize, dtype=WISE_DTYPES) as reader:
+                for chunk in reader:
+                    chunk['trade_date'] = parse_date_column(chunk['trade_date'], tz=LOCAL_TZ)
+                    chunk['data_source'] = 'wise'
+                    yield chunk
         else:
-            raise ValueError(f"Unknown SBI file format: {file_name}")
-        
-        df['data_source'] = f'sbi_{file_name}'
-        df['trade_date'] = df['trade_date'].apply(self.standardize_date)
-        df['settlement_date'] = df['settlement_date'].apply(self.standardize_date)
-        df['settlement_amount'] = df['settlement_amount'].apply(self.clean_numeric)
-        df['price'] = df['price'].apply(self.clean_numeric)
-        df['quantity'] = df['quantity'].apply(self.clean_numeric)
-        return df[self.common_columns]
+            file_name = os.path.basename(file_path)
+            for fmt, chunk in iter_broker_csv(file_path, chunksize, broker=folder,
+                                              transcode_dir=self.transcode_folder):
+                yield self.normalize_broker_frame(fmt, chunk, file_name)
 
-    def process_data(self):
-        wise_df = self.read_wise_data()
-        all_data = [wise_df]
+    def output_columns(self):
+        """Columns of the integrated history in the order pd.concat gives them in process_data:
+        the Wise store's columns and data_source, then the broker columns it does not have."""
+        columns = []
+        if os.path.exists(self.wise_file):
+            columns = pd.read_csv(self.wise_file, nrows=0).columns.tolist() + ['data_source']
+        return list(dict.fromkeys(columns + self.common_columns))
 
+    def source_files(self):
+        sources = [('wise', self.wise_file)]
         for folder in ['rakuten', 'sbi']:
             folder_path = os.path.join(self.base_path, "RAWDATA", folder)
-            for file in os.listdir(folder_path):
+            for file in sorted(os.listdir(folder_path)):
                 if file.endswith('.csv'):
-                    file_path = os.path.join(folder_path, file)
-                    try:
-                        if folder == 'rakuten':
-                            df = self.read_rakuten_csv(file_path)
-                        else:
-                            df = self.read_sbi_csv(file_path)
-                        all_data.append(df)
-                    except Exception as e:
-                        logger.error(f"Error processing file {file_path}: {str(e)}")
+                    sources.append((folder, os.path.join(folder_path, file)))
+        return sources
+
+    def read_source_file(self, source):
+        # Returns (df, seconds, error) so failures can be logged by the parent process
+        folder, file_path = source
+        start = time.perf_counter()
+        try:
+            if folder == 'wise':
+                df = self.read_wise_data()
+            else:
+                df = self.read_broker_file(file_path, broker=folder)
+            return df, time.perf_counter() - start, None
+        except Exception as e:
+            return None, time.perf_counter() - start, str(e)
 
+    def parse_sources(self, sources):
+        if self.workers and self.workers > 1 and len(sources) > 1:
+            logger.info(f"Parsing {len(sources)} files with {self.workers} worker processes")
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(self.read_source_file, sources))
+        else:
+            results = map(self.read_source_file, sources)
+
+        # executor.map keeps input order, so the result matches the serial run
+        parsed = {}
+        for (folder, file_path), (df, elapsed, error) in zip(sources, results):
+            if error is not None:
+                logger.error(f"Error processing file {file_path}: {error}")
+                continue
+            logger.info(f"Parsed {file_path}: {len(df)} rows in {elapsed:.2f}s")
+            parsed[file_path] = df
+        return parsed
+
+    def process_data(self):
+        sources = self.source_files()
+        paths = [file_path for _, file_path in sources]
+
+        if self.incremental:
+            cache = ShardCache(self.cache_folder, version=PARSER_VERSION)
+            cache.prune(paths)
+            stale = set(cache.stale_files(paths))
+            logger.info(f"Incremental run: {len(stale)} new or changed files, "
+                        f"{len(paths) - len(stale)} cached shards")
+            parsed = self.parse_sources([s for s in sources if s[1] in stale])
+            for file_path, df in parsed.items():
+                cache.store(file_path, df)
+            cache.save()
+            all_data = cache.load(paths)
+        else:
+            parsed = self.parse_sources(sources)
+            all_data = [parsed[file_path] for file_path in paths if file_path in parsed]
+
+        self.save_rejections([row for df in all_data for row in df.attrs.pop(REJECTED_ATTR, [])])
         combined_df = pd.concat(all_data, ignore_index=True)
-        combined_df = combined_df.sort_values('trade_date')
-        return combined_df
+        # Overlapping downloads export the same trade more than once
+        combined_df = self.deduplicate(combined_df)
+        combined_df = combined_df.sort_values('trade_date', kind='stable')
+        # Categorical labels and downcast numerics, see artifacts.TRADE_SCHEMA
+        return compact_frame(combined_df, name='integrated trade history')
+
+    def save_rejections(self, rows):
+        """Write the unparseable numeric cells of the broker files to numeric_rejections.csv, if there are any."""
+        if not rows:
+            return
+        # Chunks of one file each report their own counts
+        report = pd.DataFrame(rows).groupby(['data_source', 'reason', 'column', 'value'], sort=False)['rows'].sum()
+        path = os.path.join(self.output_folder, "numeric_rejections.csv")
+        report.reset_index().to_csv(path, index=False, encoding='utf-8-sig')
+        logger.warning(f"{len(report)} distinct unparseable numeric values written to {path}")
+
+    def deduplicate(self, df):
+        deduped, overlap, near = deduplicate_trades(df)
+        save_reports(overlap, near, self.output_folder)
+        return deduped
+
+    def stream_data(self, output_file, chunksize=50_000, run_rows=500_000):
+        """Write the integrated history without holding it in memory.
+
+        Every source is read in chunks, normalized and fed to an external sort
+        on trade_date; the sorted runs are k-way merged, deduplicated one trade
+        day at a time and written as the same typed parquet + CSV artifact as
+        save_data, with the columns of process_data (see output_columns).
+        """
+        columns = self.output_columns()
+        sorter = ExternalSorter('trade_date', columns, run_rows=run_rows, work_dir=self.output_folder)
+        rejections = []
+        try:
+            for folder, file_path in self.source_files():
+                start = time.perf_counter()
+                rows = 0
+                try:
+                    for chunk in self.iter_source_chunks(folder, file_path, chunksize):
+                        rejections.extend(chunk.attrs.pop(REJECTED_ATTR, []))
+                        sorter.add(chunk)
+                        rows += len(chunk)
+                except Exception as e:
+                    logger.error(f"Error processing file {file_path}: {str(e)}")
+                    continue
+                logger.info(f"Streamed {file_path}: {rows} rows in {time.perf_counter() - start:.2f}s")
+            dedup = StreamingDeduplicator()
+            with ArtifactWriter(os.path.splitext(output_file)[0], columns) as writer:
+                for frame in sorter.merge():
+                    writer.write(dedup.feed(frame))
+                writer.write(dedup.flush())
+            save_reports(*dedup.reports(), self.output_folder)
+            self.save_rejections(rejections)
+        finally:
+            sorter.cleanup()
+        logger.info(f"Integrated data saved to {output_file}")
+        return writer.rows
+
+    def output_file(self):
+        return os.path.join(self.output_folder, f"integrated_trade_history_{datetime.now().strftime('%Y%m%d')}.csv")
 
     def save_data(self, df):
-        output_file = os.path.join(self.output_folder, f"integrated_trade_history_{datetime.now().strftime('%Y%m%d')}.csv")
-        df.to_csv(output_file, index=False, encoding='utf-8')
+        output_file = self.output_file()
+        # Typed parquet for the next stages, CSV copy for inspection
+        save_artifact(df, os.path.splitext(output_file)[0])
         print(df)
         print(output_file)
         logger.info(f"Integrated data saved to {output_file}")
@@ -161,9 +246,13 @@ class TradeDataIntegrator:
         jpy_amount = df[(df['currency'] == 'JPY') & (df['settlement_amount'].notnull())]['settlement_amount'].sum()
         logger.info(f"Total JPY amount: {jpy_amount}")
 
-def main():
+def main(streaming=False):
     base_path = r"C:\Users\100ca\Documents\PyCode\TRADEHISTORY"
-    integrator = TradeDataIntegrator(base_path)
+    integrator = TradeDataIntegrator(base_path, workers=os.cpu_count(), incremental=True)
+    if streaming:
+        # Bounded-memory path for archives that do not fit in RAM
+        integrator.stream_data(integrator.output_file())
+        return
     combined_df = integrator.process_data()
     integrator.save_data(combined_df)
     integrator.log_data_summary(combined_df)
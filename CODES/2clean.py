@@ -1,36 +1,32 @@
 import pandas as pd
 import numpy as np
 import os
-import re
 from datetime import datetime, timedelta
+from dateparse import LOCAL_TZ, parse_date_column
+from numclean import clean_numeric_column, rejected_report
+from artifacts import load_artifact, save_artifact, recode_category
+from fxrates import load_fx_rates
+from secmaster import SecurityMaster
+from fuzzymatch import FuzzyResolver
+from traderules import classify_investment_type, convert_to_jpy
 
 # Path settings
 base_path = r"C:\Users\100ca\Documents\PyCode\TRADEHISTORY"
-input_file = os.path.join(base_path, "integrated_trade_history_20240919.csv")
-security_code_file = os.path.join(base_path, "DIC", "securitycode.csv")
-forex_data_file = os.path.join(base_path, "DIC", "forex_data.csv")
-output_file = os.path.join(base_path, "trade_history3.csv")
+input_file = os.path.join(base_path, "integrated_trade_history_20240919")  # .parquet / .csv
+dic_folder = os.path.join(base_path, "DIC")  # securitycode.csv などの辞書
+forex_data_file = os.path.join(base_path, "DIC", "forex_data")
+output_file = os.path.join(base_path, "trade_history3")
 
 # Load data
-df = pd.read_csv(input_file)
-security_code = pd.read_csv(security_code_file)
-forex_data = pd.read_csv(forex_data_file)
+# 型付きの列形式ファイルを優先して読む（ラベル列はカテゴリのまま扱う）
+df = load_artifact(input_file)
+security_master = SecurityMaster.load(dic_folder)
+# 為替レートは日付を一度だけ解析してソート済み配列で保持する
+fx_rates = load_fx_rates(forex_data_file)
 
 # Clean and standardize date formats
-def parse_dates(date_series):
-    # 日付の形式を確認し、適切に処理
-    parsed_dates = pd.to_datetime(date_series, errors='coerce')  # フォーマットを指定しない
-    if parsed_dates.isnull().all():
-        print("No valid dates found in the series.")
-    return parsed_dates
-
-df['trade_date'] = parse_dates(df['trade_date'])
-df['settlement_date'] = parse_dates(df['settlement_date'])  # settlement_dateも解析
-
-# forex_dataの日付もdatetimeに変換
-forex_data['Date'] = pd.to_datetime(forex_data['Date'], errors='coerce')
-forex_data = forex_data.rename(columns={'Date': 'trade_date'})
-forex_data['trade_date'] = forex_data['trade_date'].dt.tz_localize(None)  # UTCを解除
+df['trade_date'] = parse_date_column(df['trade_date'], tz=LOCAL_TZ)
+df['settlement_date'] = parse_date_column(df['settlement_date'], tz=LOCAL_TZ)  # settlement_dateも解析
 
 # データの最初の数行を表示
 print("Original trade_date values:")
@@ -43,98 +39,54 @@ print(df['trade_date'].unique())
 # データ型と中身を確認して表示
 print(f"df['trade_date'] type: {df['trade_date'].dtype}")
 print(f"df['trade_date'] contents:\n{df['trade_date']}\n")
-print(f"forex_data['trade_date'] type: {forex_data['trade_date'].dtype}")
-print(f"forex_data['trade_date'] contents:\n{forex_data['trade_date']}\n")
 
-# Merge with forex data
-df = pd.merge(df, forex_data, on='trade_date', how='left')
-
-# マージ後のデータ型と中身を確認して表示
-print(f"After merge, df['trade_date'] type: {df['trade_date'].dtype}")
-print(f"After merge, df['trade_date'] contents:\n{df['trade_date']}\n")
+# 為替レートを付与（土日祝の取引は直前の営業日のレート）
+for pair in fx_rates.pairs:
+    df[pair] = fx_rates.asof(pair, df['trade_date'])
 
 # Clean and convert numeric columns
-def clean_numeric(x):
-    if pd.isna(x) or x == '-':
-        return np.nan
-    if isinstance(x, str):
-        x = re.sub(r'[,円]', '', x)
-        match = re.search(r'-?\d+(\.\d+)?', x)
-        if match:
-            return float(match.group())
-    try:
-        return float(x)
-    except ValueError:
-        return np.nan
-
 numeric_columns = ['quantity', 'price', 'settlement_amount']
+rejected = {}
 for col in numeric_columns:
-    df[col] = df[col].apply(clean_numeric)
+    df[col], rejected[col] = clean_numeric_column(df[col], name=col)
 
 # Standardize currency
 currency_mapping = {
     'JPY': 'JPY', '日本円': 'JPY', '円': 'JPY',
     'USD': 'USD', '米国ドル': 'USD', '米ドル': 'USD'
 }
-df['currency'] = df['currency'].map(currency_mapping).fillna('Unknown')
+df['currency'] = recode_category(df['currency'], currency_mapping, 'Unknown')
 
 # Standardize transaction types
 transaction_type_mapping = {
     'buy': 'Buy', 'sell': 'Sell', '買付': 'Buy', '売付': 'Sell'
 }
-df['transaction_type'] = df['transaction_type'].map(transaction_type_mapping).fillna('Other')
+df['transaction_type'] = recode_category(df['transaction_type'], transaction_type_mapping, 'Other')
 
 # Standardize account types
 account_type_mapping = {
     '特定': 'Specific', 'つみたてNISA': 'Cumulative NISA', 
     'つみたてNISA   ': 'Cumulative NISA', '一般': 'General'
 }
-df['account_type'] = df['account_type'].map(account_type_mapping).fillna('Other')
-
-# Merge with security code data
-df = pd.merge(df, security_code, on='security_name', how='left', suffixes=('', '_y'))
-df['security_code'] = df['security_code'].fillna(df['security_code_y'])
-df = df.drop('security_code_y', axis=1)
-
-
-def classify_investment_type(row):
-    if 'JP' in row['data_source']:
-        return '日本株'
-    elif 'US' in row['data_source']:
-        return '米国株'
-    elif 'INVST' in row['data_source']:
-        return '投資信託'
-    elif 'SaveFile' in row['data_source']:
-        return '日本株か投資信託'
-    elif 'SBI' in row['data_source']:
-        return '日本株か投資信託'  
-    elif 'yakujo' in row['data_source']:
-        return '米国株' 
-    else:
-        return 'その他'
-
-df['investment_type'] = df.apply(classify_investment_type, axis=1)
-
-def convert_to_jpy(row):
-    
-    if row['currency'] == 'USD':
-        if pd.isna(row['USDJPY']):
-            print(f"Warning: USDJPY rate is missing for row: {row}")
-            return np.nan  # または適切なデフォルト値
-        return  row['price']* row['quantity']* row['USDJPY']
-    elif row['currency'] == 'JPY':
-        if row['settlement_amount'] == 0 and row['price'] * row['quantity'] > 0:
-            return row['price'] * row['quantity']         
-        elif row['currency'] == 'JPY':
-            return row['settlement_amount']  # JPYの場合はそのまま
-    else:
-        return -1 
-
-# amount_jpyを計算
-df['amount_jpy'] = df.apply(convert_to_jpy, axis=1)
+df['account_type'] = recode_category(df['account_type'], account_type_mapping, 'Other')
+
+# Fill missing security codes from the security name (normalized lookup)
+codes = security_master.fill_codes(df['security_name'], df['security_code'])
+# 辞書にない銘柄名は n-gram 索引で候補を探し、確度の高いものだけ自動で埋める（残りは確認用 CSV へ）
+resolver = FuzzyResolver.from_master(security_master,
+                                     report_file=os.path.join(base_path, "unmatched_security_names.csv"))
+df['security_code'] = resolver.fill_unmatched(df['security_name'], codes).astype('category')
+
+# 投資種別は data_source ごとに一度だけ判定
+df['investment_type'] = classify_investment_type(df['data_source'])
+
+# amount_jpyを計算（換算できなかった行と数値に変換できなかった値を理由付きで CSV にまとめる）
+df['amount_jpy'], conversion_issues = convert_to_jpy(df, fx_rates)
+conversion_issues = pd.concat([conversion_issues, rejected_report(rejected)], ignore_index=True)
+conversion_issues.to_csv(os.path.join(base_path, "amount_jpy_issues.csv"), index=False, encoding='utf-8-sig')
 
 # Save cleaned and integrated data
-df.to_csv(output_file, index=False)
+df = save_artifact(df, output_file)
 
 # Print summary to identify missing or problematic data
 print("Data summary after cleaning and integration:")
@@ -153,7 +105,7 @@ print(f"\nCleaned and integrated data saved to {output_file}")
 
 
 # security_codeごとのデータに整形
-df_grouped = df.groupby('security_code').agg({
+df_grouped = df.groupby('security_code', observed=True).agg({
     'quantity': 'sum',
     'price': 'mean',
     'settlement_amount': 'sum',
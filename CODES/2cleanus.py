@@ -1,155 +1,134 @@
 import pandas as pd
 import numpy as np
 import os
-import re
 from datetime import datetime, timedelta
+from dateparse import LOCAL_TZ, parse_date_column
+from numclean import clean_numeric_column, rejected_report
+from artifacts import load_artifact, save_artifact, recode_category
+from fxrates import FxRates, load_fx_rates
+from secmaster import SecurityMaster
+from fuzzymatch import FuzzyResolver
+from traderules import classify_investment_type, convert_to_jpy
 
 # Path settings
 base_path = r"C:\Users\100ca\Documents\PyCode\TRADEHISTORY"
-input_file = os.path.join(base_path, "integrated_trade_history_20240921.csv")
-security_code_file = os.path.join(base_path, "DIC", "securitycode.csv")
-forex_data_file = os.path.join(base_path, "DIC", "forex_data.csv")
-jpx_codes_us_file = os.path.join(base_path, "DIC", "jpxcodesus.csv")  # New file path
-output_file = os.path.join(base_path, "trade_history3.csv")
-
-# Load data
-df = pd.read_csv(input_file)
-security_code = pd.read_csv(security_code_file)
-forex_data = pd.read_csv(forex_data_file)
-jpx_codes_us = pd.read_csv(jpx_codes_us_file)  # Load the jpxcodesus.csv file
-
-# Clean and standardize date formats
-def parse_dates(date_series):
-    parsed_dates = pd.to_datetime(date_series, errors='coerce')
-    if parsed_dates.isnull().all():
-        print("No valid dates found in the series.")
-    return parsed_dates
-
-df['trade_date'] = parse_dates(df['trade_date'])
-df['settlement_date'] = parse_dates(df['settlement_date'])
-
-forex_data['Date'] = pd.to_datetime(forex_data['Date'], errors='coerce')
-forex_data = forex_data.rename(columns={'Date': 'trade_date'})
-forex_data['trade_date'] = forex_data['trade_date'].dt.tz_localize(None)
-
-# Merge with forex data
-df = pd.merge(df, forex_data, on='trade_date', how='left')
-
-# Clean and convert numeric columns
-def clean_numeric(x):
-    if pd.isna(x) or x == '-':
-        return np.nan
-    if isinstance(x, str):
-        x = re.sub(r'[,円]', '', x)
-        match = re.search(r'-?\d+(\.\d+)?', x)
-        if match:
-            return float(match.group())
-    try:
-        return float(x)
-    except ValueError:
-        return np.nan
-
-numeric_columns = ['quantity', 'price', 'settlement_amount']
-for col in numeric_columns:
-    df[col] = df[col].apply(clean_numeric)
+input_file = os.path.join(base_path, "integrated_trade_history_20240921")  # .parquet / .csv
+# securitycode.csv, jpxcodesus.csv etc. are read through the security master
+dic_folder = os.path.join(base_path, "DIC")
+forex_data_file = os.path.join(base_path, "DIC", "forex_data")
+output_file = os.path.join(base_path, "trade_history3")
+# Fuzzy candidates for names that could not be resolved automatically
+unmatched_names_file = os.path.join(base_path, "unmatched_security_names.csv")
+# Rows whose amount_jpy could not be computed and numeric cells that could not be parsed, with the reason
+conversion_issues_file = os.path.join(base_path, "amount_jpy_issues.csv")
 
 # Standardize currency
 currency_mapping = {
     'JPY': 'JPY', '日本円': 'JPY', '円': 'JPY',
     'USD': 'USD', '米国ドル': 'USD', '米ドル': 'USD'
 }
-df['currency'] = df['currency'].map(currency_mapping).fillna('Unknown')
 
 # Standardize transaction types
 transaction_type_mapping = {
     'buy': 'Buy', 'sell': 'Sell', '買付': 'Buy', '売付': 'Sell'
 }
-df['transaction_type'] = df['transaction_type'].map(transaction_type_mapping).fillna('Other')
 
 # Standardize account types
 account_type_mapping = {
     '特定': 'Specific', 'つみたてNISA': 'Cumulative NISA', 
     'つみたてNISA   ': 'Cumulative NISA', '一般': 'General'
 }
-df['account_type'] = df['account_type'].map(account_type_mapping).fillna('Other')
-
-# Merge with security code data
-df = pd.merge(df, security_code, on='security_name', how='left', suffixes=('', '_y'))
-df['security_code'] = df['security_code'].fillna(df['security_code_y'])
-df = df.drop('security_code_y', axis=1)
-
-# Convert Japanese ETF codes to US ETF codes
-def convert_etf_code(code):
-    if code in jpx_codes_us['コード'].values:
-        us_code = jpx_codes_us.loc[jpx_codes_us['コード'] == code, '類似米国ETFティッカー'].iloc[0]
-        return us_code
-    return code
-
-df['security_code'] = df['security_code'].apply(convert_etf_code)
-
-def classify_investment_type(row):
-    if 'JP' in row['data_source']:
-        return '日本株'
-    elif 'US' in row['data_source']:
-        return '米国株'
-    elif 'INVST' in row['data_source']:
-        return '投資信託'
-    elif 'SaveFile' in row['data_source']:
-        return '日本株か投資信託'
-    elif 'SBI' in row['data_source']:
-        return '日本株か投資信託'  
-    elif 'yakujo' in row['data_source']:
-        return '米国株' 
-    else:
-        return 'その他'
-
-df['investment_type'] = df.apply(classify_investment_type, axis=1)
-
-def convert_to_jpy(row):
-    if row['currency'] == 'USD':
-        if pd.isna(row['USDJPY']):
-            print(f"Warning: USDJPY rate is missing for row: {row}")
-            return np.nan
-        return row['price'] * row['quantity'] * row['USDJPY']
-    elif row['currency'] == 'JPY':
-        if row['settlement_amount'] == 0 and row['price'] * row['quantity'] > 0:
-            return row['price'] * row['quantity']         
-        elif row['currency'] == 'JPY':
-            return row['settlement_amount']
-    else:
-        return -1 
-
-# Calculate amount_jpy
-df['amount_jpy'] = df.apply(convert_to_jpy, axis=1)
-
-# Save cleaned and integrated data
-df.to_csv(output_file, index=False)
-
-# Print summary to identify missing or problematic data
-print("Data summary after cleaning and integration:")
-print(df.info())
-
-print("\nMissing values:")
-print(df.isnull().sum())
-
-print("\nUnique values in key columns:")
-for col in ['currency', 'transaction_type', 'account_type', 'security_code']:
-    print(f"\n{col}:")
-    print(df[col].value_counts(dropna=False))
-
-print(f"\nCleaned and integrated data saved to {output_file}")
-
-# Group data by security_code
-df_grouped = df.groupby('security_code').agg({
-    'quantity': 'sum',
-    'price': 'mean',
-    'settlement_amount': 'sum',
-    'amount_jpy': 'sum'
-}).reset_index()
-
-# Save grouped data
-output_grouped_file = os.path.join(base_path, "grouped_trade_history.csv")
-df_grouped.to_csv(output_grouped_file, index=False)
-
-print(f"\nGrouped data saved to {output_grouped_file}")
 
+
+def load_inputs():
+    # 型付きの列形式ファイルを優先して読む（ラベル列はカテゴリのまま扱う）
+    df = load_artifact(input_file)
+    security_master = SecurityMaster.load(dic_folder)
+    forex_data = load_fx_rates(forex_data_file)
+    return df, security_master, forex_data
+
+
+
+def clean_trades(df, security_master, forex_data, resolver=None, diagnostics_file=None):
+    """Integrated history -> trade_history3 (FX rates added, labels standardized, amount_jpy).
+
+    ``forex_data`` is an FxRates or the wide forex_data frame. Names without
+    a dictionary entry go through ``resolver`` (a FuzzyResolver over the
+    security master by default).
+    """
+    df = df.copy()
+
+    # Clean and standardize date formats
+    df['trade_date'] = parse_date_column(df['trade_date'], tz=LOCAL_TZ)
+    df['settlement_date'] = parse_date_column(df['settlement_date'], tz=LOCAL_TZ)
+
+    # As-of FX rates, so weekend and holiday trades get the last rate before them
+    fx_rates = forex_data if isinstance(forex_data, FxRates) else FxRates(forex_data)
+    for pair in fx_rates.pairs:
+        df[pair] = fx_rates.asof(pair, df['trade_date'])
+
+    # Clean and convert numeric columns
+    numeric_columns = ['quantity', 'price', 'settlement_amount']
+    rejected = {}
+    for col in numeric_columns:
+        df[col], rejected[col] = clean_numeric_column(df[col], name=col)
+
+    df['currency'] = recode_category(df['currency'], currency_mapping, 'Unknown')
+    df['transaction_type'] = recode_category(df['transaction_type'], transaction_type_mapping, 'Other')
+    df['account_type'] = recode_category(df['account_type'], account_type_mapping, 'Other')
+
+    # Fill missing codes from the security name, then convert Japanese ETF codes to US ETF codes
+    codes = security_master.fill_codes(df['security_name'], df['security_code'])
+    resolver = resolver or FuzzyResolver.from_master(security_master)
+    codes = resolver.fill_unmatched(df['security_name'], codes)
+    df['security_code'] = security_master.map_etf(codes).astype('category')
+
+    df['investment_type'] = classify_investment_type(df['data_source'])
+
+    # Calculate amount_jpy
+    df['amount_jpy'], diagnostics = convert_to_jpy(df, fx_rates)
+    diagnostics = pd.concat([diagnostics, rejected_report(rejected)], ignore_index=True)
+    if diagnostics_file is not None:
+        diagnostics.to_csv(diagnostics_file, index=False, encoding='utf-8-sig')
+    return df
+
+
+def main():
+    df, security_master, forex_data = load_inputs()
+    resolver = FuzzyResolver.from_master(security_master, report_file=unmatched_names_file)
+    df = clean_trades(df, security_master, forex_data, resolver, diagnostics_file=conversion_issues_file)
+
+    # Save cleaned and integrated data
+    df = save_artifact(df, output_file)
+
+    # Print summary to identify missing or problematic data
+    print("Data summary after cleaning and integration:")
+    print(df.info())
+
+    print("\nMissing values:")
+    print(df.isnull().sum())
+
+    print("\nUnique values in key columns:")
+    for col in ['currency', 'transaction_type', 'account_type', 'security_code']:
+        print(f"\n{col}:")
+        print(df[col].value_counts(dropna=False))
+
+    print(f"\nCleaned and integrated data saved to {output_file}")
+
+    # Group data by security_code
+    df_grouped = df.groupby('security_code', observed=True).agg({
+        'quantity': 'sum',
+        'price': 'mean',
+        'settlement_amount': 'sum',
+        'amount_jpy': 'sum'
+    }).reset_index()
+
+    # Save grouped data
+    output_grouped_file = os.path.join(base_path, "grouped_trade_history.csv")
+    df_grouped.to_csv(output_grouped_file, index=False)
+
+    print(f"\nGrouped data saved to {output_grouped_file}")
+
+
+if __name__ == "__main__":
+    main()
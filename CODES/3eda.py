@@ -3,21 +3,18 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import os
 import numpy as np
-import yfinance as yf
+from artifacts import load_artifact
+from pricestore import default_store
 
-# File path
-cleaned_file = r'C:\Users\100ca\Documents\PyCode\TRADEHISTORY\trade_history4.csv'
+# File path (trade_history4.parquet、無ければ .csv)
+cleaned_file = r'C:\Users\100ca\Documents\PyCode\TRADEHISTORY\trade_history4'
 
 # Output folder
 output_folder = r'C:\Users\100ca\Documents\PyCode\TRADEHISTORY\EDA_results'
 os.makedirs(output_folder, exist_ok=True)
 
-# Load data
-df = pd.read_csv(cleaned_file)
-
-# Convert date columns to datetime
-df['trade_date'] = pd.to_datetime(df['trade_date'])
-df['settlement_date'] = pd.to_datetime(df['settlement_date'])
+# Load data (dates are already datetime64 in the typed artifact)
+df = load_artifact(cleaned_file)
 
 # Convert trade_date to month for grouping
 df['month'] = df['trade_date'].dt.to_period('M')  # 'month'列を追加
@@ -78,7 +75,8 @@ weekly_data = df.resample('W-Mon', on='trade_date').agg(
 )
 
 # TOPIX Total Marketのデータを取得
-topix_data = yf.download("^TOPX", start=df['trade_date'].min(), end=pd.Timestamp.today().strftime('%Y-%m-%d'))
+topix_data = default_store().get(["^TOPX"], start=df['trade_date'].min(), end=pd.Timestamp.today().strftime('%Y-%m-%d'))
+topix_data = topix_data.rename(columns={"^TOPX": 'Close'})
 topix_data['weekly_return'] = topix_data['Close'].pct_change().rolling(window=7).mean()  # 7日間の移動平均リターンを計算
 
 # Merge TOPIX data with weekly_data
@@ -142,7 +140,7 @@ plt.close()
 
 # 8. Transaction Amounts by Security Code with TOPIX
 plt.figure(figsize=(12, 6))
-top_10_securities = df.groupby('security_code')['amount_jpy'].sum().sort_values(ascending=False).head(10)
+top_10_securities = df.groupby('security_code', observed=True)['amount_jpy'].sum().sort_values(ascending=False).head(10)
 top_10_securities.plot(kind='bar', color='blue', label='Transaction Amounts')
 plt.title('Top 10 Securities by Transaction Amount with TOPIX')
 plt.xlabel('Security Code')
@@ -176,19 +174,17 @@ with open(os.path.join(output_folder, 'cumulative_investment_amount.txt'), 'w')
 print(f"\nEDA completed. Results and visualizations saved in {output_folder}.")
 
 import pandas as pd
-import yfinance as yf
 import matplotlib.pyplot as plt
 
-# 取引データの読み込み
-df = pd.read_csv(r'C:\Users\100ca\Documents\PyCode\TRADEHISTORY\trade_history4.csv')
+# 取引データの読み込み（必要な列だけ）
+df = load_artifact(cleaned_file, columns=['security_code', 'amount_jpy'])
 
 # security_codeごとの取引額を計算
-top_securities = df.groupby('security_code')['amount_jpy'].sum().nlargest(5).index.tolist()
+top_securities = df.groupby('security_code', observed=True)['amount_jpy'].sum().nlargest(5).index.tolist()
 
 # 各銘柄のデータを取得
-data = {}
-for code in top_securities:
-    data[code] = yf.download(code, start='2022-01-01', end='2023-01-01')
+closes = default_store().get(top_securities, start='2022-01-01', end='2023-01-01')
+data = {code: closes[[code]].rename(columns={code: 'Close'}) for code in top_securities}
 
 # 追加: security_codeごとのデータを整形して出力
 formatted_data = pd.DataFrame()
@@ -212,28 +208,27 @@ plt.grid()
 
 
 import pandas as pd
-import yfinance as yf
 import matplotlib.pyplot as plt
 import os
 
 # 1. データの読み込み
-file_path = r'C:\Users\100ca\Documents\PyCode\TRADEHISTORY\trade_history4.csv'
-df = pd.read_csv(file_path)
+file_path = r'C:\Users\100ca\Documents\PyCode\TRADEHISTORY\trade_history4'
+df = load_artifact(file_path, columns=['security_code', 'amount_jpy'])
 print("データの読み込みが完了しました。")
 
 # 2. 取引額の計算
-top_securities = df.groupby('security_code')['amount_jpy'].sum().sort_values(ascending=False).head(5).index.tolist()
+top_securities = df.groupby('security_code', observed=True)['amount_jpy'].sum().sort_values(ascending=False).head(5).index.tolist()
 print(f"トップ5の銘柄コード: {top_securities}")
 
 # 3. データの取得
 data = {}
 start_date = '2018-01-01'
 end_date = '2025-01-01'
-for code in top_securities:
-    try:
-        data[code] = yf.download(code, start=start_date, end=end_date)
-    except Exception as e:
-        print(f"{code}のデータ取得中にエラーが発生しました: {e}")
+try:
+    closes = default_store().get(top_securities, start=start_date, end=end_date)
+    data = {code: closes[[code]].dropna().rename(columns={code: 'Close'}) for code in top_securities}
+except Exception as e:
+    print(f"データ取得中にエラーが発生しました: {e}")
 print("データの取得が完了しました。")
 
 # 4. プロットの作成
@@ -255,7 +250,7 @@ print("プロットを保存しました。")
 
 # 6. エラーハンドリング
 try:
-    df = pd.read_csv(file_path)
+    df = load_artifact(file_path)
 except Exception as e:
     print(f"データの読み込み中にエラーが発生しました: {e}")
 
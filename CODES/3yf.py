@@ -1,6 +1,8 @@
 import pandas as pd
-import yfinance as yf
 from datetime import datetime, timedelta
+from artifacts import load_artifact, write_table
+from pricematrix import save_price_matrix
+from pricestore import default_store
 
 def process_code(x):
     if pd.notna(x):
@@ -15,36 +17,47 @@ def process_code(x):
             return x
     return None
 
-# CSVファイルを読み込み、銘柄コードを処理
-df = pd.read_csv(r'C:\Users\100ca\Documents\PyCode\TRADEHISTORY\trade_history4.csv')
-codes = df['security_code'].apply(process_code).dropna().unique().tolist()
+trade_history_path = r'C:\Users\100ca\Documents\PyCode\TRADEHISTORY\trade_history4'
+output_path = r'C:\Users\100ca\Documents\PyCode\trahist\DIC\charts'  # charts の価格行列と charts.csv
 
-# 日付範囲を設定（今日から5年前まで）
-end_date = datetime.now()
-print(end_date)
-start_date = end_date - timedelta(days=365*5)
 
-# データをダウンロード（エラーを無視）
-data = yf.download(codes, start=start_date, end=end_date, ignore_tz=True, group_by='column')
+def download_adj_close(security_codes, start_date=None, end_date=None, store=None):
+    codes = security_codes.apply(process_code).dropna().unique().tolist()
 
-# Adj Closeのデータを抽出
-adj_close_data = data['Adj Close'].copy()
+    # 日付範囲を設定（今日から5年前まで）
+    end_date = end_date or datetime.now()
+    print(end_date)
+    start_date = start_date or end_date - timedelta(days=365*5)
 
-# 列名から'.T'を削除し、NaNのみの列を削除
-adj_close_data.columns = adj_close_data.columns.str.rstrip('.T')
-adj_close_data = adj_close_data.dropna(axis=1, how='all')
+    # ローカルの価格ストアに無い期間だけダウンロードし、Adj Closeを取り出す
+    adj_close_data = (store or default_store()).get(codes, start_date, end_date, field='Adj Close')
 
+    # 列名から'.T'を削除し、NaNのみの列を削除
+    adj_close_data.columns = adj_close_data.columns.str.rstrip('.T')
+    adj_close_data = adj_close_data.dropna(axis=1, how='all')
 
-print(adj_close_data.tail(1))
+    print(f"処理された銘柄数: {len(adj_close_data.columns)}")
+    print(f"サンプル列: {list(adj_close_data.columns)[:10]}")
+    print(f"ダウンロードに失敗した銘柄: {set(codes) - set(adj_close_data.columns)}")
+    failures = (store or default_store()).failure_report()
+    if not failures.empty:
+        print(failures.to_string(index=False))
+    return adj_close_data
 
 
-# CSVファイルに保存
-output_path = r'C:\Users\100ca\Documents\PyCode\trahist\DIC\charts.csv'
-print(adj_close_data)
-print(f"処理された銘柄数: {len(adj_close_data.columns)}")
-print(f"サンプル列: {list(adj_close_data.columns)[:10]}")
-print(f"ダウンロードに失敗した銘柄: {set(codes) - set(adj_close_data.columns)}")
-print(f"データは {output_path} に保存されました。")
+def main():
+    # 取引履歴から security_code 列だけを読み込み、銘柄コードを処理
+    df = load_artifact(trade_history_path, columns=['security_code'])
+    adj_close_data = download_adj_close(df['security_code'])
 
+    print(adj_close_data.tail(1))
+    print(adj_close_data)
 
-adj_close_data.to_csv(output_path)
\ No newline at end of file
+    # 価格行列に追記（新しい日付だけ書き込む）し、確認用にCSVも保存
+    save_price_matrix(adj_close_data, output_path)
+    write_table(adj_close_data, f'{output_path}.csv', index=True)
+    print(f"データは {output_path} に保存されました。")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,8 @@ import logging
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 import numpy as np
+from artifacts import load_artifact
+from pricematrix import PriceMatrix, load_prices
 
 # ロギングの設定
 logging.basicConfig(filename='plot_log.txt', level=logging.INFO, 
@@ -16,17 +18,26 @@ def normalize_code(code):
     code = str(code).strip().upper()
     return code.rstrip('.JP').rstrip('.T')
 
+def normalize_codes(trade_history, adj_close_data):
+    trade_history = trade_history.copy()
+    trade_history['security_code'] = trade_history['security_code'].apply(normalize_code)
+    if isinstance(adj_close_data, PriceMatrix):
+        # 価格行列はコピーせず、ティッカー名だけを付け替える
+        return trade_history, adj_close_data.with_tickers([normalize_code(t) for t in adj_close_data.tickers])
+    adj_close_data = adj_close_data.copy()
+    adj_close_data.columns = [normalize_code(col) for col in adj_close_data.columns]
+    return trade_history, adj_close_data
+
 def load_data(trade_history_path, adj_close_data_path):
     try:
-        trade_history = pd.read_csv(trade_history_path, parse_dates=['trade_date'])
-        trade_history['security_code'] = trade_history['security_code'].apply(normalize_code)
-        
-        adj_close_data = pd.read_csv(adj_close_data_path, index_col=0, parse_dates=True)
-        adj_close_data.columns = [normalize_code(col) for col in adj_close_data.columns]
+        trade_history = load_artifact(trade_history_path, columns=['trade_date', 'security_code',
+                                                                   'transaction_type', 'amount_jpy'])
+        # charts の価格行列（無ければ charts.parquet / .csv）
+        adj_close_data = load_prices(adj_close_data_path)
         
         # フィルタリングは行わず、すべてのデータを保持します
         
-        return trade_history, adj_close_data
+        return normalize_codes(trade_history, adj_close_data)
     except Exception as e:
         logging.error(f"Error loading data: {str(e)}")
         return None, None
@@ -80,26 +91,33 @@ def generate_combined_chart(args):
     except Exception as e:
         logging.error(f"Error generating chart for {security_code}: {str(e)}")
 
-def main():
-    trade_history_path = r'C:\Users\100ca\Documents\PyCode\TRADEHISTORY\trade_history4.csv'
-    adj_close_data_path = r'C:\Users\100ca\Documents\PyCode\trahist\DIC\charts.csv'
-    output_folder = Path(r'C:\Users\100ca\Documents\PyCode\trahist\charts')
+def generate_charts(trade_history, adj_close_data, output_folder):
+    output_folder = Path(output_folder)
     output_folder.mkdir(parents=True, exist_ok=True)
 
-    trade_history, adj_close_data = load_data(trade_history_path, adj_close_data_path)
-    if trade_history is None or adj_close_data is None:
-        logging.error("Failed to load data. Exiting.")
-        return
-
-    security_codes = trade_history['security_code'].dropna().unique()
+    # 各ワーカーには銘柄ごとの取引だけを渡す（PriceMatrixはファイルパスだけが送られる）
+    trades_by_code = dict(tuple(trade_history.groupby('security_code', sort=False)))
+    security_codes = list(trades_by_code)
 
     # マルチプロセッシングを使用してチャートを生成
     with ProcessPoolExecutor() as executor:
-        args_list = [(trade_history, adj_close_data, code, output_folder) for code in security_codes]
+        args_list = [(trades_by_code[code], adj_close_data, code, output_folder) for code in security_codes]
         list(tqdm(executor.map(generate_combined_chart, args_list), total=len(security_codes), desc="Generating charts"))
 
     logging.info("All charts have been generated.")
     print("All charts have been generated. Check plot_log.txt for details.")
 
+def main():
+    trade_history_path = r'C:\Users\100ca\Documents\PyCode\TRADEHISTORY\trade_history4'
+    adj_close_data_path = r'C:\Users\100ca\Documents\PyCode\trahist\DIC\charts'
+    output_folder = Path(r'C:\Users\100ca\Documents\PyCode\trahist\charts')
+
+    trade_history, adj_close_data = load_data(trade_history_path, adj_close_data_path)
+    if trade_history is None or adj_close_data is None:
+        logging.error("Failed to load data. Exiting.")
+        return
+
+    generate_charts(trade_history, adj_close_data, output_folder)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,85 +1,108 @@
+import numpy as np
 import pandas as pd
-from collections import defaultdict
-
-def analyze_stock_transactions(trade_history_path, adj_close_data_path):
+from artifacts import load_artifact
+from fxrates import load_fx_rates
+from pricematrix import load_prices, latest_prices
+from costbasis import cost_basis, trade_sides, MOVING_AVERAGE
+from lotledger import LotLedger
+from portfolio import daily_valuation
+from positions import PositionIndex, POSITIONS_FILE
+from returns import jpy_last_prices, return_report, time_weighted_return
+
+def load_data(trade_history_path, adj_close_data_path):
     # データの読み込み
-    trade_history = pd.read_csv(trade_history_path, parse_dates=['trade_date'])
+    trade_history = load_artifact(trade_history_path, columns=['trade_date', 'security_code', 'transaction_type',
+                                                               'quantity', 'price', 'currency', 'amount_jpy',
+                                                               'account_type'])
     print(trade_history.columns)
-    adj_close_data = pd.read_csv(adj_close_data_path, index_col=0, parse_dates=True)
+    # charts の価格行列（無ければ charts.parquet / .csv）
+    adj_close_data = load_prices(adj_close_data_path)
+    return trade_history, adj_close_data
+
+def transaction_labels(trades, side):
+    # "shares@price" of every buy / sell per security, in trade order
+    labels = trades['quantity'].astype('float64').astype(str) + '@' + trades['price'].astype('float64').map('{:.2f}'.format)
+    codes = trades['security_code'].astype(object)
+    return labels[side == 1].groupby(codes[side == 1], sort=False).agg(', '.join), \
+        labels[side == -1].groupby(codes[side == -1], sort=False).agg(', '.join)
+
+def analyze_stock_transactions(trade_history, adj_close_data, fx_rates=None, method=MOVING_AVERAGE):
+    # 銘柄ごとの損益・保有数量・取得原価（method: 移動平均法 / FIFO / 総平均法）
+    summary = cost_basis(trade_history, method=method)
+    side = trade_sides(trade_history['transaction_type'])
+    buys, sells = transaction_labels(trade_history, side)
+
+    # 現在の価値の計算（最終日の価格だけを読む）
+    valuation_date, last_prices = latest_prices(adj_close_data)
+    codes = summary.index.astype(str)
+    current_price = last_prices.reindex(codes).to_numpy()
+    current_value = summary['remaining_quantity'].to_numpy() * current_price
 
-    # 結果を格納するための辞書
-    results = defaultdict(lambda: {
-        'buys': [], 'sells': [], 'total_profit': 0, 'total_loss': 0,
-        'current_shares': 0, 'current_value': 0
+    # 結果のDataFrameの作成
+    df_results = pd.DataFrame({
+        'Security Code': codes,
+        'Buy Transactions': summary.index.map(buys).fillna(''),
+        'Sell Transactions': summary.index.map(sells).fillna(''),
+        'Total Profit/Loss': summary['realized_pnl'].to_numpy(),
+        'Current Shares': summary['remaining_quantity'].to_numpy(),
+        'Current Value': np.where(np.isnan(current_price), 0, current_value),
+        'Remaining Cost': summary['remaining_cost'].to_numpy(),
+        'Unmatched Sell Quantity': summary['unmatched_sell_quantity'].to_numpy(),
     })
 
-    # 取引履歴の処理
-    for _, trade in trade_history.iterrows():
-        security_code = trade['security_code']
-        transaction_type = trade['transaction_type']
-        # 'shares'の代わりに'quantity'を使用
-        shares = trade['quantity']  # 'shares'を'quantity'に変更
-        price = trade['price']
-        amount = trade['amount_jpy']  # JPYの金額を使用
-
-        if transaction_type == 'Buy':
-            results[security_code]['buys'].append((shares, price))
-            results[security_code]['current_shares'] += shares
-        elif transaction_type == 'Sell':
-            results[security_code]['sells'].append((shares, price))
-            results[security_code]['current_shares'] -= shares
-
-            # 利益/損失の計算の前に、'buys'が空でないことを確認
-            if results[security_code]['buys']:
-                avg_buy_price = sum(buy[0] * buy[1] for buy in results[security_code]['buys']) / sum(buy[0] for buy in results[security_code]['buys'])
-                profit_loss = (price - avg_buy_price) * shares  # 価格はJPYで計算
-                if profit_loss > 0:
-                    results[security_code]['total_profit'] += profit_loss
-                else:
-                    results[security_code]['total_loss'] += abs(profit_loss)
-            else:
-                print(f"No buy transactions for {security_code}. Skipping profit/loss calculation.")
-
-    # 現在の価値の計算
-    for security_code, data in results.items():
-        if security_code in adj_close_data.columns:
-            current_price = adj_close_data[str(security_code)].iloc[-1]
-            data['current_value'] = data['current_shares'] * current_price
-
-    # 結果のDataFrameの作成
-    df_results = pd.DataFrame([
-        {
-            'Security Code': security_code,
-            'Buy Transactions': ', '.join([f"{shares}@{price:.2f}" for shares, price in data['buys']]),
-            'Sell Transactions': ', '.join([f"{shares}@{price:.2f}" for shares, price in data['sells']]),
-            'Total Profit/Loss': data['total_profit'] - data['total_loss'],  # 合計利益/損失を1つのカラムに
-            'Current Shares': data['current_shares'],
-            'Current Value': data['current_value']
-        }
-        for security_code, data in results.items()
-    ])
+    # 現在価値を円換算（最終価格日時点のレート）
+    if fx_rates is not None and not df_results.empty:
+        currency = trade_history.groupby('security_code', observed=True)['currency'].last()
+        rate = fx_rates.rate_to(df_results['Security Code'].map(currency), [valuation_date] * len(df_results))
+        df_results['Current Value (JPY)'] = df_results['Current Value'] * rate
 
     return df_results
 
 # 使用例
-trade_history_path = r'C:\Users\100ca\Documents\PyCode\TRADEHISTORY\trade_history4.csv'
-adj_close_data_path = r'C:\Users\100ca\Documents\PyCode\trahist\DIC\charts.csv'
-
-result_table = analyze_stock_transactions(trade_history_path, adj_close_data_path)
-print(result_table)
-
-# CSVファイルとして保存
+trade_history_path = r'C:\Users\100ca\Documents\PyCode\TRADEHISTORY\trade_history4'
+adj_close_data_path = r'C:\Users\100ca\Documents\PyCode\trahist\DIC\charts'
+forex_data_path = r'C:\Users\100ca\Documents\PyCode\TRADEHISTORY\DIC\forex_data'
 output_path = r'C:\Users\100ca\Documents\PyCode\trahist\stock_transaction_analysis.csv'
-result_table.to_csv(output_path, index=False)
-print(f"結果を {output_path} に保存しました。")
-
-
-
-result_table = analyze_stock_transactions(trade_history_path, adj_close_data_path)
-print(result_table)
-
-# CSVファイルとして保存
-output_path = r'C:\Users\100ca\Documents\PyCode\trahist\stock_transaction_analysis.csv'
-result_table.to_csv(output_path, index=False)
-print(f"結果を {output_path} に保存しました。")
-
+lot_output_path = r'C:\Users\100ca\Documents\PyCode\trahist\lot_realized_gains.csv'
+nav_output_path = r'C:\Users\100ca\Documents\PyCode\trahist\portfolio_nav.csv'
+exposure_output_path = r'C:\Users\100ca\Documents\PyCode\trahist\portfolio_exposure.csv'
+xirr_output_path = r'C:\Users\100ca\Documents\PyCode\trahist\returns_xirr.csv'
+twr_output_path = r'C:\Users\100ca\Documents\PyCode\trahist\returns_twr.csv'
+
+def main():
+    trade_history, adj_close_data = load_data(trade_history_path, adj_close_data_path)
+    fx_rates = load_fx_rates(forex_data_path)
+    result_table = analyze_stock_transactions(trade_history, adj_close_data, fx_rates=fx_rates)
+    print(result_table)
+
+    # CSVファイルとして保存
+    result_table.to_csv(output_path, index=False)
+    print(f"結果を {output_path} に保存しました。")
+
+    # 税務用: 売却ごとに消化した買付ロット・保有期間・損益（FIFO、口座区分ごと、円建て）
+    ledger = LotLedger.from_trades(trade_history, amount_column='amount_jpy')
+    ledger.realized.to_csv(lot_output_path, index=False, encoding='utf-8-sig')
+    print(f"ロット別の実現損益を {lot_output_path} に保存しました。")
+
+    # 日次の時価評価（NAV・資金フロー・銘柄別の円建て評価額）
+    nav, exposure, _ = daily_valuation(trade_history, adj_close_data, fx_rates=fx_rates)
+    nav.to_csv(nav_output_path)
+    exposure.to_csv(exposure_output_path)
+    print(f"日次NAVを {nav_output_path} に保存しました。")
+
+    # 運用成績: 銘柄・口座区分・ポートフォリオ全体のXIRR（金額加重）と日次NAVからのTWR（時間加重）
+    valuation_date, last_prices_jpy = jpy_last_prices(trade_history, adj_close_data, fx_rates)
+    xirr_report = return_report(trade_history, last_prices_jpy, valuation_date, ledger=ledger)
+    xirr_report.to_csv(xirr_output_path, encoding='utf-8-sig')
+    twr, twr_annualized = time_weighted_return(nav)
+    twr.to_csv(twr_output_path)
+    print(xirr_report.loc['portfolio'])
+    print(f"TWR（年率）: {twr_annualized:.2%}")
+    print(f"XIRR / TWR を {xirr_output_path} / {twr_output_path} に保存しました。")
+
+    # 任意の日付の保有数量・取得原価を再計算なしで引けるよう、ポジション索引を保存
+    PositionIndex.from_trades(trade_history).save(POSITIONS_FILE)
+    print(f"ポジション索引を {POSITIONS_FILE} に保存しました。")
+
+if __name__ == "__main__":
+    main()
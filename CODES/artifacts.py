@@ -0,0 +1,254 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from dateparse import LOCAL_TZ, parse_date_column
+
+logger = logging.getLogger(__name__)
+
+# Columnar format used for the pipeline artifacts; CSV copies are optional and only for people
+COLUMNAR_FORMAT = 'parquet'
+
+# Fixed column types of the trade tables (integrated, trade_history3/4).
+# Columns that are not present are skipped, extra columns keep their inferred type.
+# Only the ID and label columns are compacted: labels with a handful of distinct values
+# are categoricals. All numbers stay float64; amount_jpy is recomputed from price and the
+# FX rates, and float32 would already turn a price of 430.12 into 430.119995.
+TRADE_SCHEMA = {
+    'trade_date': 'datetime64[ns]',
+    'settlement_date': 'datetime64[ns]',
+    'security_code': 'category',
+    'security_name': 'category',
+    'transaction_type': 'category',
+    'quantity': 'float64',
+    'price': 'float64',
+    'settlement_amount': 'float64',
+    'currency': 'category',
+    'account_type': 'category',
+    'data_source': 'category',
+    'investment_type': 'category',
+    'from_currency': 'category',
+    'to_currency': 'category',
+    'from_amount': 'float64',
+    'to_amount': 'float64',
+    'exchange_rate': 'float64',
+    'amount_jpy': 'float64',
+    'USDJPY': 'float64',
+    'EURJPY': 'float64',
+    # Pair rates and transfer ID of the Wise store (0wise.py), carried into the integrated history
+    'EURJPY=X': 'float64',
+    'USDJPY=X': 'float64',
+    'EURUSD=X': 'float64',
+    'ID': 'category',
+}
+
+
+def apply_schema(df, schema=TRADE_SCHEMA):
+    df = df.copy()
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        if dtype.startswith('datetime64'):
+            # Trade and settlement dates keep the calendar day they have in Japan
+            df[col] = parse_date_column(df[col], tz=LOCAL_TZ)
+        elif dtype == 'category':
+            values = df[col]
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                # Codes come in as a mix of ints and strings; categories are always strings
+                values = values.where(values.isna(), values.astype(str))
+            df[col] = values.astype('category')
+        else:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(dtype)
+    return df
+
+
+def apply_price_schema(df):
+    # Wide price frames (charts, forex): DatetimeIndex x float64 columns
+    df = df.copy()
+    if not isinstance(df.index, pd.DatetimeIndex):
+        # Quotes are dated by UTC midnight ('2024-01-05 00:00:00+00:00'), kept as naive UTC days
+        df.index = pd.DatetimeIndex(parse_date_column(pd.Series(df.index)))
+    df.index.name = df.index.name or 'Date'
+    return df.apply(pd.to_numeric, errors='coerce').astype('float64')
+
+
+def recode_category(values, mapping, default):
+    """``values.map(mapping).fillna(default)`` that looks up each category once and stays categorical."""
+    values = values if isinstance(values.dtype, pd.CategoricalDtype) else values.astype('category')
+    labels = [mapping.get(cat, default) for cat in values.cat.categories]
+    # Missing values have code -1, which picks the trailing default
+    recoded = np.array(labels + [default], dtype=object)[values.cat.codes.to_numpy()]
+    return pd.Series(recoded, index=values.index, name=values.name, dtype='category')
+
+
+def memory_report(before, after):
+    """Bytes per column of two versions of a frame, with the totals in the last row."""
+    report = pd.DataFrame({
+        'dtype_before': before.dtypes.astype(str),
+        'bytes_before': before.memory_usage(index=False, deep=True),
+        'dtype_after': after.dtypes.astype(str),
+        'bytes_after': after.memory_usage(index=False, deep=True),
+    })
+    report.loc['TOTAL'] = ['', report['bytes_before'].sum(), '', report['bytes_after'].sum()]
+    report['ratio'] = (report['bytes_before'] / report['bytes_after']).round(1)
+    return report
+
+
+def compact_frame(df, schema=TRADE_SCHEMA, name='trade table'):
+    """apply_schema plus a log of the memory saved."""
+    compact = apply_schema(df, schema)
+    report = memory_report(df, compact)
+    logger.info(f"Memory of {name} by column:\n{report.to_string()}")
+    return compact
+
+
+def categories_to_object(df):
+    """Turn categorical columns back into plain object columns for stages that relabel values."""
+    df = df.copy()
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+    return df
+
+
+def _columnar_available():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def write_table(df, path, index=False):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.parquet':
+        df.to_parquet(path, index=index)
+    elif ext == '.feather':
+        # Feather cannot store an index, keep it as a regular column
+        (df.reset_index() if index else df.reset_index(drop=True)).to_feather(path)
+    elif ext == '.csv':
+        df.to_csv(path, index=index, encoding='utf-8')
+    else:
+        raise ValueError(f"Unsupported table format: {path}")
+
+
+def read_table(path, columns=None, index_col=None):
+    """Read a table, loading only ``columns`` when given."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.parquet':
+        df = pd.read_parquet(path, columns=columns)
+    elif ext == '.feather':
+        df = pd.read_feather(path, columns=None if columns is None else
+                             ([index_col] if index_col else []) + list(columns))
+    elif ext == '.csv':
+        usecols = None if columns is None else ([index_col] if index_col else []) + list(columns)
+        df = pd.read_csv(path, usecols=usecols)
+    else:
+        raise ValueError(f"Unsupported table format: {path}")
+    if index_col is not None and index_col in df.columns:
+        df = df.set_index(index_col)
+    return df
+
+
+def save_artifact(df, stem, schema=TRADE_SCHEMA, csv=True, index=False):
+    """Write ``stem.parquet`` (or feather) with the fixed schema, plus ``stem.csv`` when ``csv`` is set.
+
+    ``schema=None`` treats the frame as a wide price table.
+    """
+    df = apply_schema(df, schema) if schema is not None else apply_price_schema(df)
+    paths = []
+    if _columnar_available():
+        paths.append(f'{stem}.{COLUMNAR_FORMAT}')
+        write_table(df, paths[-1], index=index)
+    else:
+        logger.warning("pyarrow is not installed, writing CSV only")
+        csv = True
+    if csv:
+        paths.append(f'{stem}.csv')
+        write_table(df, paths[-1], index=index)
+    logger.info(f"Saved {len(df)} rows to {', '.join(paths)}")
+    return df
+
+
+def _arrow_schema(columns, schema):
+    import pyarrow as pa
+    types = {'category': pa.dictionary(pa.int32(), pa.string()), 'datetime64[ns]': pa.timestamp('ns')}
+    return pa.schema([(col, types.get(schema[col], pa.float64()) if col in schema else pa.string())
+                      for col in columns])
+
+
+class ArtifactWriter:
+    """save_artifact for frames arriving in chunks: every chunk gets the fixed schema and is appended.
+
+    The parquet file is written through a pyarrow ParquetWriter with one
+    fixed arrow schema (categoricals as string dictionaries), so chunks whose
+    categories differ still land in one typed file. Columns that are not in
+    ``schema`` have no type a chunk could be trusted to agree on and are
+    written as strings.
+    """
+
+    def __init__(self, stem, columns, schema=TRADE_SCHEMA, csv=True):
+        self.stem = stem
+        self.columns = list(columns)
+        self.schema = schema
+        self.csv = csv
+        self.rows = 0
+        self.paths = []
+        self._parquet = None
+        self._csv_file = None
+        if _columnar_available():
+            import pyarrow.parquet as pq
+            self._arrow_schema = _arrow_schema(self.columns, schema)
+            self.paths.append(f'{stem}.{COLUMNAR_FORMAT}')
+            self._parquet = pq.ParquetWriter(self.paths[-1], self._arrow_schema)
+        else:
+            logger.warning("pyarrow is not installed, writing CSV only")
+            self.csv = True
+        if self.csv:
+            self.paths.append(f'{stem}.csv')
+            self._csv_file = open(self.paths[-1], 'w', encoding='utf-8', newline='')
+            self._csv_file.write(','.join(self.columns) + '\n')
+
+    def write(self, df):
+        if df is None or df.empty:
+            return
+        df = apply_schema(df.reindex(columns=self.columns), self.schema)
+        for col in self.columns:
+            if col not in self.schema:
+                df[col] = df[col].where(df[col].isna(), df[col].astype(str)).astype(object)
+        if self._parquet is not None:
+            import pyarrow as pa
+            self._parquet.write_table(pa.Table.from_pandas(df, schema=self._arrow_schema, preserve_index=False))
+        if self._csv_file is not None:
+            df.to_csv(self._csv_file, header=False, index=False)
+        self.rows += len(df)
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
+        if self._csv_file is not None:
+            self._csv_file.close()
+            self._csv_file = None
+        logger.info(f"Saved {self.rows} rows to {', '.join(self.paths)}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_artifact(stem, columns=None, schema=TRADE_SCHEMA, index_col=None):
+    """Load an artifact, preferring the typed columnar file over the CSV copy."""
+    for ext in ('parquet', 'feather', 'csv'):
+        path = f'{stem}.{ext}'
+        if os.path.exists(path) and (ext == 'csv' or _columnar_available()):
+            df = read_table(path, columns=columns, index_col=index_col)
+            if ext == 'csv':
+                # CSV loses the types, restore them
+                df = apply_schema(df, schema) if schema is not None else apply_price_schema(df)
+            return df
+    raise FileNotFoundError(f"No artifact found for {stem}")
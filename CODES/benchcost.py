@@ -0,0 +1,122 @@
+import logging
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from costbasis import FIFO, METHODS, MOVING_AVERAGE, TOTAL_AVERAGE, cost_basis
+from lotledger import LotLedger
+
+
+def make_trades(n, n_securities=2000, seed=0):
+    """Synthetic trade history: buys and smaller sells over 8 years, sorted by trade date."""
+    rng = np.random.default_rng(seed)
+    codes = np.array([f'{1000 + i}' for i in range(n_securities)], dtype=object)
+    side = rng.choice(['Buy', 'Sell'], n, p=[0.6, 0.4])
+    quantity = np.where(side == 'Buy', rng.integers(1, 20, n), rng.integers(1, 12, n)) * 100.0
+    trades = pd.DataFrame({
+        'trade_date': pd.Timestamp('2017-01-01') + pd.to_timedelta(rng.integers(0, 8 * 365, n), unit='D'),
+        'security_code': codes[rng.integers(0, n_securities, n)],
+        'transaction_type': side,
+        'quantity': quantity,
+        'price': rng.uniform(100, 5000, n).round(1),
+    })
+    return trades.sort_values('trade_date', kind='stable').reset_index(drop=True)
+
+
+def reference(trades, method):
+    # Straightforward per-security lists, to check the engine on a sample
+    out = {}
+    for code, group in trades.groupby('security_code', sort=False):
+        lots, realized, unmatched = [], 0.0, 0.0
+        for year, rows in group.groupby(group['trade_date'].dt.year):
+            if method == TOTAL_AVERAGE:
+                qty = sum(q for q, _ in lots) + rows.loc[rows['transaction_type'] == 'Buy', 'quantity'].sum()
+                cost = sum(q * p for q, p in lots) + (rows['quantity'] * rows['price'])[rows['transaction_type'] == 'Buy'].sum()
+                avg = cost / qty if qty else 0.0
+                for q, p, t in zip(rows['quantity'], rows['price'], rows['transaction_type']):
+                    if t == 'Sell':
+                        sold = min(q, qty)
+                        realized += (p - avg) * sold
+                        unmatched += q - sold
+                        qty -= sold
+                lots = [(qty, avg)] if qty else []
+                continue
+            for q, p, t in zip(rows['quantity'], rows['price'], rows['transaction_type']):
+                if t == 'Buy':
+                    lots.append((q, p))
+                    continue
+                held = sum(lq for lq, _ in lots)
+                sold = min(q, held)
+                unmatched += q - sold
+                if method == MOVING_AVERAGE and held:
+                    avg = sum(lq * lp for lq, lp in lots) / held
+                    realized += (p - avg) * sold
+                    lots = [(held - sold, avg)] if held - sold else []
+                elif method == FIFO:
+                    remaining = sold
+                    while remaining:
+                        lq, lp = lots[0]
+                        take = min(lq, remaining)
+                        realized += (p - lp) * take
+                        remaining -= take
+                        lots = ([(lq - take, lp)] if lq - take else []) + lots[1:]
+        out[code] = (realized, sum(q for q, _ in lots), sum(q * p for q, p in lots), unmatched)
+    return pd.DataFrame.from_dict(out, orient='index',
+                                  columns=['realized_pnl', 'remaining_quantity', 'remaining_cost',
+                                           'unmatched_sell_quantity'])
+
+
+def legacy_profit(trade_history):
+    # The iterrows loop of the old analyze_stock_transactions (average over every buy ever made)
+    results = defaultdict(lambda: {'buys': [], 'total': 0.0})
+    for _, trade in trade_history.iterrows():
+        data = results[trade['security_code']]
+        if trade['transaction_type'] == 'Buy':
+            data['buys'].append((trade['quantity'], trade['price']))
+        elif data['buys']:
+            avg = sum(q * p for q, p in data['buys']) / sum(q for q, _ in data['buys'])
+            data['total'] += (trade['price'] - avg) * trade['quantity']
+    return results
+
+
+def timed(label, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36}{elapsed:8.2f}s")
+    return result, elapsed
+
+
+def main(n=1_000_000, check_rows=20_000):
+    # Random sells often exceed the holdings; the engine would warn once per run
+    logging.getLogger('costbasis').setLevel(logging.ERROR)
+    logging.getLogger('lotledger').setLevel(logging.ERROR)
+    trades = make_trades(n)
+    print(f"Synthetic trade history: {n} trades, {trades['security_code'].nunique()} securities")
+    for method in METHODS:
+        timed(f'cost_basis {method}', cost_basis, trades, method=method)
+    ledger, _ = timed('LotLedger (FIFO lots)', LotLedger.from_trades, trades)
+    print(f"{len(ledger.realized)} lot sales, {len(ledger.open_lots)} open lots")
+    gains = ledger.realized.groupby('security_code')['gain'].sum()
+    fifo = cost_basis(trades, method=FIFO)['realized_pnl']
+    np.testing.assert_allclose(gains.reindex(fifo.index, fill_value=0.0), fifo, rtol=1e-9, atol=1e-6)
+    print("Lot gains add up to the FIFO realized P&L per security")
+
+    sample = make_trades(check_rows, n_securities=50, seed=1)
+    for method in METHODS:
+        engine = cost_basis(sample, method=method)[['realized_pnl', 'remaining_quantity', 'remaining_cost',
+                                                    'unmatched_sell_quantity']]
+        pd.testing.assert_frame_equal(engine, reference(sample, method).loc[engine.index],
+                                      check_names=False, check_index_type=False, rtol=1e-9)
+    print(f"All methods match the reference implementation on {len(sample)} trades")
+
+    _, legacy_secs = timed(f'legacy iterrows ({len(sample)} trades)', legacy_profit, sample)
+    print(f"Legacy extrapolated to {n} trades (50 securities): {legacy_secs * n / len(sample):.0f}s or more, "
+          f"quadratic in the buys per security")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
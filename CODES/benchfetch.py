@@ -0,0 +1,64 @@
+import logging
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from pricefetch import CannedProvider, ConcurrentFetcher
+
+
+def make_prices(n_symbols, start='2019-01-01', end='2024-12-31', seed=0):
+    """Canned daily OHLC for ``n_symbols`` synthetic tickers."""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, end, name='Date')
+    prices = {}
+    for i in range(n_symbols):
+        close = 1000 * np.exp(np.cumsum(rng.normal(0, 0.01, len(dates))))
+        prices[f'{1000 + i}.T'] = pd.DataFrame({'Close': close, 'Adj Close': close}, index=dates)
+    return prices
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40}{elapsed:8.2f}s")
+    return result, elapsed
+
+
+def serial_fetch(provider, symbols, start, end):
+    # The old loops: one synchronous request per symbol, and any error stops the run
+    out = {}
+    for symbol in symbols:
+        out.update(provider.fetch([symbol], start, end))
+    return out
+
+
+def main(n_symbols=200, latency=0.05):
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    prices = make_prices(n_symbols)
+    symbols = list(prices)
+    start, end = pd.Timestamp('2020-01-01'), pd.Timestamp('2024-12-31')
+    print(f"{n_symbols} canned symbols, {latency * 1000:.0f}ms per request")
+
+    serial, _ = timed('serial, one request per symbol', serial_fetch, CannedProvider(prices, latency), symbols, start, end)
+    fetcher = ConcurrentFetcher(CannedProvider(prices, latency), batch_size=10, max_workers=8)
+    batched, _ = timed('concurrent, batches of 10 on 8 threads', fetcher.fetch, symbols, start, end)
+    assert batched.keys() == serial.keys()
+    for symbol in symbols:
+        pd.testing.assert_frame_equal(batched[symbol], serial[symbol])
+
+    # A flaky symbol, a bad ticker, a stalled response and a ticker without data in one run
+    provider = CannedProvider(prices, latency,
+                              failures={symbols[3]: 1, symbols[5]: float('inf')},
+                              delays={symbols[40]: 5.0})
+    fetcher = ConcurrentFetcher(provider, batch_size=10, max_workers=8, retries=2, backoff=0.1, timeout=1.0)
+    result, _ = timed('concurrent, with failures', fetcher.fetch, symbols + ['XXXX'], start, end)
+    print(f"{len(result)} of {n_symbols + 1} symbols fetched in {len(provider.requests)} requests")
+    print(fetcher.failure_report().to_string(index=False))
+    return result
+
+
+if __name__ == "__main__":
+    main(*(float(arg) if '.' in arg else int(arg) for arg in sys.argv[1:]))
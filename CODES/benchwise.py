@@ -0,0 +1,106 @@
+import importlib
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+wise = importlib.import_module('0wise')
+
+
+def make_transfers(n, seed=0):
+    """Synthetic Wise export with the raw Japanese column names."""
+    rng = np.random.default_rng(seed)
+    currencies = np.array(['JPY', 'USD', 'EUR', 'GBP', None], dtype=object)
+    weights = [0.45, 0.3, 0.2, 0.04, 0.01]
+    from_currency = rng.choice(currencies, n, p=weights)
+    to_currency = rng.choice(currencies, n, p=weights)
+    rate = rng.uniform(0.005, 170.0, n).round(6)
+    from_amount = rng.uniform(1, 1_000_000, n).round(2)
+    dates = pd.Timestamp('2018-01-01') + pd.to_timedelta(rng.integers(0, 6 * 365 * 86400, n), unit='s')
+    return pd.DataFrame({
+        'ステータス': rng.choice(['COMPLETED', 'CANCELLED'], n, p=[0.95, 0.05]),
+        '送金の種類': rng.choice(['NEUTRAL', 'OUT'], n, p=[0.9, 0.1]),
+        '完了日': dates.strftime('%Y-%m-%d %H:%M:%S'),
+        '為替レート': rate,
+        '送金元通貨.1': from_currency,
+        '受取通貨': to_currency,
+        '送金額（手数料差し引き後）': from_amount,
+        '受取額（手数料差し引き後）': (from_amount * rate).round(2),
+    })
+
+
+class LegacyWiseDataCleaner(wise.WiseDataCleaner):
+    """The row-wise clean_data this benchmark replaces, kept to check the output."""
+
+    def clean_data(self, df):
+        df = df.rename(columns={
+            '完了日': 'trade_date',
+            '為替レート': 'exchange_rate',
+            '送金元通貨.1': 'from_currency',
+            '受取通貨': 'to_currency',
+            '送金額（手数料差し引き後）': 'from_amount',
+            '受取額（手数料差し引き後）': 'to_amount'
+        })
+        df['trade_date'] = pd.to_datetime(df['trade_date'])
+        df['exchange_rate'] = pd.to_numeric(df['exchange_rate'], errors='coerce')
+        df['from_amount'] = pd.to_numeric(df['from_amount'], errors='coerce')
+        df['to_amount'] = pd.to_numeric(df['to_amount'], errors='coerce')
+        for pair in ['EURJPY=X', 'USDJPY=X', 'EURUSD=X']:
+            df[pair] = df.apply(
+                lambda row: row['exchange_rate'] if self.generate_security_code(row['from_currency'], row['to_currency']) == pair else None,
+                axis=1
+            )
+        df['transaction_type'] = df.apply(lambda row: 'Buy' if row['to_currency'] in ['USD', 'EUR'] else 'Sell', axis=1)
+        df['security_code'] = df.apply(lambda row: self.generate_security_code(row['from_currency'], row['to_currency']), axis=1)
+        df['amount_jpy'] = df.apply(self.legacy_jpy_amount, axis=1)
+        return df
+
+    def legacy_jpy_amount(self, row):
+        if row['to_currency'] == 'JPY':
+            return row['to_amount']
+        elif row['from_currency'] == 'JPY':
+            return row['from_amount']
+        elif row['security_code'] == 'USDJPY=X':
+            return row['to_amount'] * row['USDJPY=X'] if pd.notnull(row['USDJPY=X']) else None
+        elif row['security_code'] == 'EURJPY=X':
+            return row['to_amount'] * row['EURJPY=X'] if pd.notnull(row['EURJPY=X']) else None
+        else:
+            return None
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32}{elapsed:8.2f}s")
+    return result, elapsed
+
+
+def main(n=1_000_000, check_rows=20_000):
+    # The vectorized cleaner logs one warning per run, the legacy one would log per row
+    wise.logger.setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as tmp:
+        input_file = os.path.join(tmp, 'wizefx.csv')
+        make_transfers(n).to_csv(input_file, index=False)
+        print(f"Synthetic Wise export: {n} transfers, {os.path.getsize(input_file) / 1e6:.1f} MB")
+
+        cleaner = wise.WiseDataCleaner(input_file, tmp)
+        raw, _ = timed('read_data', cleaner.read_data)
+        cleaned, vec_secs = timed(f'clean_data ({len(raw)} rows)', cleaner.clean_data, raw)
+
+        sample = raw.iloc[:check_rows]
+        legacy, legacy_secs = timed(f'legacy clean_data ({len(sample)} rows)',
+                                    LegacyWiseDataCleaner(input_file, tmp).clean_data, sample)
+        pd.testing.assert_frame_equal(cleaner.clean_data(sample), legacy, check_dtype=False)
+        print(f"Output matches the row-wise cleaner on {len(sample)} rows")
+        print(f"Legacy extrapolated to {len(raw)} rows: {legacy_secs * len(raw) / len(sample):.1f}s "
+              f"({legacy_secs * len(raw) / len(sample) / vec_secs:.0f}x slower)")
+        return cleaned
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
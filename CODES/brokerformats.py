@@ -0,0 +1,152 @@
+import csv
+import os
+
+import pandas as pd
+
+from textencoding import sniff_encoding, transcoded_path
+
+# Only this many bytes are read to recognise a file and find its header row
+SNIFF_BYTES = 8192
+
+
+class BrokerFormat:
+    def __init__(self, name, broker, columns, signature, constants=None,
+                 encoding='cp932', post_process=None):
+        self.name = name
+        self.broker = broker
+        # Source column -> standard column
+        self.columns = columns
+        # Standard columns that the export does not carry, e.g. a fixed currency
+        self.constants = constants or {}
+        # Header cells that identify the export and must all be present. Other mapped
+        # columns are optional: a file without them still matches, the column is None
+        self.signature = list(signature)
+        # Preferred encoding; a file that turns out to be UTF-8 is still read as UTF-8
+        self.encoding = encoding
+        self.post_process = post_process
+
+    def matches(self, header_cells):
+        return all(col in header_cells for col in self.signature)
+
+    def normalize(self, df):
+        df = df.rename(columns=self.columns)
+        for col in self.columns.values():
+            if col not in df.columns:
+                df[col] = None
+        for col, value in self.constants.items():
+            df[col] = value
+        if self.post_process is not None:
+            df = self.post_process(df)
+        return df
+
+    def __repr__(self):
+        return f"BrokerFormat({self.name!r}, broker={self.broker!r})"
+
+
+FORMATS = []
+
+
+def register_format(fmt):
+    FORMATS.append(fmt)
+    return fmt
+
+
+def _extract_ticker(df):
+    df['security_code'] = df['security_name'].str.extract(r'(\w+) / ', expand=False)
+    return df
+
+
+register_format(BrokerFormat(
+    'rakuten_invst', 'rakuten',
+    {'約定日': 'trade_date', '受渡日': 'settlement_date', 'ファンド名': 'security_name',
+     '取引': 'transaction_type', '数量［口］': 'quantity', '単価': 'price',
+     '受渡金額/(ポイント利用)[円]': 'settlement_amount', '決済通貨': 'currency', '口座': 'account_type'},
+    signature=['約定日', 'ファンド名', '数量［口］'],
+    constants={'security_code': ''}))
+
+register_format(BrokerFormat(
+    'rakuten_jp', 'rakuten',
+    {'約定日': 'trade_date', '受渡日': 'settlement_date', '銘柄コード': 'security_code',
+     '銘柄名': 'security_name', '売買区分': 'transaction_type', '数量［株］': 'quantity',
+     '単価［円］': 'price', '受渡金額［円］': 'settlement_amount', '口座区分': 'account_type'},
+    signature=['約定日', '銘柄コード', '銘柄名', '数量［株］', '単価［円］'],
+    constants={'currency': 'JPY'}))
+
+register_format(BrokerFormat(
+    'rakuten_us', 'rakuten',
+    {'約定日': 'trade_date', '受渡日': 'settlement_date', 'ティッカー': 'security_code',
+     '銘柄名': 'security_name', '売買区分': 'transaction_type', '数量［株］': 'quantity',
+     '単価［USドル］': 'price', '受渡金額［円］': 'settlement_amount', '口座': 'account_type'},
+    signature=['約定日', 'ティッカー', '数量［株］', '単価［USドル］'],
+    constants={'currency': 'USD'}))
+
+register_format(BrokerFormat(
+    'sbi_savefile', 'sbi',
+    {'約定日': 'trade_date', '受渡日': 'settlement_date', '銘柄コード': 'security_code',
+     '銘柄': 'security_name', '取引': 'transaction_type', '約定数量': 'quantity',
+     '約定単価': 'price', '受渡金額/決済損益': 'settlement_amount', '預り': 'account_type'},
+    signature=['約定日', '銘柄コード', '銘柄', '約定数量'],
+    constants={'currency': 'JPY'}))
+
+register_format(BrokerFormat(
+    'sbi_yakujo', 'sbi',
+    {'国内約定日': 'trade_date', '国内受渡日': 'settlement_date', '銘柄名': 'security_name',
+     '取引': 'transaction_type', '約定数量': 'quantity', '約定単価': 'price',
+     '受渡金額': 'settlement_amount', '通貨': 'currency', '預り区分': 'account_type'},
+    signature=['国内約定日', '銘柄名', '約定数量'],
+    post_process=_extract_ticker))
+
+
+def detect_format(file_path, sample_size=SNIFF_BYTES):
+    """Return (format, header_row, encoding) by looking for a known header in the first bytes of the file."""
+    with open(file_path, 'rb') as f:
+        sample = f.read(sample_size)
+    truncated = len(sample) == sample_size
+    samples = {}
+    for fmt in FORMATS:
+        if fmt.encoding not in samples:
+            encoding = sniff_encoding(sample, fmt.encoding, truncated)
+            lines = sample.decode(encoding, errors='ignore').splitlines()
+            # The last line of a full sample may be cut off mid-row
+            samples[fmt.encoding] = encoding, lines[:-1] if truncated else lines
+        encoding, lines = samples[fmt.encoding]
+        for row, line in enumerate(lines):
+            cells = {cell.strip() for cell in next(csv.reader([line]), [])}
+            if fmt.matches(cells):
+                return fmt, row, encoding
+    raise ValueError(f"Unknown file format: {os.path.basename(file_path)}")
+
+
+def detect_broker_format(file_path, broker=None):
+    """detect_format, additionally rejecting a file recognised as another broker's export."""
+    fmt, header_row, encoding = detect_format(file_path)
+    if broker is not None and fmt.broker != broker:
+        raise ValueError(f"{os.path.basename(file_path)} looks like a {fmt.broker} export ({fmt.name}), "
+                         f"not {broker}")
+    return fmt, header_row, encoding
+
+
+def _open_source(file_path, broker, transcode_dir):
+    fmt, header_row, encoding = detect_broker_format(file_path, broker)
+    if transcode_dir is not None and encoding not in ('utf-8', 'utf-8-sig'):
+        return fmt, header_row, transcoded_path(file_path, transcode_dir, encoding), 'utf-8'
+    return fmt, header_row, file_path, encoding
+
+
+def read_broker_csv(file_path, broker=None, transcode_dir=None):
+    """Read a broker export with detected header offset and standard column names.
+
+    With ``transcode_dir``, the file is decoded once into a cached UTF-8 copy
+    keyed by its content hash and encoding and read from there.
+    """
+    fmt, header_row, path, encoding = _open_source(file_path, broker, transcode_dir)
+    df = pd.read_csv(path, encoding=encoding, skiprows=header_row)
+    return fmt, fmt.normalize(df)
+
+
+def iter_broker_csv(file_path, chunksize, broker=None, transcode_dir=None):
+    """Like read_broker_csv, but yield (format, chunk) pairs of at most ``chunksize`` rows."""
+    fmt, header_row, path, encoding = _open_source(file_path, broker, transcode_dir)
+    with pd.read_csv(path, encoding=encoding, skiprows=header_row, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield fmt, fmt.normalize(chunk)
@@ -0,0 +1,171 @@
+import logging
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MOVING_AVERAGE = 'moving_average'   # 移動平均法
+FIFO = 'fifo'                       # 先入先出法
+TOTAL_AVERAGE = 'total_average'     # 総平均法 (one average unit cost per calendar year)
+METHODS = [MOVING_AVERAGE, FIFO, TOTAL_AVERAGE]
+
+SUMMARY_COLUMNS = ['realized_pnl', 'remaining_quantity', 'remaining_cost', 'average_cost',
+                   'unmatched_sell_quantity', 'buy_count', 'sell_count']
+
+
+def trade_sides(transaction_type):
+    """+1 for buys, -1 for sells, 0 for anything else; evaluated once per distinct label."""
+    values = pd.Series(transaction_type).astype('category')
+    sides = {label: {'buy': 1, 'sell': -1}.get(str(label).strip().lower(), 0) for label in values.cat.categories}
+    lookup = np.array([sides[label] for label in values.cat.categories] + [0], dtype=np.int8)
+    return lookup[values.cat.codes.to_numpy()]
+
+
+def _grouped(trades, code_column, date_column):
+    # Buys and sells ordered by security, then by trade date (stable, so same-day trades keep file order)
+    side = trade_sides(trades['transaction_type'])
+    keep = (side != 0) & trades[code_column].notna().to_numpy()
+    df = trades.loc[keep]
+    codes, securities = pd.factorize(df[code_column].astype(object), sort=False)
+    dates = pd.to_datetime(df[date_column]).to_numpy() if date_column in df.columns else np.zeros(len(df))
+    order = np.lexsort((dates, codes))
+    return df.index[order], codes[order], securities, side[keep][order], dates[order]
+
+
+def _values(trades, index, amount_column):
+    quantity = trades.loc[index, 'quantity'].to_numpy(dtype=np.float64)
+    if amount_column is None:
+        value = quantity * trades.loc[index, 'price'].to_numpy(dtype=np.float64)
+    else:
+        value = np.abs(trades.loc[index, amount_column].to_numpy(dtype=np.float64))
+    return np.abs(quantity), value
+
+
+def _moving_average(codes, side, quantity, value, n_securities):
+    realized = np.zeros(len(codes))
+    unmatched = np.zeros(len(codes))
+    # Plain lists: element access in the loop is several times faster than on numpy arrays
+    held = [0.0] * n_securities
+    cost = [0.0] * n_securities
+    for i, (code, s, q, v) in enumerate(zip(codes.tolist(), side.tolist(), quantity.tolist(), value.tolist())):
+        if s > 0:
+            held[code] += q
+            cost[code] += v
+        elif held[code] > 0:
+            sold = min(q, held[code])
+            avg = cost[code] / held[code]
+            realized[i] = (v / q) * sold - avg * sold if q else 0.0
+            cost[code] -= avg * sold
+            held[code] -= sold
+            unmatched[i] = q - sold
+        else:
+            unmatched[i] = q
+    return realized, unmatched, np.array(held), np.array(cost)
+
+
+def _fifo(codes, side, quantity, value, n_securities):
+    realized = np.zeros(len(codes))
+    unmatched = np.zeros(len(codes))
+    lots = [deque() for _ in range(n_securities)]
+    for i, (code, s, q, v) in enumerate(zip(codes.tolist(), side.tolist(), quantity.tolist(), value.tolist())):
+        if s > 0:
+            if q > 0:
+                lots[code].append([q, v / q])
+            continue
+        queue = lots[code]
+        remaining = q
+        lot_cost = 0.0
+        while remaining > 0 and queue:
+            lot = queue[0]
+            take = min(remaining, lot[0])
+            lot_cost += take * lot[1]
+            lot[0] -= take
+            remaining -= take
+            if lot[0] <= 0:
+                queue.popleft()
+        sold = q - remaining
+        realized[i] = (v / q) * sold - lot_cost if q else 0.0
+        unmatched[i] = remaining
+    held = np.array([sum(lot[0] for lot in queue) for queue in lots])
+    cost = np.array([sum(lot[0] * lot[1] for lot in queue) for queue in lots])
+    return realized, unmatched, held, cost
+
+
+def _total_average(codes, side, quantity, value, dates, n_securities):
+    # Sells of a year are costed at (opening cost + that year's buys) / (opening quantity + bought quantity)
+    years = pd.DatetimeIndex(dates).year.to_numpy()
+    realized = np.zeros(len(codes))
+    unmatched = np.zeros(len(codes))
+    held = [0.0] * n_securities
+    cost = [0.0] * n_securities
+    codes_list, side_list, quantity_list, value_list = codes.tolist(), side.tolist(), quantity.tolist(), value.tolist()
+    # Rows are sorted by (security, date), so every (security, year) is one contiguous run
+    starts = np.flatnonzero(np.r_[True, (codes[1:] != codes[:-1]) | (years[1:] != years[:-1])])
+    ends = np.r_[starts[1:], len(codes)]
+    buy = side > 0
+    buy_qty = np.add.reduceat(np.where(buy, quantity, 0.0), starts) if len(codes) else np.zeros(0)
+    buy_value = np.add.reduceat(np.where(buy, value, 0.0), starts) if len(codes) else np.zeros(0)
+    for start, end, bq, bv in zip(starts.tolist(), ends.tolist(), buy_qty.tolist(), buy_value.tolist()):
+        code = codes_list[start]
+        pool_qty = held[code] + bq
+        avg = (cost[code] + bv) / pool_qty if pool_qty > 0 else 0.0
+        available = pool_qty
+        for i in range(start, end):
+            if side_list[i] > 0:
+                continue
+            q = quantity_list[i]
+            sold = min(q, available)
+            realized[i] = (value_list[i] / q) * sold - avg * sold if q else 0.0
+            unmatched[i] = q - sold
+            available -= sold
+        held[code] = available
+        cost[code] = available * avg
+    return realized, unmatched, np.array(held), np.array(cost)
+
+
+def realized_by_trade(trades, method=MOVING_AVERAGE, code_column='security_code', date_column='trade_date',
+                      amount_column=None):
+    """Per-trade realized P&L and unmatched sell quantity, plus closing holdings per security.
+
+    Returns (realized Series, unmatched Series, summary frame). Trade values are
+    quantity * price, or ``amount_column`` (e.g. amount_jpy) when given.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown cost basis method {method!r}, expected one of {METHODS}")
+    index, codes, securities, side, dates = _grouped(trades, code_column, date_column)
+    quantity, value = _values(trades, index, amount_column)
+    if method == MOVING_AVERAGE:
+        realized, unmatched, held, cost = _moving_average(codes, side, quantity, value, len(securities))
+    elif method == FIFO:
+        realized, unmatched, held, cost = _fifo(codes, side, quantity, value, len(securities))
+    else:
+        realized, unmatched, held, cost = _total_average(codes, side, quantity, value, dates, len(securities))
+
+    is_buy = side > 0
+    summary = pd.DataFrame({
+        'realized_pnl': np.bincount(codes, realized, len(securities)),
+        'remaining_quantity': held,
+        'remaining_cost': cost,
+        'average_cost': np.divide(cost, held, out=np.full(len(held), np.nan), where=held > 0),
+        'unmatched_sell_quantity': np.bincount(codes, unmatched, len(securities)),
+        'buy_count': np.bincount(codes, is_buy, len(securities)).astype(np.int64),
+        'sell_count': np.bincount(codes, ~is_buy, len(securities)).astype(np.int64),
+    }, index=pd.Index(securities, name=code_column))
+    return pd.Series(realized, index=index), pd.Series(unmatched, index=index), summary
+
+
+def cost_basis(trades, method=MOVING_AVERAGE, code_column='security_code', date_column='trade_date',
+               amount_column=None):
+    """Realized P&L, remaining quantity and cost per security in one pass over the trades.
+
+    ``method`` is MOVING_AVERAGE (移動平均法), FIFO or TOTAL_AVERAGE (総平均法).
+    Sells beyond the quantity held have no cost basis; they are counted in
+    ``unmatched_sell_quantity`` and left out of the P&L.
+    """
+    _, unmatched, summary = realized_by_trade(trades, method, code_column, date_column, amount_column)
+    if (unmatched > 0).any():
+        logger.warning(f"{int((unmatched > 0).sum())} sells exceed the quantity held, "
+                       f"unmatched quantity left out of the P&L")
+    return summary[SUMMARY_COLUMNS]
@@ -0,0 +1,190 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from secmaster import normalize_codes, normalize_names
+
+logger = logging.getLogger(__name__)
+
+# Columns that identify a trade; the same trade exported twice agrees on all of them
+KEY_COLUMNS = ['account_type', 'trade_date', 'security_code', 'transaction_type',
+               'quantity', 'price', 'settlement_amount']
+# Near-duplicates agree on these but differ slightly in price or amount (rounding, fee adjustments)
+NEAR_KEY_COLUMNS = ['account_type', 'trade_date', 'security_code', 'transaction_type', 'quantity']
+
+# Decimals kept per numeric column, so that '1,234.50' and '1234.5' parse to the same key
+DECIMALS = {'quantity': 6, 'price': 4, 'settlement_amount': 2}
+
+
+def normalized_key_frame(df, columns=KEY_COLUMNS):
+    """The key columns of ``df`` in canonical form: NFKC text, trade day, rounded numbers."""
+    key = pd.DataFrame(index=df.index)
+    for col in columns:
+        values = df[col] if col in df.columns else pd.Series(np.nan, index=df.index)
+        if col == 'trade_date':
+            key[col] = pd.to_datetime(values, errors='coerce').dt.floor('D')
+        elif col in DECIMALS:
+            key[col] = pd.to_numeric(values, errors='coerce').round(DECIMALS[col])
+        elif col == 'security_code':
+            # Funds carry no code in the exports; their name identifies them instead
+            codes = normalize_codes(values).replace('', np.nan)
+            if 'security_name' in df.columns:
+                codes = codes.fillna(normalize_names(df['security_name']))
+            key[col] = codes
+        else:
+            key[col] = normalize_names(values)
+    return key
+
+
+def trade_keys(df, columns=KEY_COLUMNS):
+    """64-bit hash per row of the normalized key columns."""
+    return pd.util.hash_pandas_object(normalized_key_frame(df, columns), index=False)
+
+
+def find_duplicates(df, source_column='data_source'):
+    """Key, occurrence and duplicate flag per row; a row is a duplicate of the first file that has it.
+
+    Identical trades within one file are repeat fills, numbered by their
+    occurrence; another file's n-th copy only duplicates the n-th fill.
+    """
+    source = df[source_column].astype(object).fillna('')
+    marks = pd.DataFrame({'source': source, 'key': trade_keys(df)}, index=df.index)
+    marks['occurrence'] = marks.groupby(['source', 'key'], sort=False).cumcount()
+    marks['duplicate'] = marks.duplicated(['key', 'occurrence'], keep='first')
+    marks['duplicate_of'] = marks.groupby(['key', 'occurrence'], sort=False)['source'].transform('first')
+    marks.loc[~marks['duplicate'], 'duplicate_of'] = None
+    return marks
+
+
+def duplicate_rows(df, marks, source_column='data_source'):
+    """trade_date, file and the file it duplicates of every duplicate row."""
+    return df.loc[marks['duplicate'], ['trade_date']].assign(
+        **{source_column: marks.loc[marks['duplicate'], 'source'],
+           'duplicate_of': marks.loc[marks['duplicate'], 'duplicate_of']})
+
+
+def overlap_report(df, marks, source_column='data_source'):
+    """One row per (file, file it overlaps with): duplicate rows and their date range."""
+    return overlap_table(duplicate_rows(df, marks, source_column), marks['source'].value_counts(), source_column)
+
+
+def overlap_table(dup, rows_per_file, source_column='data_source'):
+    report = dup.groupby([source_column, 'duplicate_of']).agg(
+        duplicate_rows=('trade_date', 'size'), first_date=('trade_date', 'min'), last_date=('trade_date', 'max'))
+    report = report.reset_index()
+    report['file_rows'] = report[source_column].map(rows_per_file).to_numpy()
+    report['duplicate_share'] = report['duplicate_rows'] / report['file_rows']
+    return report.sort_values('duplicate_rows', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def near_duplicates(df, source_column='data_source', tolerance=0.01):
+    """Rows that match a row of another file on NEAR_KEY_COLUMNS and are within ``tolerance``
+    (relative) of its settlement amount and price, without being exact duplicates."""
+    near_key = trade_keys(df, NEAR_KEY_COLUMNS)
+    source = df[source_column].astype(object).fillna('')
+    groups = source.groupby(near_key, sort=False)
+    spans_files = groups.transform('nunique') > 1
+    if not spans_files.any():
+        return df.iloc[0:0].assign(near_duplicate_of=pd.Series(dtype=object),
+                                   amount_diff=pd.Series(dtype=float))
+    cand = df[spans_files]
+    cand_key = near_key[spans_files]
+    cand_source = source[spans_files]
+    ref_source = cand_source.groupby(cand_key, sort=False).transform('first')
+    diffs = {}
+    within = cand_source != ref_source
+    for col in ['settlement_amount', 'price']:
+        values = pd.to_numeric(cand[col], errors='coerce')
+        ref = values.groupby(cand_key, sort=False).transform('first')
+        diffs[col] = values - ref
+        scale = np.maximum(ref.abs(), 1.0)
+        within &= (diffs[col].abs() <= tolerance * scale) | (values.isna() & ref.isna())
+    return cand[within].assign(near_duplicate_of=ref_source[within], amount_diff=diffs['settlement_amount'][within])
+
+
+def deduplicate_trades(df, source_column='data_source', near_tolerance=0.01):
+    """Drop trades exported by more than one file.
+
+    Returns (deduplicated frame, file overlap report, near-duplicate report).
+    Everything is hash grouping on 64-bit row keys, linear in the number of
+    rows; near-duplicates are only reported, not dropped.
+    """
+    marks = find_duplicates(df, source_column)
+    overlap = overlap_report(df, marks, source_column)
+    deduped = df[~marks['duplicate'].to_numpy()]
+    near = near_duplicates(deduped, source_column, near_tolerance)
+    logger.info(f"Dropped {int(marks['duplicate'].sum())} duplicate trades of {len(df)} rows "
+                f"({len(overlap)} overlapping file pairs, {len(near)} near-duplicates left for review)")
+    for row in overlap.itertuples(index=False):
+        logger.info(f"{getattr(row, source_column)} overlaps {row.duplicate_of}: {row.duplicate_rows} rows "
+                    f"({row.first_date} - {row.last_date})")
+    return deduped, overlap, near
+
+
+class StreamingDeduplicator:
+    """deduplicate_trades for frames that arrive sorted on trade_date (ExternalSorter.merge).
+
+    Copies of a trade share its trade day, so every day is deduplicated once
+    all of its rows are in; only the last, possibly incomplete day is held
+    back between frames. Call ``flush`` after the last frame, then ``reports``.
+    """
+
+    def __init__(self, source_column='data_source', near_tolerance=0.01):
+        self.source_column = source_column
+        self.near_tolerance = near_tolerance
+        self.rows = 0
+        self._pending = None
+        self._duplicates = []
+        self._near = []
+        self._rows_per_file = pd.Series(dtype='int64')
+
+    def feed(self, frame):
+        """Deduplicated rows of the days that ``frame`` completes."""
+        if self._pending is not None:
+            frame = pd.concat([self._pending, frame], ignore_index=True)
+        if frame.empty:
+            return frame
+        day = pd.to_datetime(frame['trade_date'], errors='coerce').dt.floor('D')
+        last = day.iloc[-1]
+        tail = day.isna() if pd.isna(last) else (day == last)
+        self._pending = frame[tail.to_numpy()]
+        return self._deduplicate(frame[~tail.to_numpy()])
+
+    def flush(self):
+        pending, self._pending = self._pending, None
+        return self._deduplicate(pending) if pending is not None else pending
+
+    def _deduplicate(self, df):
+        if df.empty:
+            return df
+        self.rows += len(df)
+        marks = find_duplicates(df, self.source_column)
+        self._rows_per_file = self._rows_per_file.add(marks['source'].value_counts(), fill_value=0)
+        if marks['duplicate'].any():
+            self._duplicates.append(duplicate_rows(df, marks, self.source_column))
+        deduped = df[~marks['duplicate'].to_numpy()]
+        near = near_duplicates(deduped, self.source_column, self.near_tolerance)
+        if len(near):
+            self._near.append(near)
+        return deduped
+
+    def reports(self):
+        """(file overlap report, near-duplicate report) over everything fed so far."""
+        dup = pd.concat(self._duplicates, ignore_index=True) if self._duplicates else \
+            pd.DataFrame(columns=['trade_date', self.source_column, 'duplicate_of'])
+        overlap = overlap_table(dup, self._rows_per_file.astype('int64'), self.source_column)
+        near = pd.concat(self._near, ignore_index=True) if self._near else pd.DataFrame()
+        logger.info(f"Dropped {len(dup)} duplicate trades of {self.rows} rows "
+                    f"({len(overlap)} overlapping file pairs, {len(near)} near-duplicates left for review)")
+        return overlap, near
+
+
+def save_reports(overlap, near, folder):
+    """Write the overlap and near-duplicate reports into ``folder``, each only when it has rows."""
+    for report, file_name in [(overlap, 'duplicate_file_overlap.csv'), (near, 'near_duplicate_trades.csv')]:
+        if len(report):
+            path = os.path.join(folder, file_name)
+            report.to_csv(path, index=False, encoding='utf-8-sig')
+            logger.info(f"{len(report)} rows written to {path}")
@@ -0,0 +1,107 @@
+import glob
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+NAT_LAST = np.iinfo(np.int64).max
+# Insertion order of every row, kept in the runs so that equal keys merge in input order
+SEQ = '__seq'
+
+
+def sort_key(values: pd.Series) -> np.ndarray:
+    # datetime64 as int64 with NaT moved to the end, so runs and merge agree on ordering
+    key = values.to_numpy(dtype='datetime64[ns]').view(np.int64).copy()
+    key[key == np.iinfo(np.int64).min] = NAT_LAST
+    return key
+
+
+class ExternalSorter:
+    """Sort a stream of frames on a datetime column with bounded memory.
+
+    Chunks are buffered up to ``run_rows`` rows, sorted and spilled to disk as
+    a run made of pickled blocks of ``block_rows`` rows. ``merge`` then does a
+    k-way merge of the runs holding one block per run in memory at a time.
+    The sort is stable: rows with equal keys come out in the order they were added.
+    """
+
+    def __init__(self, key, columns, run_rows=500_000, block_rows=20_000, work_dir=None):
+        self.key = key
+        self.columns = columns
+        self.run_rows = run_rows
+        self.block_rows = block_rows
+        self.work_dir = tempfile.mkdtemp(prefix='extsort_', dir=work_dir)
+        self.runs = []
+        self._buffer = []
+        self._buffered_rows = 0
+        self._added = 0
+
+    def add(self, df):
+        chunk = df.reindex(columns=self.columns)
+        chunk[SEQ] = np.arange(self._added, self._added + len(chunk), dtype=np.int64)
+        self._added += len(chunk)
+        self._buffer.append(chunk)
+        self._buffered_rows += len(df)
+        if self._buffered_rows >= self.run_rows:
+            self._spill()
+
+    def _spill(self):
+        if not self._buffer:
+            return
+        run = pd.concat(self._buffer, ignore_index=True)
+        self._buffer, self._buffered_rows = [], 0
+        # Rows are buffered in insertion order, so a stable sort keeps SEQ ascending within a key
+        run = run.iloc[np.argsort(sort_key(run[self.key]), kind='stable')]
+        run_dir = os.path.join(self.work_dir, f'run{len(self.runs):05d}')
+        os.makedirs(run_dir)
+        for i, start in enumerate(range(0, len(run), self.block_rows)):
+            run.iloc[start:start + self.block_rows].to_pickle(os.path.join(run_dir, f'{i:06d}.pkl'))
+        self.runs.append(run_dir)
+        logger.info(f"Spilled sorted run {len(self.runs)} ({len(run)} rows)")
+
+    def _blocks(self, run_dir):
+        for path in sorted(glob.glob(os.path.join(run_dir, '*.pkl'))):
+            yield pd.read_pickle(path)
+
+    def merge(self):
+        """Yield the merged rows as sorted frames."""
+        self._spill()
+        readers = [self._blocks(run_dir) for run_dir in self.runs]
+        buffers = [next(reader, None) for reader in readers]
+        while True:
+            active = [i for i, block in enumerate(buffers) if block is not None]
+            if not active:
+                break
+            keys = {i: sort_key(buffers[i][self.key]) for i in active}
+            seqs = {i: buffers[i][SEQ].to_numpy() for i in active}
+            # Rows up to the smallest (key, seq) block tail are final: every other run continues above it
+            bound_key, bound_seq = min((keys[i][-1], seqs[i][-1]) for i in active)
+            parts = []
+            for i in active:
+                lo = np.searchsorted(keys[i], bound_key, side='left')
+                hi = np.searchsorted(keys[i], bound_key, side='right')
+                n = lo + np.searchsorted(seqs[i][lo:hi], bound_seq, side='right')
+                parts.append(buffers[i].iloc[:n])
+                rest = buffers[i].iloc[n:]
+                buffers[i] = rest if len(rest) else next(readers[i], None)
+            out = pd.concat(parts, ignore_index=True)
+            out = out.iloc[np.lexsort((out[SEQ].to_numpy(), sort_key(out[self.key])))]
+            yield out.drop(columns=SEQ)
+
+    def merge_to_csv(self, output_file, **to_csv_kwargs):
+        rows = 0
+        with open(output_file, 'w', encoding='utf-8', newline='') as f:
+            f.write(','.join(self.columns) + '\n')
+            for frame in self.merge():
+                frame.to_csv(f, header=False, index=False, **to_csv_kwargs)
+                rows += len(frame)
+        logger.info(f"Merged {len(self.runs)} runs into {output_file} ({rows} rows)")
+        return rows
+
+    def cleanup(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
@@ -0,0 +1,116 @@
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+from secmaster import normalize_names
+
+logger = logging.getLogger(__name__)
+
+# Broker decorations that are not part of the name, e.g. '<購入・換金手数料なし>' (after NFKC) or '【NISA】'
+NOISE = re.compile(r'<[^>]*>|【[^】]*】')
+
+PAD = ' '
+
+
+def match_keys(names):
+    """Normalized names with broker decorations removed, the form both sides are indexed in."""
+    keys = normalize_names(names)
+    return keys.str.replace(NOISE, '', regex=True).str.strip()
+
+
+def ngrams(key, n=3):
+    # Padded so that short names and word starts still produce n-grams
+    padded = f'{PAD * (n - 1)}{key}{PAD}'
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+class NgramIndex:
+    """Inverted index from character n-grams to entry ids, scored with the Dice coefficient."""
+
+    def __init__(self, keys, n=3):
+        self.n = n
+        self.keys = np.asarray(keys, dtype=object)
+        self.sizes = np.empty(len(self.keys), dtype=np.int32)
+        postings = {}
+        for i, key in enumerate(self.keys):
+            grams = ngrams(key, n)
+            self.sizes[i] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def search(self, key, top_k=5):
+        """(entry ids, scores) of the best ``top_k`` entries sharing at least one n-gram with ``key``."""
+        grams = ngrams(key, self.n)
+        hits = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not hits:
+            return np.empty(0, dtype=np.int32), np.empty(0)
+        ids, shared = np.unique(np.concatenate(hits), return_counts=True)
+        scores = 2.0 * shared / (len(grams) + self.sizes[ids])
+        best = np.argsort(-scores, kind='stable')[:top_k]
+        return ids[best], scores[best]
+
+
+class FuzzyResolver:
+    """Ranked code candidates for security names without an exact dictionary match.
+
+    A candidate is applied automatically when its score reaches ``threshold``
+    and beats the best candidate with a different code by ``min_margin``.
+    """
+
+    def __init__(self, names, codes, n=3, threshold=0.85, min_margin=0.05, report_file=None):
+        entries = pd.DataFrame({'name': pd.Series(names, dtype=object).to_numpy(),
+                                'code': pd.Series(codes, dtype=object).to_numpy()})
+        entries['key'] = match_keys(entries['name']).to_numpy()
+        self.entries = entries.dropna().drop_duplicates(['key', 'code']).reset_index(drop=True)
+        self.index = NgramIndex(self.entries['key'], n)
+        self.threshold = threshold
+        self.min_margin = min_margin
+        # CSV of the candidates for names that were not applied automatically, for manual review
+        self.report_file = report_file
+
+    @classmethod
+    def from_master(cls, security_master, **kwargs):
+        tables = [security_master.tables[t] for t in ('overrides', 'names') if t in security_master.tables]
+        if not tables:
+            return cls([], [], **kwargs)
+        entries = pd.concat(tables)
+        return cls(entries.index, entries.to_numpy(), **kwargs)
+
+    def candidates(self, names, top_k=5):
+        """One row per (distinct name, candidate), best first."""
+        names = pd.Series(names, dtype=object).dropna().drop_duplicates()
+        rows = []
+        for name, key in zip(names, match_keys(names)):
+            ids, scores = self.index.search(key, top_k)
+            for rank, (i, score) in enumerate(zip(ids, scores), start=1):
+                rows.append((name, rank, self.entries['name'].iat[i], self.entries['code'].iat[i], score))
+        return pd.DataFrame(rows, columns=['security_name', 'rank', 'candidate_name', 'candidate_code', 'score'])
+
+    def confident(self, candidates):
+        """security_name -> code for the candidates that pass the threshold and margin."""
+        best = candidates[candidates['rank'] == 1].set_index('security_name')
+        # Best score among candidates whose code differs from the top one
+        other = candidates[candidates['candidate_code'] != candidates['security_name'].map(best['candidate_code'])]
+        runner_up = other.groupby('security_name')['score'].max().reindex(best.index).fillna(0.0)
+        ok = (best['score'] >= self.threshold) & (best['score'] - runner_up >= self.min_margin)
+        return best.loc[ok, 'candidate_code']
+
+    def fill_unmatched(self, names, codes):
+        """Fill missing ``codes`` from confident fuzzy matches of ``names``; other candidates go to the report."""
+        names = pd.Series(names).astype(object)
+        codes = pd.Series(codes).astype(object)
+        unmatched = names[codes.isna() & names.notna()]
+        if unmatched.empty:
+            return codes
+        candidates = self.candidates(unmatched)
+        applied = self.confident(candidates)
+        filled = codes.fillna(names.map(applied))
+        logger.info(f"Fuzzy matched {len(applied)} of {unmatched.nunique()} unmatched security names")
+        if self.report_file is not None:
+            review = candidates[~candidates['security_name'].isin(applied.index)]
+            review.to_csv(self.report_file, index=False, encoding='utf-8-sig')
+            logger.info(f"Candidates for {review['security_name'].nunique()} names written to {self.report_file}")
+        return filled
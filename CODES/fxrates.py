@@ -0,0 +1,105 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from artifacts import load_artifact
+
+logger = logging.getLogger(__name__)
+
+# Weekends and Japanese holidays (Golden Week, New Year) have no quote; a week covers them
+MAX_STALENESS = pd.Timedelta(days=7)
+
+_LOADED = {}
+
+
+def pair_name(pair):
+    # 'USDJPY=X' (Yahoo ticker) and 'USDJPY' (forex_data column) are the same pair
+    return str(pair).upper().replace('=X', '')
+
+
+def _calendar_days_ns(values):
+    # Rates are daily: the CSV and parquet copies of forex_data and a trade at any time of day
+    # all compare as calendar days, so a midnight trade gets that day's rate
+    times = pd.to_datetime(pd.Series(values), errors='coerce')
+    if getattr(times.dt, 'tz', None) is not None:
+        times = times.dt.tz_convert(None)
+    return times.dt.normalize().to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+class FxRates:
+    """As-of lookup of daily FX rates held as one sorted (times, rates) array pair per currency pair.
+
+    A lookup returns the last rate dated on or before the calendar day of each
+    timestamp, or NaN when that rate is older than ``max_staleness`` or there is none.
+    """
+
+    def __init__(self, rates, max_staleness=MAX_STALENESS):
+        self.max_staleness = pd.Timedelta(max_staleness).value
+        times = _calendar_days_ns(rates.index)
+        self._series = {}
+        for col in rates.columns:
+            values = pd.to_numeric(rates[col], errors='coerce').to_numpy(dtype=np.float64)
+            keep = ~np.isnan(values) & (times != np.iinfo(np.int64).min)
+            order = np.argsort(times[keep], kind='stable')
+            self._series[pair_name(col)] = times[keep][order], values[keep][order]
+
+    @property
+    def pairs(self):
+        return list(self._series)
+
+    def asof(self, pair, timestamps, return_dates=False):
+        """Rates of ``pair`` as of ``timestamps`` (batched, binary search)."""
+        times, values = self._series[pair_name(pair)]
+        query = _calendar_days_ns(timestamps)
+        pos = np.searchsorted(times, query, side='right') - 1
+        found = (pos >= 0) & (query != np.iinfo(np.int64).min)
+        # Index 0 stands in for "no rate" so the gathers below stay in bounds
+        pos = np.where(found, pos, 0)
+        if len(times):
+            found &= query - times[pos] <= self.max_staleness
+            rates, dates = values[pos], times[pos]
+        else:
+            rates, dates = np.zeros(len(query)), np.zeros(len(query), dtype=np.int64)
+        rates = np.where(found, rates, np.nan)
+        if return_dates:
+            return rates, np.where(found, dates, np.iinfo(np.int64).min).view('datetime64[ns]')
+        return rates
+
+    def rate_to(self, currencies, timestamps, target='JPY'):
+        """Rate converting each row's currency into ``target``; direct pairs first, then inverted ones."""
+        currencies = pd.Series(currencies).reset_index(drop=True)
+        timestamps = pd.Series(timestamps).reset_index(drop=True)
+        out = np.full(len(currencies), np.nan)
+        for currency in currencies.dropna().unique():
+            rows = (currencies == currency).to_numpy()
+            if currency == target:
+                out[rows] = 1.0
+            elif f'{currency}{target}' in self._series:
+                out[rows] = self.asof(f'{currency}{target}', timestamps[rows])
+            elif f'{target}{currency}' in self._series:
+                out[rows] = 1.0 / self.asof(f'{target}{currency}', timestamps[rows])
+            else:
+                logger.warning(f"No {currency}/{target} rate available ({rows.sum()} rows)")
+        return out
+
+    def latest(self, pair):
+        times, values = self._series[pair_name(pair)]
+        return values[-1] if len(values) else np.nan
+
+
+def load_fx_rates(stem, max_staleness=MAX_STALENESS):
+    """FxRates for the forex_data artifact; parsed once per process and reused until the file changes."""
+    for ext in ('parquet', 'feather', 'csv'):
+        path = f'{stem}.{ext}'
+        if os.path.exists(path):
+            break
+    else:
+        raise FileNotFoundError(f"No forex data found for {stem}")
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, pd.Timedelta(max_staleness).value)
+    if key not in _LOADED:
+        _LOADED[key] = FxRates(load_artifact(stem, schema=None, index_col='Date'), max_staleness)
+        logger.info(f"Loaded FX rates {_LOADED[key].pairs} from {path}")
+    return _LOADED[key]
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import logging
+import os
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ShardCache:
+    """Parsed source files cached as typed pickle shards, tracked by a manifest.
+
+    The manifest records size, mtime and content hash per source path. A file
+    whose size and mtime are unchanged is trusted without hashing; a touched
+    file with the same hash keeps its shard. Bump ``version`` whenever the
+    parser output changes so that every shard is rebuilt.
+    """
+
+    def __init__(self, cache_dir, version=1):
+        self.cache_dir = cache_dir
+        self.version = version
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+        os.makedirs(cache_dir, exist_ok=True)
+        self.manifest = self._load_manifest()
+        self._digests = {}
+        # Stale paths from stale_files() that have not been stored again yet
+        self._pending = set()
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != self.version:
+            logger.info(f"Shard cache version changed ({manifest.get('version')} -> {self.version}), rebuilding")
+            for entry in manifest.get('files', {}).values():
+                self._remove_shard(entry['shard'])
+            return {}
+        return manifest.get('files', {})
+
+    def _shard_path(self, shard):
+        return os.path.join(self.cache_dir, shard)
+
+    def _remove_shard(self, shard):
+        if os.path.exists(self._shard_path(shard)):
+            os.remove(self._shard_path(shard))
+
+    def stale_files(self, paths):
+        """Return the paths that are new or whose content changed since the last run.
+
+        Missing paths are logged and skipped, and their shard is no longer served.
+        """
+        stale = []
+        for path in paths:
+            if not os.path.exists(path):
+                logger.error(f"Error processing file {path}: file not found")
+                entry = self.manifest.pop(path, None)
+                if entry is not None:
+                    self._remove_shard(entry['shard'])
+                continue
+            stat = os.stat(path)
+            entry = self.manifest.get(path)
+            if entry is None or not os.path.exists(self._shard_path(entry['shard'])):
+                stale.append(path)
+                continue
+            if entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                continue
+            digest = self._digests[path] = file_digest(path)
+            if digest == entry['sha1']:
+                entry['mtime_ns'] = stat.st_mtime_ns
+            else:
+                stale.append(path)
+        self._pending.update(stale)
+        return stale
+
+    def store(self, path, df):
+        stat = os.stat(path)
+        digest = self._digests.pop(path, None) or file_digest(path)
+        self._pending.discard(path)
+        shard = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16] + '.pkl'
+        df.to_pickle(self._shard_path(shard))
+        self.manifest[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                               'sha1': digest, 'shard': shard}
+
+    def prune(self, paths):
+        """Drop manifest entries and shards for sources that are no longer listed or no longer exist."""
+        keep = {path for path in paths if os.path.exists(path)}
+        for path in [p for p in self.manifest if p not in keep]:
+            logger.info(f"Dropping shard for removed file {path}")
+            self._remove_shard(self.manifest.pop(path)['shard'])
+
+    def drop_unstored(self):
+        """Forget stale files that were not stored again (parse failed), so their old shard is not served."""
+        for path in sorted(self._pending):
+            entry = self.manifest.pop(path, None)
+            if entry is not None:
+                logger.warning(f"Dropping outdated shard of {path}: the changed file could not be parsed")
+                self._remove_shard(entry['shard'])
+        self._pending.clear()
+
+    def load(self, paths):
+        self.drop_unstored()
+        return [pd.read_pickle(self._shard_path(self.manifest[path]['shard']))
+                for path in paths if path in self.manifest]
+
+    def save(self):
+        self.drop_unstored()
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.version, 'files': self.manifest}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.manifest_path)
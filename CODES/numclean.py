@@ -0,0 +1,54 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Full-width digits/signs to ASCII. The △/▲ markers are dropped, not read as a minus sign:
+# the per-cell regex this replaced skipped them too, and the cost-basis and valuation code take
+# the sign of a trade from its transaction type, so '▲1,000' stays 1000
+_TO_ASCII = str.maketrans('０１２３４５６７８９．，－−＋（）', '0123456789.,--+()', '△▲')
+
+# Values that mean "no amount" in the exports and are not counted as rejected
+BLANK_VALUES = {'', '-', '--', 'nan', 'None'}
+
+# First number of the cell; '10,000(100)' is the amount followed by the point usage in brackets.
+# Scientific notation ('1.5e3') is part of the number, not cut off after the mantissa
+_NUMBER = r'([-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)'
+
+
+def clean_numeric_column(values, name=None):
+    """Convert a column of broker amounts to float64 in one pass.
+
+    Handles thousands separators, '円', full-width digits, '-' placeholders,
+    scientific notation and bracketed point usage. Each distinct string is converted once.
+    Returns (float array, value counts of rejected cells); see rejected_report.
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return series.to_numpy(dtype=np.float64, na_value=np.nan), pd.Series(dtype=np.int64)
+
+    codes, uniques = pd.factorize(series)
+    text = pd.Series(uniques, dtype=object).astype(str).str.translate(_TO_ASCII)
+    text = text.str.replace(r'[,円\s]', '', regex=True)
+    numbers = pd.to_numeric(text.str.extract(_NUMBER, expand=False), errors='coerce').to_numpy(dtype=np.float64)
+
+    rejected = np.isnan(numbers) & ~text.isin(BLANK_VALUES).to_numpy()
+    if rejected.any():
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))[rejected]
+        summary = pd.Series(counts, index=pd.Index(uniques[rejected], dtype=object)).sort_values(ascending=False)
+        logger.warning(f"Unable to convert {summary.sum()} {name or series.name or 'numeric'} values "
+                       f"({len(summary)} distinct): {summary.head(10).to_dict()}")
+    else:
+        summary = pd.Series(dtype=np.int64)
+
+    # Missing values have code -1, which picks the trailing NaN
+    return np.append(numbers, np.nan)[codes], summary
+
+
+def rejected_report(rejected):
+    """{column: value counts of rejected cells} as diagnostics rows (reason, column, value, rows)."""
+    rows = [(f'unparseable {column}', column, value, int(count))
+            for column, counts in rejected.items() for value, count in counts.items()]
+    return pd.DataFrame(rows, columns=['reason', 'column', 'value', 'rows'])
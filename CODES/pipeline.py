@@ -0,0 +1,265 @@
+import argparse
+import hashlib
+import importlib
+import json
+import logging
+import os
+import time
+
+import pandas as pd
+
+from artifacts import save_artifact, load_artifact, TRADE_SCHEMA
+from ingestcache import file_digest
+from fxrates import FxRates
+from secmaster import SecurityMaster, SOURCES
+from pricestore import default_store
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+CODES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BASE_PATH = r"C:\Users\100ca\Documents\PyCode\TRADEHISTORY"
+CHART_FOLDER = r"C:\Users\100ca\Documents\PyCode\trahist\charts"
+PROFIT_FILE = r"C:\Users\100ca\Documents\PyCode\trahist\stock_transaction_analysis.csv"
+
+
+def script(name):
+    # The stage scripts start with a digit, so they can only be imported this way
+    return importlib.import_module(name)
+
+
+def frame_digest(df):
+    """Content hash of a frame: values, index, column names and dtypes."""
+    h = hashlib.sha1()
+    h.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+class Stage:
+    """One node of the pipeline.
+
+    ``func`` receives the outputs of ``inputs`` positionally and ``params`` as
+    keywords. The cache key covers the upstream output digests, the params,
+    the content of ``files`` and the source of ``scripts`` (the stage scripts
+    whose code the stage runs), so any of them changing re-runs the stage.
+    ``cache=False`` is for stages that only write side outputs (charts).
+    """
+
+    def __init__(self, name, func, inputs=(), params=None, files=(), scripts=(),
+                 schema=TRADE_SCHEMA, index=False, cache=True):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = params or {}
+        self.files = list(files)
+        self.scripts = list(scripts)
+        self.schema = schema
+        self.index = index
+        self.cache = cache
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, inputs={self.inputs})"
+
+
+class Pipeline:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+        self.stages = {}
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding='utf-8') as f:
+                self.manifest = json.load(f)
+
+    def add(self, stage):
+        if stage.name in self.stages:
+            raise ValueError(f"Duplicate stage: {stage.name}")
+        self.stages[stage.name] = stage
+        return stage
+
+    def order(self, targets=None):
+        """Stages needed for ``targets`` (default: all), upstream first."""
+        ordered, state = [], {}
+
+        def visit(name):
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError(f"Cycle in pipeline at stage {name}")
+            if name not in self.stages:
+                raise KeyError(f"Unknown stage: {name}")
+            state[name] = 'visiting'
+            for dep in self.stages[name].inputs:
+                visit(dep)
+            state[name] = 'done'
+            ordered.append(self.stages[name])
+
+        for name in targets or self.stages:
+            visit(name)
+        return ordered
+
+    def stage_key(self, stage, input_digests):
+        h = hashlib.sha1()
+        h.update(stage.name.encode('utf-8'))
+        h.update(repr(sorted(stage.params.items())).encode('utf-8'))
+        # Artifacts written with another column schema are not reused
+        h.update(repr(stage.schema).encode('utf-8'))
+        for digest in input_digests:
+            h.update(digest.encode('ascii'))
+        for path in stage.files:
+            h.update(path.encode('utf-8'))
+            h.update((file_digest(path) if os.path.exists(path) else 'missing').encode('ascii'))
+        for name in stage.scripts:
+            h.update(file_digest(os.path.join(CODES_DIR, f'{name}.py')).encode('ascii'))
+        return h.hexdigest()
+
+    def run(self, targets=None, force=()):
+        """Run the stages needed for ``targets`` in one process and return their outputs by name.
+
+        A stage whose key is in the manifest is loaded from its artifact instead
+        of executed. Keys depend on upstream output digests rather than upstream
+        keys, so a stage that re-runs but produces the same frame does not
+        invalidate anything downstream.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        results, digests = {}, {}
+        try:
+            for stage in self.order(targets):
+                key = self.stage_key(stage, [digests[name] for name in stage.inputs])
+                entry = self.manifest.get(stage.name)
+                start = time.perf_counter()
+                if (stage.cache and stage.name not in force and entry and entry['key'] == key
+                        and self._artifact_exists(entry['stem'])):
+                    results[stage.name] = load_artifact(entry['stem'], schema=stage.schema,
+                                                        index_col='Date' if stage.index else None)
+                    digests[stage.name] = entry['digest']
+                    logger.info(f"[{stage.name}] cached ({time.perf_counter() - start:.2f}s)")
+                    continue
+
+                out = stage.func(*[results[name] for name in stage.inputs], **stage.params)
+                if stage.cache:
+                    stem = os.path.join(self.cache_dir, f'{stage.name}-{key[:16]}')
+                    out = save_artifact(out, stem, schema=stage.schema, csv=False, index=stage.index)
+                    if not stage.index:
+                        # Same frame as a later cached load, which comes back with a fresh RangeIndex
+                        out = out.reset_index(drop=True)
+                    self._replace_entry(stage.name, {'key': key, 'stem': stem, 'digest': frame_digest(out)})
+                    digests[stage.name] = self.manifest[stage.name]['digest']
+                else:
+                    digests[stage.name] = key
+                results[stage.name] = out
+                logger.info(f"[{stage.name}] ran in {time.perf_counter() - start:.2f}s")
+        finally:
+            self.save()
+        return results
+
+    def _artifact_exists(self, stem):
+        return any(os.path.exists(f'{stem}.{ext}') for ext in ('parquet', 'feather', 'csv'))
+
+    def _replace_entry(self, name, entry):
+        old = self.manifest.get(name)
+        if old and old['stem'] != entry['stem']:
+            for ext in ('parquet', 'feather', 'csv'):
+                if os.path.exists(f"{old['stem']}.{ext}"):
+                    os.remove(f"{old['stem']}.{ext}")
+        self.manifest[name] = entry
+
+    def save(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+
+# --- stage functions ---------------------------------------------------------
+
+def fetch_forex(start_date, end_date, store_folder):
+    return script('0fx').fetch_forex(start_date=start_date, end_date=end_date, store=default_store(store_folder))
+
+
+def integrate(base_path):
+    integrator = script('1concatw').TradeDataIntegrator(base_path, workers=os.cpu_count(), incremental=True)
+    return integrator.process_data()
+
+
+def clean(integrated, forex, dic_folder):
+    return script('2cleanus').clean_trades(integrated, SecurityMaster.load(dic_folder), forex)
+
+
+def replace_codes(cleaned, dic_folder):
+    return script('2dcleanus').replace_security_codes(cleaned, SecurityMaster.load(dic_folder))
+
+
+def download_prices(trade_history, end_date, store_folder):
+    return script('3yf').download_adj_close(trade_history['security_code'], end_date=end_date,
+                                            store=default_store(store_folder))
+
+
+def analyze_profit(trade_history, prices, forex):
+    return script('4profit').analyze_stock_transactions(trade_history, prices, fx_rates=FxRates(forex))
+
+
+def valuate(trade_history, prices, forex):
+    nav, _, _ = script('portfolio').daily_valuation(trade_history, prices, fx_rates=FxRates(forex))
+    return nav
+
+
+def draw_charts(trade_history, prices, output_folder):
+    chart = script('4chart')
+    chart.generate_charts(*chart.normalize_codes(trade_history, prices), output_folder)
+
+
+def raw_files(base_path):
+    integrator = script('1concatw').TradeDataIntegrator(base_path)
+    return [file_path for _, file_path in integrator.source_files()]
+
+
+def build_pipeline(base_path=BASE_PATH, chart_folder=CHART_FOLDER, today=None):
+    dic = os.path.join(base_path, 'DIC')
+    # Network stages are keyed on the date, so prices are fetched at most once a day
+    today = pd.Timestamp(today or pd.Timestamp.today()).normalize()
+    # Both code stages read the security master, which is built from every DIC dictionary
+    dictionaries = [os.path.join(dic, file_name) for _, file_name, _, _ in SOURCES]
+    # Downloaded price history shared by the forex and prices stages
+    store_folder = os.path.join(dic, 'prices')
+
+    pipeline = Pipeline(os.path.join(base_path, 'CACHE', 'pipeline'))
+    pipeline.add(Stage('forex', fetch_forex, scripts=['0fx'], schema=None, index=True,
+                       params={'start_date': '2018-01-01',
+                               'end_date': (today - pd.Timedelta(days=1)).strftime('%Y-%m-%d'),
+                               'store_folder': store_folder}))
+    pipeline.add(Stage('integrated', integrate, params={'base_path': base_path},
+                       files=raw_files(base_path), scripts=['1concatw']))
+    pipeline.add(Stage('trade_history3', clean, inputs=['integrated', 'forex'], scripts=['2cleanus'],
+                       params={'dic_folder': dic}, files=dictionaries))
+    pipeline.add(Stage('trade_history4', replace_codes, inputs=['trade_history3'], scripts=['2dcleanus'],
+                       params={'dic_folder': dic}, files=dictionaries))
+    pipeline.add(Stage('prices', download_prices, inputs=['trade_history4'], scripts=['3yf'],
+                       params={'end_date': today, 'store_folder': store_folder}, schema=None, index=True))
+    pipeline.add(Stage('profit', analyze_profit, inputs=['trade_history4', 'prices', 'forex'], scripts=['4profit'],
+                       schema={}))
+    pipeline.add(Stage('nav', valuate, inputs=['trade_history4', 'prices', 'forex'], scripts=['portfolio'],
+                       schema=None, index=True))
+    pipeline.add(Stage('charts', draw_charts, inputs=['trade_history4', 'prices'], scripts=['4chart'],
+                       params={'output_folder': chart_folder}, cache=False))
+    return pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the trade history pipeline in one process')
+    parser.add_argument('targets', nargs='*', help='stages to produce (default: all)')
+    parser.add_argument('--base', default=BASE_PATH)
+    parser.add_argument('--force', nargs='*', default=[], help='stages to re-run even when cached')
+    args = parser.parse_args()
+
+    pipeline = build_pipeline(args.base)
+    results = pipeline.run(args.targets or None, force=set(args.force))
+    if 'profit' in results:
+        results['profit'].to_csv(PROFIT_FILE, index=False)
+        logger.info(f"Profit table saved to {PROFIT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from costbasis import trade_sides
+from pricematrix import PriceMatrix
+
+logger = logging.getLogger(__name__)
+
+NAV_COLUMNS = ['nav', 'buy_amount', 'sell_amount', 'net_flow', 'cumulative_flow', 'pnl', 'priced_flow',
+               'positions', 'unpriced']
+
+
+def _price_frame(prices, tickers, start, end):
+    if isinstance(prices, PriceMatrix):
+        known = [t for t in tickers if t in set(prices.tickers)]
+        frame = prices.window(start, end, known)
+    else:
+        frame = prices.loc[(prices.index >= start) & (prices.index <= end)]
+        frame = frame.set_axis(frame.columns.astype(str), axis=1)
+        frame = frame.loc[:, ~frame.columns.duplicated()]
+    return frame.reindex(columns=tickers)
+
+
+def daily_valuation(trades, prices, fx_rates=None, code_column='security_code', amount_column='amount_jpy'):
+    """Mark-to-market value of the holdings on every price date, without a per-day loop.
+
+    Holdings are the cumulative signed quantities (dates x securities), priced
+    with the last known close (carried over holidays) and converted to JPY with
+    the as-of FX rate of each security's currency. Returns (nav, exposure,
+    holdings): nav has the portfolio value, the JPY bought/sold per day from
+    ``amount_column`` and the P&L against the cumulative net investment;
+    exposure is the JPY value per security and day.
+    """
+    side = trade_sides(trades['transaction_type'])
+    keep = (side != 0) & trades[code_column].notna().to_numpy() & trades['trade_date'].notna().to_numpy()
+    df = trades.loc[keep]
+    side = side[keep].astype(np.float64)
+    codes, securities = pd.factorize(df[code_column].astype(str))
+    trade_days = pd.to_datetime(df['trade_date']).dt.normalize().to_numpy(dtype='datetime64[ns]')
+
+    tickers = [str(s) for s in securities]
+    empty = pd.DataFrame(columns=NAV_COLUMNS, index=pd.DatetimeIndex([], name='Date'))
+    if len(df) == 0:
+        return empty, pd.DataFrame(columns=tickers), pd.DataFrame(columns=tickers)
+
+    # Calendar: price dates from the first trade to the last price
+    end = prices.dates[-1] if isinstance(prices, PriceMatrix) else prices.index.max()
+    price_frame = _price_frame(prices, tickers, trade_days.min(), end)
+    calendar = pd.DatetimeIndex(price_frame.index).as_unit('ns')
+    if len(calendar) == 0:
+        return empty, pd.DataFrame(columns=tickers), pd.DataFrame(columns=tickers)
+
+    # A trade on a non-trading day counts from the next price date on; later trades are beyond the calendar
+    rows = np.searchsorted(calendar.asi8, trade_days.view(np.int64), side='left')
+    inside = rows < len(calendar)
+    signed = side * np.abs(df['quantity'].to_numpy(dtype=np.float64))
+    flows = np.zeros((len(calendar), len(tickers)))
+    np.add.at(flows, (rows[inside], codes[inside]), np.nan_to_num(signed[inside]))
+    holdings = np.cumsum(flows, axis=0)
+    # Rounding leftovers of fully sold fractional fund units
+    holdings[np.abs(holdings) < 1e-9] = 0.0
+
+    price = price_frame.ffill().to_numpy(dtype=np.float64)
+    if fx_rates is not None and 'currency' in df.columns:
+        currency = df.groupby(codes)['currency'].last().reindex(range(len(tickers))).astype(object)
+        fx = np.ones((len(calendar), len(tickers)))
+        for cur in currency.dropna().unique():
+            if cur != 'JPY':
+                cols = (currency == cur).to_numpy()
+                fx[:, cols] = fx_rates.rate_to([cur] * len(calendar), calendar)[:, None]
+        price = price * fx
+
+    value = holdings * price
+    held = holdings != 0
+    unpriced = held & np.isnan(value)
+    value[~held] = 0.0
+    if unpriced.any():
+        missing = [tickers[j] for j in np.flatnonzero(unpriced.any(axis=0))]
+        logger.warning(f"No JPY price for {len(missing)} held securities, left out of the NAV: {missing[:10]}")
+
+    amount = np.abs(pd.to_numeric(df[amount_column], errors='coerce').to_numpy(dtype=np.float64)) \
+        if amount_column in df.columns else np.zeros(len(df))
+    amount = np.nan_to_num(amount)
+    buy_amount = np.bincount(rows[inside], np.where(side > 0, amount, 0.0)[inside], len(calendar))
+    sell_amount = np.bincount(rows[inside], np.where(side < 0, amount, 0.0)[inside], len(calendar))
+    net_flow = buy_amount - sell_amount
+    # Flows of securities that have a price that day, the ones the NAV moves with (time-weighted returns)
+    priced = inside.copy()
+    priced[inside] = ~np.isnan(price[rows[inside], codes[inside]])
+    priced_flow = np.bincount(rows[priced], (side * amount)[priced], len(calendar))
+    cumulative_flow = np.cumsum(net_flow)
+    nav_values = np.nansum(value, axis=1)
+
+    index = pd.DatetimeIndex(calendar, name='Date')
+    nav = pd.DataFrame({
+        'nav': nav_values,
+        'buy_amount': buy_amount,
+        'sell_amount': sell_amount,
+        'net_flow': net_flow,
+        'cumulative_flow': cumulative_flow,
+        'pnl': nav_values - cumulative_flow,
+        'priced_flow': priced_flow,
+        'positions': held.sum(axis=1),
+        'unpriced': unpriced.sum(axis=1),
+    }, index=index)
+    exposure = pd.DataFrame(value, index=index, columns=tickers)
+    holdings = pd.DataFrame(holdings, index=index, columns=tickers)
+    return nav, exposure, holdings
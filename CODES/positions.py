@@ -0,0 +1,147 @@
+import logging
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from costbasis import MOVING_AVERAGE, realized_by_trade, trade_sides
+
+logger = logging.getLogger(__name__)
+
+POSITIONS_FILE = r'C:\Users\100ca\Documents\PyCode\TRADEHISTORY\DIC\positions.pkl'
+
+
+def _as_ns(values):
+    times = pd.to_datetime(pd.Series(values))
+    if getattr(times.dt, 'tz', None) is not None:
+        times = times.dt.tz_convert(None)
+    return times.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+class PositionIndex:
+    """Quantity and moving-average cost held per security at any point in time.
+
+    Each security keeps its trade times in order with the quantity and cost
+    held after each trade, so a point-in-time query is one binary search per
+    security. Costs come from ``amount_column`` (JPY by default); sells beyond
+    the quantity held do not reduce the position below zero.
+    """
+
+    def __init__(self, amount_column='amount_jpy'):
+        self.amount_column = amount_column
+        # Buys and sells seen so far: security_code, trade_date, transaction_type, quantity, value
+        self.trades = pd.DataFrame(columns=['security_code', 'trade_date', 'transaction_type', 'quantity', 'value'])
+        # security_code -> (times ns, quantity after trade, cost after trade)
+        self.series = {}
+
+    @classmethod
+    def from_trades(cls, trades, amount_column='amount_jpy'):
+        index = cls(amount_column)
+        index.append(trades)
+        return index
+
+    @classmethod
+    def load(cls, path=POSITIONS_FILE):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, path=POSITIONS_FILE):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @property
+    def codes(self):
+        return list(self.series)
+
+    def _normalize(self, trades):
+        side = trade_sides(trades['transaction_type'])
+        keep = (side != 0) & trades['security_code'].notna().to_numpy() & trades['trade_date'].notna().to_numpy()
+        df = trades.loc[keep]
+        quantity = np.abs(df['quantity'].to_numpy(dtype=np.float64))
+        if self.amount_column in df.columns:
+            value = np.abs(pd.to_numeric(df[self.amount_column], errors='coerce').to_numpy(dtype=np.float64))
+        else:
+            value = quantity * df['price'].to_numpy(dtype=np.float64)
+        return pd.DataFrame({
+            'security_code': df['security_code'].astype(str).to_numpy(dtype=object),
+            'trade_date': pd.to_datetime(df['trade_date']).to_numpy(),
+            'transaction_type': np.where(side[keep] > 0, 'Buy', 'Sell'),
+            'quantity': quantity,
+            'value': value,
+        })
+
+    def append(self, trades):
+        """Add trades; only the securities they touch are re-indexed, in any date order."""
+        new = self._normalize(trades)
+        if new.empty:
+            return self
+        touched = set(new['security_code'])
+        old = self.trades[self.trades['security_code'].isin(touched)]
+        rebuild = pd.concat([old, new], ignore_index=True) if len(old) else new
+        self.trades = pd.concat([self.trades, new], ignore_index=True) if len(self.trades) else new
+        self._index(rebuild)
+        logger.info(f"Position index: {len(new)} trades appended, {len(touched)} securities re-indexed, "
+                    f"{len(self.series)} securities in total")
+        return self
+
+    def _index(self, trades):
+        # Per-trade realized P&L and unmatched quantity in (security, date) order from the cost-basis engine
+        realized, unmatched, _ = realized_by_trade(trades, MOVING_AVERAGE, amount_column='value')
+        ordered = trades.loc[realized.index]
+        is_buy = (ordered['transaction_type'] == 'Buy').to_numpy()
+        quantity = ordered['quantity'].to_numpy()
+        value = ordered['value'].to_numpy()
+        sold = quantity - unmatched.to_numpy()
+        unit_price = np.divide(value, quantity, out=np.zeros(len(value)), where=quantity > 0)
+        # Cost leaving the position on a sell is its proceeds minus its realized P&L
+        delta_qty = np.where(is_buy, quantity, -sold)
+        delta_cost = np.where(is_buy, value, -(unit_price * sold - realized.to_numpy()))
+
+        codes = ordered['security_code'].to_numpy()
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        ends = np.r_[starts[1:], len(codes)]
+        # Prefix sums over the whole table, rebased at each security's first row
+        cum_qty = np.cumsum(delta_qty)
+        cum_cost = np.cumsum(delta_cost)
+        base_qty = np.repeat(np.r_[0.0, cum_qty][starts], ends - starts)
+        base_cost = np.repeat(np.r_[0.0, cum_cost][starts], ends - starts)
+        cum_qty -= base_qty
+        cum_cost -= base_cost
+        times = _as_ns(ordered['trade_date'])
+        for start, end in zip(starts, ends):
+            self.series[codes[start]] = (times[start:end], cum_qty[start:end], cum_cost[start:end])
+
+    def holdings(self, at, codes=None, only_held=True):
+        """Quantity, cost and average cost per security after all trades up to ``at`` (inclusive)."""
+        at = _as_ns([at])[0]
+        codes = self.codes if codes is None else [str(c) for c in codes]
+        quantity = np.zeros(len(codes))
+        cost = np.zeros(len(codes))
+        for i, code in enumerate(codes):
+            if code not in self.series:
+                continue
+            times, qty, cst = self.series[code]
+            k = np.searchsorted(times, at, side='right')
+            if k:
+                quantity[i], cost[i] = qty[k - 1], cst[k - 1]
+        result = pd.DataFrame({'quantity': quantity, 'cost': cost,
+                               'average_cost': np.divide(cost, quantity, out=np.full(len(codes), np.nan),
+                                                         where=quantity > 1e-9)},
+                              index=pd.Index(codes, name='security_code'))
+        return result[result['quantity'] > 1e-9] if only_held else result
+
+    def holdings_at(self, dates, codes=None, field='quantity'):
+        """Dates x securities frame of ``field`` ('quantity' or 'cost'), one batched binary search per security."""
+        query = _as_ns(dates)
+        codes = self.codes if codes is None else [str(c) for c in codes]
+        out = np.zeros((len(query), len(codes)))
+        for j, code in enumerate(codes):
+            if code not in self.series:
+                continue
+            times, qty, cst = self.series[code]
+            values = qty if field == 'quantity' else cst
+            out[:, j] = np.r_[0.0, values][np.searchsorted(times, query, side='right')]
+        return pd.DataFrame(out, index=pd.DatetimeIndex(pd.to_datetime(pd.Series(dates)), name='Date'), columns=codes)
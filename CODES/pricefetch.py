@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# One row of the failure report: a symbol that ended without data, and why
+FetchFailure = namedtuple('FetchFailure', ['symbol', 'start', 'end', 'attempts', 'error'])
+
+NO_DATA = 'no data returned'
+
+
+class PriceProvider:
+    """Source of daily prices. ``fetch`` returns symbol -> frame of price fields for [start, end)."""
+
+    def fetch(self, symbols, start, end):
+        raise NotImplementedError
+
+
+class CannedProvider(PriceProvider):
+    """Serves prices from memory with a simulated round trip, for offline benchmarks and tests.
+
+    ``failures`` maps a symbol to the number of requests containing it that
+    raise before it succeeds (``float('inf')`` for a bad ticker); ``delays``
+    maps a symbol to extra seconds per request, to simulate a stalled response.
+    """
+
+    def __init__(self, prices, latency=0.0, failures=None, delays=None):
+        self.prices = prices
+        self.latency = latency
+        self.failures = dict(failures or {})
+        self.delays = delays or {}
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def fetch(self, symbols, start, end):
+        with self._lock:
+            self.requests.append((tuple(symbols), start, end))
+            failing = [s for s in symbols if self.failures.get(s, 0) > 0]
+            for symbol in failing:
+                self.failures[symbol] -= 1
+        time.sleep(self.latency + max((self.delays.get(s, 0.0) for s in symbols), default=0.0))
+        if failing:
+            raise RuntimeError(f"simulated error for {failing}")
+        out = {}
+        for symbol in symbols:
+            if symbol in self.prices:
+                frame = self.prices[symbol]
+                out[symbol] = frame[(frame.index >= start) & (frame.index < end)]
+        return out
+
+
+class ConcurrentFetcher(PriceProvider):
+    """Wraps a provider: fetches symbols in batches on a bounded number of threads.
+
+    A batch that raises or exceeds ``timeout`` seconds is retried after
+    ``backoff * 2 ** (attempt - 1)`` seconds, split in halves and finally into
+    single symbols so that one bad ticker cannot sink the rest of its batch. Symbols that still have no data
+    after ``retries`` retries are collected in ``failures``.
+    """
+
+    def __init__(self, provider, batch_size=20, max_workers=4, retries=2, backoff=1.0, timeout=60.0):
+        self.provider = provider
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.failures = []
+
+    def fetch(self, symbols, start, end):
+        symbols = list(dict.fromkeys(symbols))
+        # (ready time, symbols, attempt) of batches waiting to be sent
+        queue = [(0.0, symbols[i:i + self.batch_size], 1) for i in range(0, len(symbols), self.batch_size)]
+        running = {}
+        results = {}
+        # Timed-out requests cannot be cancelled and keep their thread, so the pool has room for them;
+        # concurrency is bounded by ``running`` instead
+        executor = ThreadPoolExecutor(max_workers=self.max_workers * (self.retries + 2),
+                                      thread_name_prefix='pricefetch')
+        try:
+            while queue or running:
+                now = time.monotonic()
+                queue.sort(key=lambda item: item[0])
+                while queue and queue[0][0] <= now and len(running) < self.max_workers:
+                    _, batch, attempt = queue.pop(0)
+                    future = executor.submit(self.provider.fetch, batch, start, end)
+                    running[future] = (batch, attempt, now + self.timeout)
+
+                if not running:
+                    # Only retries waiting out their backoff
+                    time.sleep(max(queue[0][0] - now, 0.0))
+                    continue
+                deadlines = [deadline for _, _, deadline in running.values()]
+                if queue and len(running) < self.max_workers:
+                    deadlines.append(queue[0][0])
+                wait(running, timeout=max(min(deadlines) - time.monotonic(), 0.0),
+                               return_when=FIRST_COMPLETED)
+
+                now = time.monotonic()
+                for future in list(running):
+                    batch, attempt, deadline = running[future]
+                    if future.done():
+                        error = future.exception()
+                    elif now >= deadline:
+                        error = TimeoutError(f"no response within {self.timeout}s")
+                    else:
+                        continue
+                    del running[future]
+                    if error is None:
+                        fetched = future.result()
+                        results.update(fetched)
+                        for symbol in batch:
+                            if symbol not in fetched:
+                                self.failures.append(FetchFailure(symbol, start, end, attempt, NO_DATA))
+                    elif attempt <= self.retries:
+                        ready = now + self.backoff * 2 ** (attempt - 1)
+                        # Halves first; the last attempt goes symbol by symbol
+                        size = (len(batch) + 1) // 2 if attempt < self.retries else 1
+                        for i in range(0, len(batch), size):
+                            queue.append((ready, batch[i:i + size], attempt + 1))
+                    else:
+                        logger.warning(f"Giving up on {len(batch)} symbols after {attempt} attempts: {error}")
+                        for symbol in batch:
+                            self.failures.append(FetchFailure(symbol, start, end, attempt, repr(error)))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return results
+
+    def failure_report(self):
+        return pd.DataFrame(self.failures, columns=FetchFailure._fields)
@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from artifacts import load_artifact
+
+logger = logging.getLogger(__name__)
+
+# <stem>.matrix.json: tickers, row capacity and number of dates
+# <stem>.prices.f8:   float64 ticker x capacity, one contiguous series per ticker (NaN where no price)
+# <stem>.dates.i8:    int64 ns dates of the filled rows, ascending
+MIN_CAPACITY = 4096
+
+
+def _paths(stem):
+    return f'{stem}.matrix.json', f'{stem}.prices.f8', f'{stem}.dates.i8'
+
+
+def _as_dates(index):
+    dates = pd.DatetimeIndex(index)
+    if dates.tz is not None:
+        dates = dates.tz_convert(None)
+    return dates.as_unit('ns')
+
+
+def exists(stem):
+    return all(os.path.exists(path) for path in _paths(stem))
+
+
+class PriceMatrix:
+    """Wide price table (dates x tickers) on disk, opened as memory maps.
+
+    Each ticker's series is contiguous, so ``series`` and ``window`` only touch
+    the pages they read. Rows are reserved up to ``capacity`` so that new dates
+    are written in place; the file is rewritten only when the capacity runs out
+    or a date is inserted before the last one. Pickling sends only the path,
+    worker processes map the same file.
+    """
+
+    def __init__(self, stem, mode='r', tickers=None):
+        self.stem = stem
+        self.mode = mode
+        meta_path, data_path, dates_path = _paths(stem)
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        self.capacity = meta['capacity']
+        self.n_dates = meta['n_dates']
+        self._file_tickers = meta['tickers']
+        # Display names, e.g. normalized codes; positions still follow the file
+        self.tickers = list(tickers) if tickers is not None else list(self._file_tickers)
+        self._pos = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.data = np.memmap(data_path, dtype=np.float64, mode=mode,
+                              shape=(len(self._file_tickers), self.capacity))
+        self._dates = np.fromfile(dates_path, dtype=np.int64, count=self.n_dates)
+
+    def __getstate__(self):
+        return {'stem': self.stem, 'mode': 'r', 'tickers': self.tickers}
+
+    def __setstate__(self, state):
+        self.__init__(state['stem'], state['mode'], state['tickers'])
+
+    @classmethod
+    def create(cls, stem, frame, capacity=None):
+        frame = frame.sort_index()
+        dates = _as_dates(frame.index)
+        capacity = max(capacity or 2 * len(dates), MIN_CAPACITY)
+        meta_path, data_path, dates_path = _paths(stem)
+        data = np.full((frame.shape[1], capacity), np.nan)
+        data[:, :len(dates)] = frame.to_numpy(dtype=np.float64).T
+        data.tofile(data_path)
+        dates.asi8.tofile(dates_path)
+        cls._write_meta(meta_path, [str(c) for c in frame.columns], capacity, len(dates))
+        logger.info(f"Wrote price matrix {stem}: {len(dates)} dates x {frame.shape[1]} tickers")
+        return cls(stem)
+
+    @staticmethod
+    def _write_meta(meta_path, tickers, capacity, n_dates):
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'tickers': tickers, 'capacity': capacity, 'n_dates': n_dates}, f, ensure_ascii=False)
+        os.replace(tmp_path, meta_path)
+
+    @property
+    def dates(self):
+        return pd.DatetimeIndex(self._dates.view('datetime64[ns]'), name='Date')
+
+    def with_tickers(self, tickers):
+        """The same file under other ticker names (same order), without copying data."""
+        return PriceMatrix(self.stem, self.mode, tickers)
+
+    def _rows(self, start=None, end=None):
+        lo = 0 if start is None else np.searchsorted(self._dates, _as_dates([start]).asi8[0], side='left')
+        hi = self.n_dates if end is None else np.searchsorted(self._dates, _as_dates([end]).asi8[0], side='right')
+        return slice(lo, hi)
+
+    def series(self, ticker, start=None, end=None):
+        rows = self._rows(start, end)
+        return pd.Series(np.array(self.data[self._pos[ticker], rows]), index=self.dates[rows], name=ticker)
+
+    def get(self, ticker, default=None):
+        return self.series(ticker) if ticker in self._pos else default
+
+    def window(self, start=None, end=None, tickers=None):
+        """Frame of the dates in [start, end] (inclusive) for ``tickers`` (default: all)."""
+        rows = self._rows(start, end)
+        tickers = self.tickers if tickers is None else list(tickers)
+        block = self.data[[self._pos[t] for t in tickers], rows]
+        return pd.DataFrame(block.T, index=self.dates[rows], columns=tickers)
+
+    def to_frame(self):
+        return self.window()
+
+    def latest(self):
+        """(valuation date, last row of prices per ticker), like ``frame.index.max()`` and ``frame.iloc[-1]``."""
+        if self.n_dates == 0:
+            return None, pd.Series(np.nan, index=self.tickers)
+        return self.dates[-1], pd.Series(np.array(self.data[:, self.n_dates - 1]), index=self.tickers)
+
+    def append(self, frame):
+        """Write ``frame`` into the matrix: known dates are overwritten in place, later dates fill
+        reserved rows, new tickers are added at the end of the file. Returns the reopened matrix."""
+        if self.mode != 'r+':
+            raise ValueError("Open the price matrix with mode='r+' to append")
+        frame = frame.sort_index()
+        dates = _as_dates(frame.index).asi8
+        pos = pd.Index(self._dates).get_indexer(dates)
+        new = pos < 0
+        last = self._dates[-1] if self.n_dates else np.iinfo(np.int64).min
+        if (dates[new] <= last).any() or self.n_dates + new.sum() > self.capacity:
+            # Back-filled dates or a full matrix: merge and rewrite once with room to grow
+            merged = frame.combine_first(self.to_frame()) if self.n_dates else frame
+            self.data.flush()
+            del self.data
+            return PriceMatrix.create(self.stem, merged, capacity=2 * len(merged))
+
+        meta_path, data_path, dates_path = _paths(self.stem)
+        added = [str(c) for c in frame.columns if str(c) not in self._file_tickers]
+        if added:
+            self.data.flush()
+            del self.data
+            with open(data_path, 'ab') as f:
+                np.full((len(added), self.capacity), np.nan).tofile(f)
+            self._file_tickers = self._file_tickers + added
+            self.data = np.memmap(data_path, dtype=np.float64, mode='r+',
+                                  shape=(len(self._file_tickers), self.capacity))
+        rows = pos.copy()
+        rows[new] = self.n_dates + np.arange(new.sum())
+        file_pos = {t: i for i, t in enumerate(self._file_tickers)}
+        values = frame.to_numpy(dtype=np.float64)
+        for j, ticker in enumerate(frame.columns):
+            self.data[file_pos[str(ticker)], rows] = values[:, j]
+        self.data.flush()
+        with open(dates_path, 'ab') as f:
+            dates[new].tofile(f)
+        self._write_meta(meta_path, self._file_tickers, self.capacity, self.n_dates + int(new.sum()))
+        logger.info(f"Price matrix {self.stem}: {int(new.sum())} dates appended, {len(added)} tickers added, "
+                    f"{int((~new).sum())} dates updated")
+        return PriceMatrix(self.stem, 'r+')
+
+
+def save_price_matrix(frame, stem):
+    """Create the matrix for ``stem`` or append ``frame`` to the existing one."""
+    if not exists(stem):
+        return PriceMatrix.create(stem, frame)
+    return PriceMatrix(stem, 'r+').append(frame)
+
+
+def load_prices(stem):
+    """The price matrix of ``stem`` when it exists, else the wide price artifact as a DataFrame."""
+    if exists(stem):
+        return PriceMatrix(stem)
+    return load_artifact(stem, schema=None, index_col='Date')
+
+
+def latest_prices(prices):
+    """(valuation date, last price per ticker) of a PriceMatrix or a wide DataFrame."""
+    if isinstance(prices, PriceMatrix):
+        return prices.latest()
+    if prices.empty:
+        return None, pd.Series(np.nan, index=prices.columns.astype(str))
+    return prices.index.max(), prices.iloc[-1].set_axis(prices.columns.astype(str))
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import logging
+import os
+
+import pandas as pd
+
+from pricefetch import ConcurrentFetcher, PriceProvider
+
+logger = logging.getLogger(__name__)
+
+STORE_FOLDER = r'C:\Users\100ca\Documents\PyCode\TRADEHISTORY\DIC\prices'
+
+_STORES = {}
+
+
+def _day(value):
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert(None)
+    return ts.normalize()
+
+
+def merge_ranges(ranges):
+    """Sorted, non-overlapping [start, end) day ranges."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def missing_ranges(covered, start, end):
+    """Parts of [start, end) that no range in ``covered`` contains."""
+    gaps = []
+    cursor = start
+    for cov_start, cov_end in merge_ranges(covered):
+        if cov_end <= cursor:
+            continue
+        if cov_start >= end:
+            break
+        if cov_start > cursor:
+            gaps.append((cursor, cov_start))
+        cursor = max(cursor, cov_end)
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+class YFinanceProvider(PriceProvider):
+    """Daily OHLC from Yahoo Finance, one download call per batch of symbols."""
+
+    def __init__(self, timeout=30):
+        import yfinance
+        self.yf = yfinance
+        self.timeout = timeout
+
+    def fetch(self, symbols, start, end):
+        """symbol -> frame of price fields for [start, end); symbols without data are left out."""
+        # ConcurrentFetcher runs the batches in parallel, so yfinance's own threads are off
+        data = self.yf.download(list(symbols), start=start, end=end, ignore_tz=True, group_by='column',
+                                auto_adjust=False, progress=False, threads=False, timeout=self.timeout)
+        if data.empty:
+            return {}
+        if not isinstance(data.columns, pd.MultiIndex):
+            data.columns = pd.MultiIndex.from_product([data.columns, list(symbols)[:1]])
+        out = {}
+        for symbol in data.columns.get_level_values(1).unique():
+            frame = data.xs(symbol, axis=1, level=1).dropna(how='all')
+            if not frame.empty:
+                out[symbol] = frame
+        return out
+
+
+class CsvFileProvider(PriceProvider):
+    """Prices read from ``<folder>/<symbol>.csv`` (Date column plus price fields), for offline runs and tests.
+
+    Every fetch is recorded in ``requests`` so callers can check what was asked for.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.requests = []
+
+    def fetch(self, symbols, start, end):
+        self.requests.append((tuple(symbols), start, end))
+        out = {}
+        for symbol in symbols:
+            path = os.path.join(self.folder, f'{symbol}.csv')
+            if not os.path.exists(path):
+                continue
+            frame = pd.read_csv(path, index_col='Date', parse_dates=['Date'])
+            out[symbol] = frame[(frame.index >= start) & (frame.index < end)]
+        return out
+
+
+class PriceStore:
+    """Daily price history per symbol, kept on disk with the date ranges already fetched.
+
+    ``get`` fetches only the parts of the requested range that no earlier call
+    covered, so a daily run downloads the last day or two per symbol. Today is
+    never marked as covered because its bar is still changing.
+    """
+
+    def __init__(self, folder=STORE_FOLDER, provider=None, today=None):
+        self.folder = folder
+        self.provider = provider
+        self.today = _day(today if today is not None else pd.Timestamp.today())
+        self.manifest_path = os.path.join(folder, 'manifest.json')
+        os.makedirs(folder, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def save(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _shard_path(self, symbol):
+        return os.path.join(self.folder, hashlib.sha1(symbol.encode('utf-8')).hexdigest()[:16] + '.pkl')
+
+    def covered(self, symbol):
+        entry = self.manifest.get(symbol, {})
+        return [(pd.Timestamp(start), pd.Timestamp(end)) for start, end in entry.get('ranges', [])]
+
+    def gaps(self, symbol, start, end):
+        return missing_ranges(self.covered(symbol), _day(start), _day(end))
+
+    def history(self, symbol):
+        """Everything stored for ``symbol``, without fetching."""
+        path = self._shard_path(symbol)
+        return pd.read_pickle(path) if os.path.exists(path) else pd.DataFrame()
+
+    def _store(self, symbol, frame, ranges):
+        if frame is not None and not frame.empty:
+            frame = frame.copy()
+            frame.index = pd.DatetimeIndex(frame.index).tz_localize(None) if frame.index.tz is not None \
+                else pd.DatetimeIndex(frame.index)
+            frame.index.name = 'Date'
+            merged = pd.concat([self.history(symbol), frame])
+            merged = merged[~merged.index.duplicated(keep='last')].sort_index()
+            merged.to_pickle(self._shard_path(symbol))
+        covered = self.covered(symbol) + [r for r in ranges if r[0] < r[1]]
+        self.manifest[symbol] = {'ranges': [[start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')]
+                                            for start, end in merge_ranges(covered)]}
+
+    def update(self, symbols, start, end):
+        """Fetch the uncovered parts of [start, end) for ``symbols``; symbols sharing a gap are fetched together."""
+        start, end = _day(start), _day(end)
+        batches = {}
+        for symbol in dict.fromkeys(symbols):
+            for gap in self.gaps(symbol, start, end):
+                batches.setdefault(gap, []).append(symbol)
+        if not batches:
+            return
+        if self.provider is None:
+            self.provider = ConcurrentFetcher(YFinanceProvider())
+        for (gap_start, gap_end), batch in batches.items():
+            logger.info(f"Fetching {len(batch)} symbols for {gap_start:%Y-%m-%d} - {gap_end:%Y-%m-%d}")
+            fetched = self.provider.fetch(batch, gap_start, gap_end)
+            # Symbols the provider returned nothing for stay uncovered and are retried next time
+            for symbol, frame in fetched.items():
+                self._store(symbol, frame, [(gap_start, min(gap_end, self.today))])
+            missing = [s for s in batch if s not in fetched]
+            if missing:
+                logger.warning(f"No data for {missing} in {gap_start:%Y-%m-%d} - {gap_end:%Y-%m-%d}")
+        self.save()
+
+    def failure_report(self):
+        """Symbols the provider could not deliver, when it reports failures (ConcurrentFetcher)."""
+        if hasattr(self.provider, 'failure_report'):
+            return self.provider.failure_report()
+        return pd.DataFrame(columns=['symbol', 'start', 'end', 'attempts', 'error'])
+
+    def get(self, symbols, start, end=None, field='Close'):
+        """Date x symbol frame of ``field`` for [start, end), fetching only what is missing."""
+        symbols = list(dict.fromkeys(symbols))
+        start = _day(start)
+        end = _day(end) if end is not None else self.today + pd.Timedelta(days=1)
+        self.update(symbols, start, end)
+        columns = {}
+        for symbol in symbols:
+            history = self.history(symbol)
+            if field in history.columns:
+                rows = (history.index >= start) & (history.index < end)
+                columns[symbol] = history.loc[rows, field]
+        prices = pd.DataFrame(columns, columns=symbols)
+        prices.index.name = 'Date'
+        return prices
+
+
+def default_store(folder=STORE_FOLDER):
+    """The shared store of the TRADEHISTORY folder, created once per process."""
+    if folder not in _STORES:
+        _STORES[folder] = PriceStore(folder)
+    return _STORES[folder]
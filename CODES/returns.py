@@ -0,0 +1,164 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from costbasis import trade_sides
+from lotledger import LotLedger
+from pricematrix import latest_prices
+
+logger = logging.getLogger(__name__)
+
+DAYS_PER_YEAR = 365.25
+# Rates are searched in (-100%, MAX_RATE]; XIRR beyond +1e6 per year is not meaningful
+MIN_RATE = -0.999999
+MAX_RATE = 1e6
+
+
+def _npv(rate, groups, years, amounts, n_groups):
+    # NPV and its derivative per group, with every group's rate applied to its own flows
+    log_growth = np.log1p(rate)[groups]
+    discount = np.exp(-years * log_growth)
+    npv = np.bincount(groups, amounts * discount, n_groups)
+    slope = np.bincount(groups, -years * amounts * discount / (1.0 + rate[groups]), n_groups)
+    return npv, slope
+
+
+def xirr(groups, dates, amounts, tol=1e-9, max_iter=100):
+    """Annual money-weighted return per group, solved for all groups in one vectorized iteration.
+
+    Every iteration takes a Newton step per group and falls back to bisection
+    of the group's sign-change bracket when the step leaves it. Groups whose
+    flows are all of one sign have no XIRR (NaN).
+    """
+    groups = groups if isinstance(groups, pd.Index) else pd.Index(groups)
+    codes, labels = groups.factorize()
+    amounts = np.asarray(amounts, dtype=np.float64)
+    ns = pd.to_datetime(pd.Series(dates)).to_numpy(dtype='datetime64[ns]').view(np.int64)
+    n = len(labels)
+    keep = (codes >= 0) & np.isfinite(amounts) & (amounts != 0)
+    codes, amounts, ns = codes[keep], amounts[keep], ns[keep]
+    # Years from each group's first flow keeps the discount factors near 1
+    first = np.full(n, np.iinfo(np.int64).max)
+    np.minimum.at(first, codes, ns)
+    years = (ns - first[codes]) / (DAYS_PER_YEAR * 86400e9)
+
+    has_in = np.bincount(codes, amounts > 0, n) > 0
+    has_out = np.bincount(codes, amounts < 0, n) > 0
+    solvable = has_in & has_out
+
+    lo = np.full(n, MIN_RATE)
+    hi = np.full(n, 1.0)
+    f_lo, _ = _npv(lo, codes, years, amounts, n)
+    f_hi, _ = _npv(hi, codes, years, amounts, n)
+    # Widen the upper end until it brackets a root
+    while True:
+        widen = solvable & (np.sign(f_hi) == np.sign(f_lo)) & (hi < MAX_RATE)
+        if not widen.any():
+            break
+        hi[widen] = np.minimum(hi[widen] * 10.0, MAX_RATE)
+        f_hi, _ = _npv(hi, codes, years, amounts, n)
+    bracketed = solvable & (np.sign(f_hi) != np.sign(f_lo))
+
+    rate = np.clip(np.full(n, 0.1), lo, hi)
+    done = ~bracketed
+    for _ in range(max_iter):
+        f, slope = _npv(rate, codes, years, amounts, n)
+        scale = np.maximum(np.bincount(codes, np.abs(amounts), n), 1.0)
+        done |= np.abs(f) <= tol * scale
+        if done.all():
+            break
+        same = np.sign(f) == np.sign(f_lo)
+        lo = np.where(same & ~done, rate, lo)
+        f_lo = np.where(same & ~done, f, f_lo)
+        hi = np.where(~same & ~done, rate, hi)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            newton = rate - f / slope
+        inside = np.isfinite(newton) & (newton > lo) & (newton < hi)
+        step = np.where(inside, newton, 0.5 * (lo + hi))
+        done |= np.abs(step - rate) <= tol * np.maximum(np.abs(rate), 1.0)
+        rate = np.where(done, rate, step)
+    if not done.all():
+        logger.warning(f"XIRR did not converge for {int((~done).sum())} groups")
+    rate = np.where(bracketed, rate, np.nan)
+    return pd.Series(rate, index=labels)
+
+
+def time_weighted_return(nav, flow_column='priced_flow'):
+    """Daily and cumulative time-weighted returns from the daily NAV.
+
+    Flows are taken to arrive at the start of the day, so a day's return is
+    NAV / (previous NAV + flow) - 1. Days without capital return 0.
+    Returns (daily frame, annualized TWR).
+    """
+    values = nav['nav'].to_numpy(dtype=np.float64)
+    flows = nav[flow_column].to_numpy(dtype=np.float64) if flow_column in nav.columns else np.zeros(len(values))
+    capital = np.r_[0.0, values[:-1]] + flows
+    daily = np.divide(values, capital, out=np.ones(len(values)), where=capital > 0) - 1.0
+    growth = np.cumprod(1.0 + daily)
+    result = pd.DataFrame({'daily_return': daily, 'twr': growth - 1.0}, index=nav.index)
+    if len(values) < 2:
+        return result, np.nan
+    days = (nav.index[-1] - nav.index[0]).days
+    annualized = growth[-1] ** (DAYS_PER_YEAR / days) - 1.0 if days > 0 else np.nan
+    return result, annualized
+
+
+def jpy_last_prices(trades, prices, fx_rates=None):
+    """Last price per security converted to JPY at the valuation date; returns (valuation date, prices)."""
+    valuation_date, last = latest_prices(prices)
+    if fx_rates is not None and 'currency' in trades.columns:
+        currency = trades.groupby(trades['security_code'].astype(str))['currency'].last().astype(object)
+        currency = currency.reindex(last.index)
+        rate = fx_rates.rate_to(currency, [valuation_date] * len(currency))
+        last = last * np.where(currency.to_numpy() == 'JPY', 1.0, rate)
+    return valuation_date, last
+
+
+def return_report(trades, last_prices_jpy, valuation_date, amount_column='amount_jpy', ledger=None):
+    """XIRR per security, per account_type and for the whole portfolio, solved in one batch.
+
+    Buys are outflows, sells inflows (``amount_column``, JPY), and what is
+    still held is an inflow at ``valuation_date`` valued at ``last_prices_jpy``.
+    The open quantities come from ``ledger`` (a LotLedger of the same trades) or a new one.
+    """
+    side = trade_sides(trades['transaction_type'])
+    keep = (side != 0) & trades['security_code'].notna().to_numpy()
+    df = trades.loc[keep]
+    code = df['security_code'].astype(str).to_numpy(dtype=object)
+    account = df['account_type'].astype(object).fillna('').to_numpy(dtype=object) \
+        if 'account_type' in df.columns else np.full(len(df), '', dtype=object)
+    amount = -side[keep] * np.abs(pd.to_numeric(df[amount_column], errors='coerce').to_numpy(dtype=np.float64))
+    dates = pd.to_datetime(df['trade_date']).to_numpy()
+
+    # Holdings left per (security, account_type) from the FIFO lots, valued at the last JPY price
+    ledger = LotLedger.from_trades(df) if ledger is None else ledger
+    held = ledger.open_lots.groupby(['security_code', 'account_type'], sort=False)['quantity'].sum().reset_index()
+    held['security_code'] = held['security_code'].astype(str)
+    held['value'] = held['quantity'] * held['security_code'].map(last_prices_jpy).to_numpy(dtype=np.float64)
+    unpriced = held.loc[held['value'].isna(), 'security_code'].unique()
+    if len(unpriced):
+        logger.warning(f"No JPY price for {len(unpriced)} held securities, valued at 0: {list(unpriced)[:10]}")
+    held['value'] = held['value'].fillna(0.0)
+
+    flows = pd.DataFrame({'security_code': np.r_[code, held['security_code'].to_numpy(dtype=object)],
+                          'account_type': np.r_[account, held['account_type'].to_numpy(dtype=object)],
+                          'date': np.r_[dates, np.repeat(np.datetime64(pd.Timestamp(valuation_date)), len(held))],
+                          'amount': np.r_[amount, held['value'].to_numpy()],
+                          'valuation': np.r_[np.zeros(len(df)), held['value'].to_numpy()]})
+    levels = [('security', flows['security_code']), ('account_type', flows['account_type']),
+              ('portfolio', pd.Series('portfolio', index=flows.index))]
+    # One long table of flows keyed by (level, key), so every group is solved in the same pass
+    stacked = pd.concat([flows.assign(level=level, key=key.to_numpy()) for level, key in levels], ignore_index=True)
+    group = pd.MultiIndex.from_arrays([stacked['level'], stacked['key']])
+    rates = xirr(group, stacked['date'], stacked['amount'])
+
+    totals = pd.DataFrame({'level': stacked['level'], 'key': stacked['key'],
+                           'invested': -stacked['amount'].clip(upper=0),
+                           'returned': stacked['amount'].clip(lower=0) - stacked['valuation'],
+                           'current_value': stacked['valuation']})
+    report = totals.groupby(['level', 'key'], sort=False).sum()
+    report['profit'] = report['returned'] + report['current_value'] - report['invested']
+    report['xirr'] = rates.reindex(report.index).to_numpy()
+    order = {'portfolio': 0, 'account_type': 1, 'security': 2}
+    return report.sort_index(key=lambda idx: idx.map(order) if idx.name == 'level' else idx)
@@ -0,0 +1,142 @@
+import logging
+import os
+import pickle
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from ingestcache import file_digest
+
+logger = logging.getLogger(__name__)
+
+# (table, dictionary file, key column, value column); earlier files win within a table.
+# names:     security name -> code, fills codes the exports do not carry
+# overrides: security name -> code, replaces whatever code the trade has (2dcleanus)
+# etf:       JPX ETF code -> similar US ETF ticker
+SOURCES = [
+    ('names', 'securitycode.csv', 'security_name', 'security_code'),
+    ('names', 'jpxcodes.csv', '銘柄名', 'コード'),
+    ('overrides', 'securitycode2.csv', 'security_name', 'security_code'),
+    ('etf', 'jpxcodesus.csv', 'コード', '類似米国ETFティッカー'),
+]
+
+CACHE_FILE = 'secmaster.pkl'
+
+_SPACES = re.compile(r'\s+')
+_FLOAT_CODE = re.compile(r'\d+\.0')
+
+
+def _normalize_uniques(values, func):
+    # Normalize each distinct value once and map back; missing values stay missing
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    codes, uniques = pd.factorize(series)
+    normalized = np.array([func(v) for v in uniques] + [None], dtype=object)
+    return pd.Series(normalized[codes], index=series.index, dtype=object)
+
+
+def _name_key(value):
+    # NFKC folds full-width letters/digits and half-width katakana; whitespace runs become one space
+    return _SPACES.sub(' ', unicodedata.normalize('NFKC', str(value))).strip()
+
+
+def _code_key(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    key = unicodedata.normalize('NFKC', str(value)).strip().upper()
+    # Codes that went through a float column in some CSV, e.g. '1306.0'
+    return key[:-2] if _FLOAT_CODE.fullmatch(key) else key
+
+
+def normalize_names(values):
+    return _normalize_uniques(values, _name_key)
+
+
+def normalize_codes(values):
+    return _normalize_uniques(values, _code_key)
+
+
+class SecurityMaster:
+    """All security dictionaries merged into hash indexes on normalized keys."""
+
+    def __init__(self, tables):
+        # table name -> Series of codes indexed by a unique normalized key
+        self.tables = tables
+
+    @classmethod
+    def build(cls, dic_folder, sources=SOURCES):
+        parts = {}
+        for table, file_name, key_col, value_col in sources:
+            path = os.path.join(dic_folder, file_name)
+            if not os.path.exists(path):
+                logger.info(f"Security dictionary {file_name} not found, skipped")
+                continue
+            df = pd.read_csv(path, usecols=[key_col, value_col]).dropna()
+            key = normalize_codes(df[key_col]) if table == 'etf' else normalize_names(df[key_col])
+            parts.setdefault(table, []).append(pd.Series(normalize_codes(df[value_col]).to_numpy(),
+                                                          index=key.to_numpy()))
+        tables = {}
+        for table, _, _, _ in sources:
+            if table in parts and table not in tables:
+                merged = pd.concat(parts[table])
+                # First entry of a key wins, both within a file and across files
+                tables[table] = merged[~merged.index.duplicated(keep='first')]
+        for table, index in tables.items():
+            logger.info(f"Security master {table}: {len(index)} keys")
+        return cls(tables)
+
+    @classmethod
+    def load(cls, dic_folder, sources=SOURCES, cache_file=None):
+        """Load the persisted master, rebuilding it when any source dictionary changed."""
+        cache_file = cache_file or os.path.join(dic_folder, CACHE_FILE)
+        digests = {}
+        for _, file_name, _, _ in sources:
+            path = os.path.join(dic_folder, file_name)
+            digests[file_name] = file_digest(path) if os.path.exists(path) else None
+        signature = {'sources': [list(s) for s in sources], 'digests': digests}
+
+        if os.path.exists(cache_file):
+            with open(cache_file, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['signature'] == signature:
+                return cls(cached['tables'])
+            logger.info("Security dictionaries changed, rebuilding the security master")
+
+        master = cls.build(dic_folder, sources)
+        tmp_path = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'signature': signature, 'tables': master.tables}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_file)
+        return master
+
+    def lookup(self, table, keys):
+        """Codes for already-normalized ``keys`` (NaN where the key is unknown)."""
+        index = self.tables.get(table)
+        keys = pd.Series(keys)
+        if index is None:
+            return pd.Series(np.nan, index=keys.index, dtype=object)
+        pos = index.index.get_indexer(keys.to_numpy())
+        found = np.append(index.to_numpy(dtype=object), np.nan)[pos]
+        return pd.Series(found, index=keys.index, dtype=object)
+
+    def fill_codes(self, names, codes):
+        """Keep existing codes, fill missing or blank ones from the security name."""
+        codes = pd.Series(codes).astype(object)
+        # Funds carry an empty code in the exports; CSV read it back as missing, parquet keeps ''
+        codes = codes.mask(normalize_codes(codes) == '')
+        return codes.fillna(self.lookup('names', normalize_names(names)))
+
+    def override_codes(self, names, codes):
+        """Replace codes whose security name has an override entry."""
+        codes = pd.Series(codes).astype(object)
+        return self.lookup('overrides', normalize_names(names)).fillna(codes)
+
+    def map_etf(self, codes):
+        """JPX ETF codes -> similar US tickers; other codes are unchanged."""
+        codes = pd.Series(codes).astype(object)
+        return self.lookup('etf', normalize_codes(codes)).fillna(codes)
+
+    def resolve(self, names, codes):
+        """fill_codes, map_etf and override_codes in pipeline order."""
+        return self.override_codes(names, self.map_etf(self.fill_codes(names, codes)))
@@ -0,0 +1,23 @@
+import os
+
+import pandas as pd
+
+from artifacts import load_artifact
+from dateparse import LOCAL_TZ, parse_date_column
+
+FOREX_STEM = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'DIC', 'forex_data')
+
+
+def test_forex_index_stays_on_utc_day():
+    # forex_data.csv の Date は UTC 0時 ('2024-01-05 00:00:00+00:00')、JST に寄せると 09:00 になってしまう
+    rates = load_artifact(FOREX_STEM, schema=None, index_col='Date')
+    assert (rates.index == rates.index.normalize()).all()
+    assert rates.loc[pd.Timestamp('2024-01-05'), 'USDJPY'] > 144
+
+
+def test_trade_dates_keep_japan_day():
+    values = pd.Series(['2024-01-01 00:00:00+09:00', '2024-01-05 00:00:00+00:00', '2024-01-05'])
+    trade = parse_date_column(values, tz=LOCAL_TZ)
+    assert list(trade) == [pd.Timestamp('2024-01-01'), pd.Timestamp('2024-01-05 09:00'), pd.Timestamp('2024-01-05')]
+    utc = parse_date_column(values)
+    assert list(utc) == [pd.Timestamp('2023-12-31 15:00'), pd.Timestamp('2024-01-05'), pd.Timestamp('2024-01-05')]
@@ -0,0 +1,35 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from artifacts import save_artifact
+from fxrates import FxRates, load_fx_rates
+
+
+@pytest.fixture
+def forex_stems(tmp_path):
+    # 0fx.py と同じく UTC 0時の index で forex_data を保存し、CSV だけのコピーも作る
+    rates = pd.DataFrame({'USDJPY': [142.999, 144.765], 'EURJPY': [156.228, 158.468]},
+                         index=pd.DatetimeIndex(['2024-01-04', '2024-01-05'], name='Date').tz_localize('UTC'))
+    stem = str(tmp_path / 'forex_data')
+    save_artifact(rates, stem, schema=None, index=True)
+    csv_stem = str(tmp_path / 'csv' / 'forex_data')
+    os.makedirs(os.path.dirname(csv_stem))
+    shutil.copy(f'{stem}.csv', f'{csv_stem}.csv')
+    return [stem, csv_stem]
+
+
+def test_midnight_trade_gets_rate_of_its_day(forex_stems):
+    trades = pd.Series(pd.to_datetime(['2024-01-05 00:00', '2024-01-05 15:30', '2024-01-04 23:59']))
+    for stem in forex_stems:
+        rates = load_fx_rates(stem).asof('USDJPY', trades)
+        assert list(rates) == [144.765, 144.765, 142.999], stem
+
+
+def test_rate_dated_later_in_the_day_covers_midnight_trade():
+    # 日中の時刻付きで記録されたレートも同じ日の 0時の取引に使う
+    rates = FxRates(pd.DataFrame({'USDJPY': [142.999, 144.765]},
+                                 index=pd.DatetimeIndex(['2024-01-04 09:00', '2024-01-05 09:00'])))
+    assert list(rates.asof('USDJPY', pd.Series(pd.to_datetime(['2024-01-05'])))) == [144.765]
@@ -0,0 +1,36 @@
+import importlib
+
+import pandas as pd
+
+from ingestcache import ShardCache
+
+TradeDataIntegrator = importlib.import_module('1concatw').TradeDataIntegrator
+
+RAKUTEN_JP = ('約定日,受渡日,銘柄コード,銘柄名,口座区分,売買区分,数量［株］,単価［円］,受渡金額［円］\n'
+              '2024/01/05,2024/01/09,1306,ＴＯＰＩＸ連動型上場投信,特定,買付,10,"2,500","25,000"\n')
+
+
+def test_missing_source_is_skipped(tmp_path):
+    present, missing = tmp_path / 'a.csv', tmp_path / 'b.csv'
+    present.write_text('x\n1\n')
+    missing.write_text('x\n2\n')
+    cache = ShardCache(str(tmp_path / 'cache'))
+    assert cache.stale_files([str(present), str(missing)]) == [str(present), str(missing)]
+    cache.store(str(present), pd.DataFrame({'x': [1]}))
+    cache.store(str(missing), pd.DataFrame({'x': [2]}))
+    cache.save()
+
+    # 消えたファイルは読み飛ばし、古いシャードも返さない
+    missing.unlink()
+    cache = ShardCache(str(tmp_path / 'cache'))
+    assert cache.stale_files([str(present), str(missing)]) == []
+    assert [df['x'].tolist() for df in cache.load([str(present), str(missing)])] == [[1]]
+
+
+def test_incremental_run_without_wise_store(tmp_path):
+    for folder in ['rakuten', 'sbi', 'wise']:
+        (tmp_path / 'RAWDATA' / folder).mkdir(parents=True)
+    (tmp_path / 'RAWDATA' / 'rakuten' / 'tradehistory(JP).csv').write_bytes(RAKUTEN_JP.encode('cp932'))
+    for _ in range(2):
+        df = TradeDataIntegrator(str(tmp_path), incremental=True).process_data()
+        assert df['security_code'].astype(str).tolist() == ['1306']
@@ -0,0 +1,36 @@
+import importlib
+
+import pandas as pd
+
+from artifacts import load_artifact, read_table
+
+TradeDataIntegrator = importlib.import_module('1concatw').TradeDataIntegrator
+
+RAKUTEN_JP = ('約定日,受渡日,銘柄コード,銘柄名,口座区分,売買区分,数量［株］,単価［円］,受渡金額［円］\n'
+              '2024/01/05,2024/01/09,1306,ＴＯＰＩＸ連動型上場投信,特定,買付,10,"2,500","25,000"\n'
+              '2024/02/05,2024/02/07,1306,ＴＯＰＩＸ連動型上場投信,特定,売付,5,"2,700","13,500"\n')
+
+# 0wise.py の増分ストアと同じ列 (基本列、通貨ペアのレート、ID)
+WISE_STORE = ('trade_date,security_code,from_currency,to_currency,from_amount,to_amount,exchange_rate,'
+              'transaction_type,amount_jpy,EURJPY=X,USDJPY=X,EURUSD=X,ID\n'
+              '2024-01-03 10:00:00,EURJPY=X,JPY,EUR,100000,640,156.2,Buy,100000,156.2,,,1001\n'
+              '2024-01-20 10:00:00,USDJPY=X,JPY,USD,50000,340,147.0,Buy,50000,,147.0,,1002\n')
+
+
+def test_stream_data_writes_process_data_columns(tmp_path):
+    for folder in ['rakuten', 'sbi', 'wise']:
+        (tmp_path / 'RAWDATA' / folder).mkdir(parents=True)
+    (tmp_path / 'RAWDATA' / 'rakuten' / 'tradehistory(JP).csv').write_bytes(RAKUTEN_JP.encode('cp932'))
+    (tmp_path / 'RAWDATA' / 'wise' / 'cleaned_wise_data.csv').write_text(WISE_STORE, encoding='utf-8')
+    integrator = TradeDataIntegrator(str(tmp_path))
+    in_memory = integrator.process_data()
+
+    stem = str(tmp_path / 'streamed')
+    assert integrator.stream_data(f'{stem}.csv', chunksize=1, run_rows=2) == len(in_memory)
+    streamed = load_artifact(stem)
+    assert list(streamed.columns) == list(in_memory.columns)
+    assert list(read_table(f'{stem}.csv').columns) == list(in_memory.columns)
+    assert streamed.dtypes.astype(str).to_dict() == in_memory.dtypes.astype(str).to_dict()
+    assert streamed['ID'].dropna().astype(str).tolist() == ['1001', '1002']
+    pd.testing.assert_series_equal(streamed['USDJPY=X'].reset_index(drop=True),
+                                   in_memory['USDJPY=X'].reset_index(drop=True))
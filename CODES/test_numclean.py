@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+from numclean import clean_numeric_column, rejected_report
+
+
+def test_broker_amounts():
+    values, rejected = clean_numeric_column(pd.Series(['1,234.5', '２５円', '10,000(100)', '▲1,000', '-', None]))
+    np.testing.assert_array_equal(values, [1234.5, 25.0, 10000.0, 1000.0, np.nan, np.nan])
+    assert rejected.empty
+
+
+def test_scientific_notation_is_not_truncated():
+    # '1.5e3' を 1.5 に切り詰めず、指数ごと読む
+    values, rejected = clean_numeric_column(pd.Series(['1.5e3', '2E-2', '-3.1e+2']))
+    np.testing.assert_array_equal(values, [1500.0, 0.02, -310.0])
+    assert rejected.empty
+
+
+def test_unparseable_values_are_reported():
+    values, rejected = clean_numeric_column(pd.Series(['abc', '12', 'abc']), name='price')
+    np.testing.assert_array_equal(values, [np.nan, 12.0, np.nan])
+    report = rejected_report({'price': rejected})
+    assert report.to_dict('records') == [{'reason': 'unparseable price', 'column': 'price', 'value': 'abc', 'rows': 2}]
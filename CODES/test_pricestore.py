@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pricefetch import ConcurrentFetcher
+from pricestore import CsvFileProvider, PriceStore
+
+TODAY = '2024-06-03'
+
+
+@pytest.fixture
+def provider(tmp_path):
+    # 2024年1月〜5月の営業日の終値を銘柄ごとの CSV に書く
+    folder = tmp_path / 'csv'
+    folder.mkdir()
+    dates = pd.bdate_range('2024-01-01', '2024-05-31')
+    for i, symbol in enumerate(['AAA', 'BBB']):
+        frame = pd.DataFrame({'Close': 100.0 * (i + 1) + np.arange(len(dates))}, index=pd.Index(dates, name='Date'))
+        frame.to_csv(folder / f'{symbol}.csv')
+    return CsvFileProvider(str(folder))
+
+
+@pytest.fixture
+def store(tmp_path, provider):
+    return PriceStore(str(tmp_path / 'store'), provider=provider, today=TODAY)
+
+
+def fetched_ranges(provider):
+    return [(symbols, f'{start:%Y-%m-%d}', f'{end:%Y-%m-%d}') for symbols, start, end in provider.requests]
+
+
+def test_first_get_fetches_whole_range(store, provider):
+    prices = store.get(['AAA', 'BBB'], '2024-01-01', '2024-02-01')
+    assert fetched_ranges(provider) == [(('AAA', 'BBB'), '2024-01-01', '2024-02-01')]
+    assert list(prices.columns) == ['AAA', 'BBB']
+    assert len(prices) == 23
+    assert prices.index.max() == pd.Timestamp('2024-01-31')
+
+
+def test_refresh_fetches_only_missing_range(store, provider):
+    store.get(['AAA', 'BBB'], '2024-01-01', '2024-02-01')
+    provider.requests.clear()
+    prices = store.get(['AAA', 'BBB'], '2024-01-01', '2024-03-01')
+    assert fetched_ranges(provider) == [(('AAA', 'BBB'), '2024-02-01', '2024-03-01')]
+    expected = pd.read_csv(f'{provider.folder}/AAA.csv', index_col='Date', parse_dates=['Date'])['Close']
+    expected = expected[(expected.index >= '2024-01-01') & (expected.index < '2024-03-01')]
+    pd.testing.assert_series_equal(prices['AAA'], expected, check_names=False, check_freq=False)
+
+
+def test_gap_before_and_after_cached_range(store, provider):
+    store.get(['AAA'], '2024-02-01', '2024-03-01')
+    provider.requests.clear()
+    store.get(['AAA'], '2024-01-01', '2024-04-01')
+    assert fetched_ranges(provider) == [(('AAA',), '2024-01-01', '2024-02-01'),
+                                        (('AAA',), '2024-03-01', '2024-04-01')]
+
+
+def test_new_symbol_fetched_alone(store, provider):
+    store.get(['AAA'], '2024-01-01', '2024-02-01')
+    provider.requests.clear()
+    store.get(['AAA', 'BBB'], '2024-01-01', '2024-02-01')
+    assert fetched_ranges(provider) == [(('BBB',), '2024-01-01', '2024-02-01')]
+
+
+def test_cached_range_makes_no_provider_calls(tmp_path, store, provider):
+    first = store.get(['AAA', 'BBB'], '2024-01-01', '2024-03-01')
+    provider.requests.clear()
+    again = store.get(['AAA', 'BBB'], '2024-01-15', '2024-02-15')
+    assert provider.requests == []
+    pd.testing.assert_frame_equal(again, first.loc['2024-01-15':'2024-02-14'], check_freq=False)
+    # The manifest on disk carries the coverage over to a new store
+    reopened = PriceStore(str(tmp_path / 'store'), provider=provider, today=TODAY)
+    reopened.get(['AAA', 'BBB'], '2024-01-01', '2024-03-01')
+    assert provider.requests == []
+
+
+def test_today_is_never_covered(tmp_path, provider):
+    store = PriceStore(str(tmp_path / 'store'), provider=provider, today='2024-05-31')
+    store.get(['AAA'], '2024-05-01')
+    provider.requests.clear()
+    store.get(['AAA'], '2024-05-01')
+    assert fetched_ranges(provider) == [(('AAA',), '2024-05-31', '2024-06-01')]
+
+
+def test_symbol_without_data_stays_uncovered(store, provider):
+    store.get(['AAA', 'ZZZ'], '2024-01-01', '2024-02-01')
+    provider.requests.clear()
+    prices = store.get(['AAA', 'ZZZ'], '2024-01-01', '2024-02-01')
+    assert fetched_ranges(provider) == [(('ZZZ',), '2024-01-01', '2024-02-01')]
+    assert prices['ZZZ'].isna().all()
+
+
+def test_concurrent_fetcher_batches_only_the_gap(tmp_path, provider):
+    fetcher = ConcurrentFetcher(provider, batch_size=1, max_workers=2, retries=0)
+    store = PriceStore(str(tmp_path / 'store'), provider=fetcher, today=TODAY)
+    store.get(['AAA', 'BBB'], '2024-01-01', '2024-02-01')
+    provider.requests.clear()
+    prices = store.get(['AAA', 'BBB'], '2024-01-01', '2024-03-01')
+    assert sorted(fetched_ranges(provider)) == [(('AAA',), '2024-02-01', '2024-03-01'),
+                                                (('BBB',), '2024-02-01', '2024-03-01')]
+    assert prices.notna().all().all()
+    assert store.failure_report().empty
@@ -0,0 +1,100 @@
+import codecs
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+from ingestcache import file_digest
+
+logger = logging.getLogger(__name__)
+
+# Bytes inspected to guess the encoding; enough to cover the header and a few hundred rows
+SAMPLE_BYTES = 64 * 1024
+
+
+def _decodes(sample, encoding, truncated):
+    # A sample cut at an arbitrary byte may end inside a multi-byte character
+    for trim in range(4 if truncated else 1):
+        try:
+            sample[:len(sample) - trim].decode(encoding)
+            return True
+        except UnicodeDecodeError:
+            continue
+    return False
+
+
+def sniff_encoding(sample, preferred='cp932', truncated=False):
+    """Guess the encoding of a byte sample.
+
+    UTF-8 is checked first because Shift-JIS bytes are almost never valid
+    UTF-8; otherwise ``preferred`` wins. Japanese brokers emit cp932, the
+    Windows superset of Shift-JIS, so cp932 is the default rather than shift-jis.
+    """
+    if sample.isascii():
+        return preferred
+    for encoding in ('utf-8-sig', preferred):
+        if _decodes(sample, encoding, truncated):
+            return encoding
+    try:
+        import chardet
+    except ImportError:
+        chardet = None
+    if chardet is not None:
+        guess = chardet.detect(sample)['encoding']
+        if guess:
+            return guess
+    logger.warning(f"Could not determine encoding, falling back to {preferred}")
+    return preferred
+
+
+def detect_encoding(file_path, preferred='cp932', sample_size=SAMPLE_BYTES):
+    with open(file_path, 'rb') as f:
+        sample = f.read(sample_size)
+    return sniff_encoding(sample, preferred, truncated=len(sample) == sample_size)
+
+
+def _stamp_path(file_path, cache_dir):
+    name = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, f'{name}.json')
+
+
+def _read_stamp(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def transcoded_path(file_path, cache_dir, encoding=None):
+    """Return a UTF-8 copy of ``file_path``, cached under its content hash and source encoding.
+
+    A small stamp per source path records the size, mtime and encoding the
+    copy was made from, so an untouched file is served without reading it.
+    A touched file is hashed; the decode only happens the first time a given
+    (content, encoding) pair is seen.
+    """
+    encoding = encoding or detect_encoding(file_path)
+    stat = os.stat(file_path)
+    stamp_path = _stamp_path(file_path, cache_dir)
+    stamp = _read_stamp(stamp_path)
+    if stamp is not None and stamp['size'] == stat.st_size and stamp['mtime_ns'] == stat.st_mtime_ns \
+            and stamp['encoding'] == encoding and os.path.exists(os.path.join(cache_dir, stamp['target'])):
+        return os.path.join(cache_dir, stamp['target'])
+
+    name = f"{file_digest(file_path)}-{codecs.lookup(encoding).name}.csv"
+    target = os.path.join(cache_dir, name)
+    os.makedirs(cache_dir, exist_ok=True)
+    if not os.path.exists(target):
+        tmp_path = f'{target}.{os.getpid()}.tmp'
+        with open(file_path, encoding=encoding, newline='') as src, \
+                open(tmp_path, 'w', encoding='utf-8', newline='') as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.replace(tmp_path, target)
+        logger.info(f"Transcoded {os.path.basename(file_path)} from {encoding} to UTF-8")
+    tmp_path = f'{stamp_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'encoding': encoding, 'target': name}, f)
+    os.replace(tmp_path, stamp_path)
+    return target
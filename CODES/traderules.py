@@ -0,0 +1,81 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from artifacts import recode_category
+
+logger = logging.getLogger(__name__)
+
+# (substring of data_source, investment type); the first matching rule wins
+INVESTMENT_TYPE_RULES = [
+    ('JP', '日本株'),
+    ('US', '米国株'),
+    ('INVST', '投資信託'),
+    ('SaveFile', '日本株か投資信託'),
+    ('SBI', '日本株か投資信託'),
+    ('yakujo', '米国株'),
+]
+OTHER_INVESTMENT_TYPE = 'その他'
+
+# amount_jpy of rows whose currency has no rate source at all (e.g. 'Unknown'), as before
+UNCONVERTIBLE = -1.0
+
+
+def investment_type_of(data_source):
+    for pattern, investment_type in INVESTMENT_TYPE_RULES:
+        if pattern in data_source:
+            return investment_type
+    return OTHER_INVESTMENT_TYPE
+
+
+def classify_investment_type(data_source):
+    """Investment type per row, evaluated once per distinct data_source."""
+    values = data_source if isinstance(data_source.dtype, pd.CategoricalDtype) else data_source.astype('category')
+    mapping = {source: investment_type_of(str(source)) for source in values.cat.categories}
+    return recode_category(values, mapping, OTHER_INVESTMENT_TYPE)
+
+
+def convert_to_jpy(df, fx_rates=None):
+    """amount_jpy for every row, plus a diagnostics frame of the rows that could not be converted.
+
+    JPY rows use settlement_amount, or price * quantity when the settlement is 0.
+    Other currencies use price * quantity * rate, where the rate is the
+    ``<CUR>JPY`` column of ``df`` if present, else an as-of lookup in ``fx_rates``.
+    """
+    currency = df['currency'].astype(object)
+    gross = df['price'].to_numpy(dtype=np.float64) * df['quantity'].to_numpy(dtype=np.float64)
+    settlement = df['settlement_amount'].to_numpy(dtype=np.float64)
+
+    rate = np.full(len(df), np.nan)
+    has_rate_source = np.zeros(len(df), dtype=bool)
+    for cur in currency.dropna().unique():
+        if cur == 'JPY':
+            continue
+        rows = (currency == cur).to_numpy()
+        if f'{cur}JPY' in df.columns:
+            rate[rows] = df[f'{cur}JPY'].to_numpy(dtype=np.float64)[rows]
+        elif fx_rates is not None and {f'{cur}JPY', f'JPY{cur}'} & set(fx_rates.pairs):
+            rate[rows] = fx_rates.rate_to(currency[rows], df['trade_date'][rows])
+        else:
+            continue
+        has_rate_source[rows] = True
+
+    is_jpy = (currency == 'JPY').to_numpy()
+    amount = np.select(
+        [is_jpy & (settlement == 0) & (gross > 0), is_jpy, has_rate_source],
+        [gross, settlement, gross * rate],
+        default=UNCONVERTIBLE)
+
+    reason = np.select(
+        [~is_jpy & ~has_rate_source, has_rate_source & np.isnan(rate), np.isnan(amount)],
+        ['no FX rate source for currency', 'no FX rate on trade date', 'missing price/quantity/settlement'],
+        default='')
+    failed = reason != ''
+    columns = [c for c in ['trade_date', 'security_code', 'security_name', 'currency', 'quantity', 'price',
+                           'settlement_amount', 'data_source'] if c in df.columns]
+    diagnostics = df.loc[failed, columns].assign(reason=reason[failed])
+    if failed.any():
+        logger.warning(f"amount_jpy could not be computed for {failed.sum()} rows: "
+                       f"{diagnostics['reason'].value_counts().to_dict()}")
+    return pd.Series(amount, index=df.index), diagnostics